@@ -1,5 +1,10 @@
 from django.contrib import admin
 from .models import *
 # Register your models here.
-admin.site.register(UserBankAccount)
-admin.site.register(UserAddress)
\ No newline at end of file
+
+@admin.register(UserBankAccount)
+class UserBankAccountAdmin(admin.ModelAdmin):
+    # Balances only move through transactions.ledger.
+    readonly_fields = ['balance', 'ledger_sequence', 'active_loan_count']
+
+admin.site.register(UserAddress)
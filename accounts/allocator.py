@@ -0,0 +1,75 @@
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from .models import AccountNumberSequence
+
+SEQUENCE_NAME = 'account_no'
+
+
+def luhn_check_digit(number):
+    total = 0
+    for i, digit in enumerate(reversed(str(number))):
+        digit = int(digit)
+        if i % 2 == 0:  # every second digit from the right, starting with the last
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return (10 - total % 10) % 10
+
+
+def with_check_digit(number):
+    return number * 10 + luhn_check_digit(number)
+
+
+def is_valid_account_number(account_no):
+    return account_no >= 10 and with_check_digit(account_no // 10) == account_no
+
+
+class AccountNumberAllocator:
+    """
+    Hands out account numbers (with a Luhn check digit) from blocks
+    reserved in ``AccountNumberSequence``, so most registrations allocate
+    a number without touching the database.
+
+    A block reserved inside someone else's transaction could be rolled
+    back after its numbers were handed out, so in that case only the
+    numbers needed are reserved and nothing is cached. Allocate before
+    opening ``transaction.atomic()`` to get the cached path.
+    """
+    def __init__(self, name=SEQUENCE_NAME, block_size=None):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        if connection.in_atomic_block:
+            start = self._reserve(count)
+            return [with_check_digit(n) for n in range(start, start + count)]
+
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size or settings.ACCOUNT_NUMBER_BLOCK_SIZE, count - len(numbers))
+                    self._next = self._reserve(size)
+                    self._end = self._next + size
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+        return [with_check_digit(n) for n in numbers]
+
+    def _reserve(self, size):
+        # Returns the first number of a freshly reserved [start, start + size) range.
+        with transaction.atomic():
+            sequence = AccountNumberSequence.objects.select_for_update().get(name=self.name)
+            AccountNumberSequence.objects.filter(pk=sequence.pk).update(next_value=F('next_value') + size)
+        return sequence.next_value
+
+
+allocator = AccountNumberAllocator()
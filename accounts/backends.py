@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class AccountModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's bank account in the same query.
+
+    AuthenticationMiddleware caches the result on the request, so every
+    later ``request.user.account`` in views and templates is free.
+    """
+    def get_queryset(self):
+        return UserModel._default_manager.select_related('account')
+
+    def get_user(self, user_id):
+        try:
+            user = self.get_queryset().get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await self.get_queryset().aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
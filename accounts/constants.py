@@ -12,3 +12,15 @@ GENDER = (
     ("Male", "Male"),
     ('Female', "Female"),
 )
+
+# How transaction emails reach the customer: one per operation, or
+# collected into an hourly or daily digest by `send_digests`.
+NOTIFY_IMMEDIATE = 'immediate'
+NOTIFY_HOURLY = 'hourly'
+NOTIFY_DAILY = 'daily'
+
+NOTIFICATION_FREQUENCY = (
+    (NOTIFY_IMMEDIATE, 'Immediately'),
+    (NOTIFY_HOURLY, 'Hourly digest'),
+    (NOTIFY_DAILY, 'Daily digest'),
+)
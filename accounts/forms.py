@@ -3,6 +3,8 @@ from django import forms
 from .constants import *
 from django.contrib.auth.models import User
 from .models import *
+from .allocator import allocator
+from django.db import transaction
 
 class UserRegistrationForm(UserCreationForm):
     birth_date = forms.DateField(widget=forms.DateInput(attrs={'type' : 'date'}))
@@ -20,7 +22,9 @@ class UserRegistrationForm(UserCreationForm):
     def save(self, commit=True):
         user = super().save(commit=False)
         if commit==True:
-            user.save()
+            # Allocated before the transaction so it normally comes from the
+            # allocator's in-memory block; then three INSERTs, all or nothing.
+            account_no = allocator.allocate()
             account_type = self.cleaned_data.get('account_type')
             birth_date = self.cleaned_data.get('birth_date')
             gender = self.cleaned_data.get('gender')
@@ -29,21 +33,24 @@ class UserRegistrationForm(UserCreationForm):
             city = self.cleaned_data.get('city')
             street_address = self.cleaned_data.get('street_address')
 
-            UserAddress.objects.create(
-                user = user,
-                post_code = post_code,
-                country = country,
-                city = city,
-                street_address = street_address
-            )
-
-            UserBankAccount.objects.create(
-                user = user,
-                account_type = account_type,
-                gender = gender,
-                birth_date = birth_date,
-                account_no = 100000 + user.id
-            )
+            with transaction.atomic():
+                user.save()
+
+                UserAddress.objects.create(
+                    user = user,
+                    post_code = post_code,
+                    country = country,
+                    city = city,
+                    street_address = street_address
+                )
+
+                UserBankAccount.objects.create(
+                    user = user,
+                    account_type = account_type,
+                    gender = gender,
+                    birth_date = birth_date,
+                    account_no = account_no
+                )
         return user
 
     def __init__(self, *args, **kwargs):
@@ -68,6 +75,7 @@ class UserUpdateForm(forms.ModelForm):
     city = forms.CharField(max_length=50)
     post_code = forms.IntegerField()
     country = forms.CharField(max_length=50)
+    notification_frequency = forms.ChoiceField(choices=NOTIFICATION_FREQUENCY, label='Transaction emails')
 
     class Meta:
         model = User
@@ -86,24 +94,29 @@ class UserUpdateForm(forms.ModelForm):
                 )
             })
 
-            if self.instance:
-                try:
-                    user_account = self.instance.account
-                    user_address = self.instance.address
-                except:
-                    user_account = None
-                    user_address = None
-            
-            if user_account:
-                self.fields['account_type'].initial = user_account.account_type
-                self.fields['gender'].initial = user_account.gender
-                self.fields['birth_date'].initial = user_account.birth_date
-
-            if user_address:
-                self.fields['street_address'].initial = user_address.street_address
-                self.fields['city'].initial = user_address.city
-                self.fields['post_code'].initial = user_address.post_code
-                self.fields['country'].initial = user_address.country
+        # Look the related rows up once, not once per field.
+        user_account = user_address = None
+        if self.instance.pk:
+            try:
+                user_account = self.instance.account
+            except UserBankAccount.DoesNotExist:
+                pass
+            try:
+                user_address = self.instance.address
+            except UserAddress.DoesNotExist:
+                pass
+
+        if user_account:
+            self.fields['account_type'].initial = user_account.account_type
+            self.fields['gender'].initial = user_account.gender
+            self.fields['birth_date'].initial = user_account.birth_date
+            self.fields['notification_frequency'].initial = user_account.notification_frequency
+
+        if user_address:
+            self.fields['street_address'].initial = user_address.street_address
+            self.fields['city'].initial = user_address.city
+            self.fields['post_code'].initial = user_address.post_code
+            self.fields['country'].initial = user_address.country
     
     def save(self, commit=True):
         user = super().save(commit=False)
@@ -115,7 +128,9 @@ class UserUpdateForm(forms.ModelForm):
             user_account.account_type = self.cleaned_data['account_type']
             user_account.gender = self.cleaned_data['gender']
             user_account.birth_date = self.cleaned_data['birth_date']
-            user_account.save()
+            user_account.notification_frequency = self.cleaned_data['notification_frequency']
+            # Never write the balance back from here; the ledger owns it.
+            user_account.save(update_fields=['account_type', 'gender', 'birth_date', 'notification_frequency'])
 
             
             user_address, _ = UserAddress.objects.get_or_create(user=user)
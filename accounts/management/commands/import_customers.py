@@ -0,0 +1,218 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from accounts.allocator import allocator
+from accounts.constants import ACCOUNT_TYPE, GENDER
+from accounts.models import UserAddress, UserBankAccount
+from transactions.constants import DEPOSIT
+from transactions.ledger import PostingRow, bulk_post
+from transactions.emails import email_context, outbox_email
+from transactions.models import EmailOutbox
+
+ACCOUNT_TYPES = {value for value, _ in ACCOUNT_TYPE}
+GENDERS = {value for value, _ in GENDER}
+
+
+def _init_worker():
+    # Spawned (non-fork) workers need Django set up before hashing.
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        'Import existing customers from a CSV or JSONL file in chunks. '
+        'Customers whose username already exists are skipped, so an '
+        'interrupted import can simply be re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+        parser.add_argument(
+            '--unusable-passwords', action='store_true',
+            help="Ignore any password column and make customers set one through password reset",
+        )
+        parser.add_argument(
+            '--invite-url', metavar='URL',
+            help='Queue a set-your-password email for customers without a password, e.g. https://bank.example.com',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('jsonl' if options['file'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.options = options
+        self.counts = {'imported' : 0, 'skipped' : 0, 'invalid' : 0}
+        started = time.perf_counter()
+
+        try:
+            source = open(options['file'], newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with source, ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            self.pool = pool
+            records = self.read_csv(source) if file_format == 'csv' else self.read_jsonl(source)
+            while True:
+                chunk = list(islice(records, options['chunk_size']))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+                elapsed = time.perf_counter() - started
+                self.stderr.write(
+                    f"{self.counts['imported']} imported, {self.counts['skipped']} skipped "
+                    f"({self.counts['imported'] / elapsed:.0f} customers/sec)"
+                )
+
+        elapsed = time.perf_counter() - started
+        rate = self.counts['imported'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.counts['imported']} customers in {elapsed:.2f}s ({rate:.0f}/sec), "
+            f"{self.counts['skipped']} already present, {self.counts['invalid']} invalid"
+        ))
+
+    def read_csv(self, source):
+        for line, record in enumerate(csv.DictReader(source), start=2):
+            yield from self.clean(line, record)
+
+    def read_jsonl(self, source):
+        for line, text in enumerate(source, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                self.invalid(line, 'not valid JSON')
+                continue
+            yield from self.clean(line, record)
+
+    def invalid(self, line, reason):
+        self.counts['invalid'] += 1
+        self.stderr.write(f'Line {line}: {reason}')
+
+    def clean(self, line, record):
+        try:
+            customer = {
+                'username' : record['username'].strip(),
+                'email' : (record.get('email') or '').strip(),
+                'first_name' : (record.get('first_name') or '').strip(),
+                'last_name' : (record.get('last_name') or '').strip(),
+                'password' : None if self.options['unusable_passwords'] else (record.get('password') or None),
+                'account_type' : record['account_type'],
+                'gender' : record['gender'],
+                'birth_date' : date.fromisoformat(record['birth_date']) if record.get('birth_date') else None,
+                'street_address' : record['street_address'],
+                'city' : record['city'],
+                'post_code' : int(record['post_code']),
+                'country' : record['country'],
+                'opening_balance' : Decimal(str(record.get('opening_balance') or 0)),
+            }
+        except (KeyError, AttributeError, ValueError, InvalidOperation) as exc:
+            self.invalid(line, f'bad or missing field {exc}')
+            return
+        if not customer['username']:
+            self.invalid(line, 'username is required')
+        elif customer['account_type'] not in ACCOUNT_TYPES:
+            self.invalid(line, f"unknown account_type {customer['account_type']!r}")
+        elif customer['gender'] not in GENDERS:
+            self.invalid(line, f"unknown gender {customer['gender']!r}")
+        elif customer['opening_balance'] < 0:
+            self.invalid(line, 'opening_balance must not be negative')
+        else:
+            yield customer
+
+    def import_chunk(self, chunk):
+        existing = set(User.objects.filter(username__in=[c['username'] for c in chunk]).values_list('username', flat=True))
+        new, seen = [], set()
+        for customer in chunk:
+            if customer['username'] in existing or customer['username'] in seen:
+                self.counts['skipped'] += 1
+            else:
+                seen.add(customer['username'])
+                new.append(customer)
+        if not new:
+            return
+
+        # PBKDF2 is deliberately slow: hash in parallel worker processes.
+        with_password = [c for c in new if c['password']]
+        hashes = dict(zip(
+            (c['username'] for c in with_password),
+            self.pool.map(make_password, [c['password'] for c in with_password], chunksize=16),
+        ))
+        unusable = make_password(None)
+        # Reserved before the transaction so the allocator can use its cache.
+        account_numbers = allocator.allocate_many(len(new))
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username = c['username'],
+                    email = c['email'],
+                    first_name = c['first_name'],
+                    last_name = c['last_name'],
+                    password = hashes.get(c['username'], unusable),
+                )
+                for c in new
+            ])
+            UserAddress.objects.bulk_create([
+                UserAddress(
+                    user = user,
+                    street_address = c['street_address'],
+                    city = c['city'],
+                    post_code = c['post_code'],
+                    country = c['country'],
+                )
+                for user, c in zip(users, new)
+            ])
+            accounts = UserBankAccount.objects.bulk_create([
+                UserBankAccount(
+                    user = user,
+                    account_type = c['account_type'],
+                    gender = c['gender'],
+                    birth_date = c['birth_date'],
+                    account_no = account_no,
+                )
+                for user, c, account_no in zip(users, new, account_numbers)
+            ])
+            # Opening balances go through the ledger like any other deposit.
+            bulk_post(
+                PostingRow(account.account_no, c['opening_balance'], DEPOSIT)
+                for account, c in zip(accounts, new) if c['opening_balance'] > 0
+            )
+            if self.options['invite_url']:
+                self.queue_invites((user, account) for user, account, c in zip(users, accounts, new) if c['username'] not in hashes)
+
+        self.counts['imported'] += len(new)
+
+    def queue_invites(self, customers):
+        base_url = self.options['invite_url'].rstrip('/')
+        emails = []
+        for user, account in customers:
+            if not user.email:
+                continue
+            path = reverse('password_reset_confirm', kwargs={
+                'uidb64' : urlsafe_base64_encode(force_bytes(user.pk)),
+                'token' : default_token_generator.make_token(user),
+            })
+            emails.append(outbox_email(
+                user.email,
+                'Set up your online banking password',
+                'accounts/welcome_email.html',
+                email_context(user, account=account, reset_url=base_url + path),
+            ))
+        EmailOutbox.objects.bulk_create(emails)
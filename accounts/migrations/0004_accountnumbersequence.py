@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+# New numbers are 1000000 onwards plus a check digit (8+ digits), clear of
+# the legacy 100000 + user.id numbers.
+FIRST_ACCOUNT_NUMBER = 1000000
+
+
+def create_sequence(apps, schema_editor):
+    AccountNumberSequence = apps.get_model('accounts', 'AccountNumberSequence')
+    AccountNumberSequence.objects.create(name='account_no', next_value=FIRST_ACCOUNT_NUMBER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_useraddress_post_code_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(create_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_accountnumbersequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='active_loan_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_userbankaccount_notification_frequency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='ledger_sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
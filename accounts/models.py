@@ -11,6 +11,11 @@ class UserBankAccount(models.Model):
     gender = models.CharField(max_length=10, choices=GENDER)
     initial_deposite_date = models.DateField(auto_now_add=True)
     balance = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    # Approved, unpaid loans; kept current by transactions.loans.
+    active_loan_count = models.PositiveSmallIntegerField(default=0)
+    # Sequence number of the latest transactions.LedgerEntry; moved with the balance.
+    ledger_sequence = models.PositiveIntegerField(default=0)
+    notification_frequency = models.CharField(max_length=10, choices=NOTIFICATION_FREQUENCY, default=NOTIFY_IMMEDIATE)
 
     def __str__(self):
         return f"{self.user.username} - {self.account_no}"
@@ -23,4 +28,13 @@ class UserAddress(models.Model):
     country = models.CharField(max_length=50)
 
     def __str__(self):
-        return f"{self.user.username} - {self.street_address}"
\ No newline at end of file
+        return f"{self.user.username} - {self.street_address}"
+
+class AccountNumberSequence(models.Model):
+    # Hi/lo counter behind accounts.allocator; each process reserves a
+    # block of numbers from it at a time.
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name} - {self.next_value}"
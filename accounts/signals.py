@@ -0,0 +1,13 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from core.ratelimit import ACCOUNT_SESSION_KEY
+from .models import UserBankAccount
+
+
+@receiver(user_logged_in)
+def remember_account(sender, request, user, **kwargs):
+    # Lets per-account rate limits find the account without a query.
+    try:
+        request.session[ACCOUNT_SESSION_KEY] = user.account.pk
+    except UserBankAccount.DoesNotExist:
+        pass
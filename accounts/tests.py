@@ -1,3 +1,99 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.http import HttpRequest
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from .allocator import AccountNumberAllocator, is_valid_account_number, luhn_check_digit
+from .models import AccountNumberSequence
+from transactions.constants import DEPOSIT
+from transactions.models import EmailOutbox
 
 # Create your tests here.
+
+class AccountNumberAllocatorTests(TransactionTestCase):
+    def setUp(self):
+        AccountNumberSequence.objects.get_or_create(name='test', defaults={'next_value': 1000000})
+
+    def test_luhn_check_digit(self):
+        self.assertEqual(luhn_check_digit(7992739871), 3)
+        self.assertTrue(is_valid_account_number(79927398713))
+        self.assertFalse(is_valid_account_number(79927398710))
+
+    def test_blocks_are_reserved_once_and_never_overlap(self):
+        first = AccountNumberAllocator('test', block_size=10)
+        second = AccountNumberAllocator('test', block_size=10)
+
+        numbers = [first.allocate() for _ in range(10)]
+        # One block of 10 reserved for all ten numbers.
+        self.assertEqual(AccountNumberSequence.objects.get(name='test').next_value, 1000010)
+        numbers += second.allocate_many(25)
+
+        self.assertEqual(len(set(numbers)), 35)
+        self.assertTrue(all(is_valid_account_number(n) for n in numbers))
+        self.assertEqual(AccountNumberSequence.objects.get(name='test').next_value, 1000035)
+
+
+class UserRegistrationTests(TestCase):
+    def test_registration_creates_user_address_and_account(self):
+        data = {
+            'username': 'newcustomer', 'email': 'new@example.com', 'first_name': 'New', 'last_name': 'Customer',
+            'password1': 'Sup3r-secret-pass', 'password2': 'Sup3r-secret-pass',
+            'account_type': 'saving', 'birth_date': '1990-01-01', 'gender': 'Female',
+            'post_code': '1207', 'street_address': 'Road 1', 'city': 'Dhaka', 'country': 'Bangladesh',
+        }
+        response = self.client.post(reverse('register'), data)
+
+        self.assertRedirects(response, reverse('profile_update'), fetch_redirect_response=False)
+        user = User.objects.get(username='newcustomer')
+        self.assertTrue(is_valid_account_number(user.account.account_no))
+        self.assertGreaterEqual(user.account.account_no, 10000000)
+        self.assertEqual(user.address.city, 'Dhaka')
+        self.assertEqual(self.client.session['_auth_user_backend'], 'accounts.backends.AccountModelBackend')
+
+    def test_sessions_from_model_backend_still_resolve(self):
+        user = User.objects.create_user(username='oldsession', password='pass12345')
+        self.client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+        request = HttpRequest()
+        request.session = self.client.session
+        self.assertEqual(get_user(request), user)
+
+
+class ImportCustomersTests(TestCase):
+    def import_file(self, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as source:
+            source.write(content)
+        self.addCleanup(os.unlink, source.name)
+        call_command('import_customers', source.name, '--workers', '1', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_import_posts_opening_balances_and_is_resumable(self):
+        base = {
+            'account_type' : 'saving', 'gender' : 'Female', 'street_address' : '1 Road',
+            'city' : 'Dhaka', 'post_code' : '1200', 'country' : 'BD',
+        }
+        rows = [
+            dict(base, username='alice', email='alice@example.com', password='s3cret-pass', opening_balance='250.00'),
+            dict(base, username='bob', email='bob@example.com'),
+            dict(base, username='carol', gender='Unknown'),
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows)
+
+        self.import_file(content, '--invite-url', 'https://bank.example.com')
+        self.import_file(content, '--invite-url', 'https://bank.example.com')
+
+        alice = User.objects.get(username='alice')
+        bob = User.objects.get(username='bob')
+        self.assertFalse(User.objects.filter(username='carol').exists())
+        self.assertTrue(alice.check_password('s3cret-pass'))
+        self.assertFalse(bob.has_usable_password())
+        self.assertTrue(is_valid_account_number(alice.account.account_no))
+        self.assertEqual(alice.account.balance, Decimal('250.00'))
+        self.assertEqual(alice.account.transactions.get().transaction_type, DEPOSIT)
+        self.assertEqual(bob.account.balance, 0)
+        # Only bob needs to set a password, and only once despite the re-run.
+        self.assertEqual(list(EmailOutbox.objects.values_list('to_email', flat=True)), ['bob@example.com'])
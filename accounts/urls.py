@@ -1,4 +1,5 @@
 from django.urls import path
+from django.contrib.auth import views as auth_views
 from .views import *
 
 urlpatterns = [
@@ -7,4 +8,9 @@ urlpatterns = [
     path('logout/', user_logout, name='logout'),
     path('profile_update/', UserUpdateView.as_view(), name='profile_update'),
     path('change_password/', ChangePassword.as_view(), name='change_password'),
+    # Password reset, also how imported customers set their first password.
+    path('password_reset/', auth_views.PasswordResetView.as_view(), name='password_reset'),
+    path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
+    path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
+    path('reset/done/', auth_views.PasswordResetCompleteView.as_view(), name='password_reset_complete'),
 ]
\ No newline at end of file
@@ -9,6 +9,7 @@ from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from transactions.views import send_transaction_email
 from django.contrib import messages
+from django.conf import settings
 
 
 # Create your views here.
@@ -20,7 +21,7 @@ class UserRegistrationView(FormView):
     def form_valid(self, form):
         print(form.cleaned_data)
         user = form.save()
-        login(self.request, user)
+        login(self.request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
         print(user)
         return super().form_valid(form)
     
@@ -71,6 +72,6 @@ class ChangePassword(LoginRequiredMixin, View):
         if form.is_valid():
             form.save()
             messages.success(request, 'Password has been successfully changed')
-            send_transaction_email(request.user, 0, 'Password Change Confirmation', 'accounts/password_email.html')
+            send_transaction_email(request.user, 0, 'Password Change Confirmation', 'accounts/password_email.html', digest=False)
             return redirect('profile_update')
         return render(request, self.template_name, {'form' : form})
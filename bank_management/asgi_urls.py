@@ -0,0 +1,19 @@
+"""
+URL configuration used by the ASGI deployment (see ``ASYNC_VIEWS``).
+
+Same routes and names as ``bank_management.urls``, but the busiest views
+are swapped for their async versions. Patterns listed first win, so
+everything else falls through to the regular sync views.
+"""
+from django.urls import path
+from core.views import AsyncHomeView
+from transactions import views as transaction_views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('', AsyncHomeView.as_view(), name='home'),
+    path('transactions/deposite/', transaction_views.AsyncDepositeView.as_view(), name='deposite'),
+    path('transactions/withdraw/', transaction_views.AsyncWithdrawMoney.as_view(), name='withdraw'),
+    path('transactions/report/', transaction_views.AsyncTransactionReportView.as_view(), name='report'),
+    path('transactions/transfer_money', transaction_views.AsyncTransferMoneyView.as_view(), name='transfer_money'),
+] + sync_urlpatterns
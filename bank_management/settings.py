@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import environ
+from .database import database_config
 env = environ.Env()
 environ.Env.read_env() 
 
@@ -28,7 +29,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = env("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env.bool("DEBUG", default=True)
 
 
 ALLOWED_HOSTS = [".vercel.app", '127.0.0.1']
@@ -55,22 +56,36 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    'core.middleware.QueryInstrumentationMiddleware',
+    'core.middleware.ReadReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'bank_management.urls'
+# asgi.py turns this on so the ASGI deployment serves the async views.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+ROOT_URLCONF = 'bank_management.asgi_urls' if ASYNC_VIEWS else 'bank_management.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are compiled once per process and kept in memory, so
+            # pages and emails never re-parse a file. runserver clears the
+            # cache when a template changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -94,17 +109,33 @@ WSGI_APPLICATION = 'bank_management.wsgi.app'
 #     }
 # }
 
+# Configured from DATABASE_URL (required) and the DB_* variables, see
+# bank_management/database.py.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',
-        'USER': 'postgres.yifcnwkacpiuqnalafaz',
-        'PASSWORD': 'BrJDzgGJVEzxZ9c2',
-        'HOST': 'aws-0-ap-southeast-1.pooler.supabase.com',
-        'PORT': '6543'
-    }
+    'default': database_config(env),
 }
 
+# An optional read replica for the reporting views and commands, see
+# core/db_router.py. Tests read it from the default test database.
+if env("DATABASE_REPLICA_URL", default=None):
+    DATABASES['replica'] = database_config(env, url_var="DATABASE_REPLICA_URL")
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# GET requests to these views (by URL name) read from the replica...
+REPLICA_READ_VIEWS = [
+    'report',
+    'loan_list',
+    'statement_export',
+    'admin:transactions_transaction_changelist',
+    'admin:transactions_loan_changelist',
+    'admin:transactions_emailoutbox_changelist',
+]
+# ...unless the client wrote something in the last REPLICA_PIN_SECONDS.
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", default=10)
+REPLICA_PIN_COOKIE = 'pin_primary'
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -125,6 +156,23 @@ DATABASES = {
 # }
 
 
+# The user and their bank account are loaded in one joined query.
+# ModelBackend stays listed so sessions it logged in still resolve.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.AccountModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Sessions are in the database by default. Set SESSION_ENGINE to
+# django.contrib.sessions.backends.signed_cookies (no server-side storage)
+# or .cache / .cached_db with CACHE_URL pointing at a shared cache
+# (e.g. rediscache://...) so requests don't spend a query on the session.
+SESSION_ENGINE = env("SESSION_ENGINE", default='django.contrib.sessions.backends.db')
+CACHES = {
+    'default': env.cache("CACHE_URL", default='locmemcache://'),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -173,4 +221,120 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = env("EMAIL")
-EMAIL_HOST_PASSWORD = env("PASSWORD")
\ No newline at end of file
+EMAIL_HOST_PASSWORD = env("PASSWORD")
+
+# Transaction emails are queued in transactions.EmailOutbox and delivered by
+# `python manage.py send_outbox_emails --loop`.
+EMAIL_OUTBOX_BATCH_SIZE = env.int("EMAIL_OUTBOX_BATCH_SIZE", default=100)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int("EMAIL_OUTBOX_MAX_ATTEMPTS", default=5)
+EMAIL_OUTBOX_RETRY_DELAY = env.int("EMAIL_OUTBOX_RETRY_DELAY", default=60)
+
+# Transactions shown per page on the report (keyset paginated).
+REPORT_PAGE_SIZE = env.int("REPORT_PAGE_SIZE", default=50)
+REPORT_MAX_PAGE_SIZE = 500
+
+# Rows fetched per round-trip when streaming statement exports.
+STATEMENT_EXPORT_CHUNK_SIZE = env.int("STATEMENT_EXPORT_CHUNK_SIZE", default=2000)
+
+# Months of transactions kept in the database; `python manage.py
+# archive_transactions` moves older ones to gzipped NDJSON files here, where
+# the statement export still finds them. See transactions/archive.py.
+TRANSACTION_RETENTION_MONTHS = env.int("TRANSACTION_RETENTION_MONTHS", default=24)
+TRANSACTION_ARCHIVE_DIR = env("TRANSACTION_ARCHIVE_DIR", default=str(BASE_DIR / 'archive'))
+
+# How long the BankSettings bankruptcy flag is cached per process, and
+# whether it is also shared through Django's cache framework.
+BANK_SETTINGS_CACHE_TTL = env.int("BANK_SETTINGS_CACHE_TTL", default=5)
+BANK_SETTINGS_USE_CACHE = env.bool("BANK_SETTINGS_USE_CACHE", default=False)
+
+# Per-request query count / DB time / repeated-query stats, exposed as
+# X-DB-* response headers and logged to "core.queries". TemplateResponse
+# render time is added as X-Template-Time-Ms.
+QUERY_INSTRUMENTATION = env.bool("QUERY_INSTRUMENTATION", default=DEBUG)
+
+# Maximum queries per view (by URL name). Exceeding one logs a warning and
+# fails core.testing.QueryBudgetMixin.assertQueryBudget in the tests.
+QUERY_BUDGETS = {
+    'home': 2,
+    'report': 5,
+    'statement_export': 3,
+    'loan_list': 3,
+    'deposite': 16,
+    'withdraw': 16,
+    'loan_request': 8,
+    'transfer_money': 21,
+    'profile_update': 3,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.queries': {
+            'handlers': ['console'],
+            # DEBUG logs every request, the default only budget overruns.
+            'level': env("QUERY_LOG_LEVEL", default='INFO'),
+        },
+    },
+}
+
+# Account numbers reserved per round-trip by accounts.allocator.
+ACCOUNT_NUMBER_BLOCK_SIZE = env.int("ACCOUNT_NUMBER_BLOCK_SIZE", default=100)
+
+# How long a deposite/withdraw/transfer outcome is kept for replay when a
+# client retries the POST with the same idempotency key.
+IDEMPOTENCY_KEY_TTL = env.int("IDEMPOTENCY_KEY_TTL", default=24 * 60 * 60)
+
+# Annual interest rate by account type, credited monthly on daily balances
+# by `python manage.py accrue_interest` (see transactions/interest.py).
+# Types not listed earn nothing. At most 6 decimal places.
+INTEREST_RATES = {
+    'saving': '0.035',
+    'retirement': '0.05',
+    'student': '0.02',
+}
+
+# Transfer fraud scoring, see transactions/velocity.py. Every rule that
+# fires adds its score and transfers reaching FRAUD_BLOCK_SCORE are
+# refused. The per-account counters live in the cache ('cache') or in
+# each process ('memory'); `python manage.py rebuild_velocity` refills them.
+FRAUD_RULES = [
+    {'rule': 'outgoing_total', 'window': '1h', 'limit': 1000000, 'score': 40},
+    {'rule': 'outgoing_total', 'window': '1d', 'limit': 2000000, 'score': 40},
+    {'rule': 'new_receivers', 'window': '1d', 'limit': 5, 'score': 40},
+    {'rule': 'unusual_amount', 'factor': 10, 'min_history': 5, 'score': 30},
+]
+FRAUD_BLOCK_SCORE = env.int("FRAUD_BLOCK_SCORE", default=70)
+VELOCITY_BACKEND = env("VELOCITY_BACKEND", default='cache')
+VELOCITY_STATE_TTL = env.int("VELOCITY_STATE_TTL", default=30 * 24 * 60 * 60)
+
+# Throttling by URL name, applied by core.middleware.RateLimitMiddleware.
+# See core/ratelimit.py for the rule format. The memory backend counts per
+# process; 'cache' shares the counts through the default cache.
+RATE_LIMIT_ENABLED = env.bool("RATE_LIMIT_ENABLED", default=True)
+RATE_LIMIT_BACKEND = env("RATE_LIMIT_BACKEND", default='memory')
+# Where the client IP comes from, e.g. HTTP_X_FORWARDED_FOR behind a proxy.
+RATE_LIMIT_IP_META = env("RATE_LIMIT_IP_META", default='REMOTE_ADDR')
+# How many proxies append to that header. The client IP is the entry the
+# outermost one added; anything to the left of it is client supplied.
+RATE_LIMIT_PROXY_COUNT = env.int("RATE_LIMIT_PROXY_COUNT", default=1)
+RATE_LIMITS = {
+    'login': [
+        {'key': 'ip', 'rate': '10/m'},
+    ],
+    'deposite': [
+        {'key': 'user', 'rate': '20/m', 'algorithm': 'token_bucket', 'burst': 5},
+        {'key': 'ip', 'rate': '120/m'},
+    ],
+    'withdraw': [
+        {'key': 'user', 'rate': '20/m', 'algorithm': 'token_bucket', 'burst': 5},
+        {'key': 'ip', 'rate': '120/m'},
+    ],
+    'transfer_money': [
+        {'key': 'account', 'rate': '10/m', 'algorithm': 'token_bucket', 'burst': 3},
+        {'key': 'ip', 'rate': '120/m'},
+    ],
+}
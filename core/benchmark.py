@@ -0,0 +1,319 @@
+"""
+Helpers behind ``manage.py benchmark``: seed a database with users,
+accounts and history, then drive the money-movement endpoints with
+concurrent clients and summarise latency percentiles and throughput.
+
+Endpoints can be driven through the WSGI handler (threads, one request
+per thread at a time) or the ASGI handler (coroutines on one event loop,
+with ``bank_management.asgi_urls`` serving the async views). Both run in
+process through Django's test clients: there is no server, socket or HTTP
+parsing, so the figures compare the handlers, middleware and views, not
+uvicorn against gunicorn.
+
+``manage.py benchmark_connections`` uses run_connection_mode() to compare
+what connection setup costs each request under the database settings in
+``CONNECTION_MODES``, and ``manage.py benchmark_interest`` times the
+month-end interest calculation with run_interest_accrual().
+"""
+import asyncio
+import copy
+import random
+import statistics
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.db.utils import load_backend
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from accounts.models import UserBankAccount
+from transactions import interest
+from transactions.constants import DEPOSIT, WITHDRAWAL
+from transactions.models import Transaction
+
+USERNAME_PREFIX = 'bench_user_'
+
+Endpoint = namedtuple('Endpoint', ['name', 'method', 'url_name', 'data'])
+
+ENDPOINTS = {
+    'deposite' : Endpoint('deposite', 'post', 'deposite', lambda accounts: {'amount' : '500'}),
+    'withdraw' : Endpoint('withdraw', 'post', 'withdraw', lambda accounts: {'amount' : '500'}),
+    'transfer_money' : Endpoint('transfer_money', 'post', 'transfer_money', lambda accounts: {
+        'account_no' : random.choice(accounts).account_no, 'amount' : '500',
+    }),
+    'report' : Endpoint('report', 'get', 'report', None),
+    'home' : Endpoint('home', 'get', 'home', None),
+    'loan_list' : Endpoint('loan_list', 'get', 'loan_list', None),
+}
+
+
+def seed(users, transactions_per_user, opening_balance=Decimal('1000000')):
+    """Create ``users`` users with accounts and history, in bulk."""
+    password = make_password('bench-password')
+    User.objects.bulk_create(
+        [User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password) for i in range(users)],
+        batch_size=1000,
+    )
+    created = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk'))
+    UserBankAccount.objects.bulk_create(
+        [
+            UserBankAccount(user=user, account_type='saving', gender='Male', account_no=900000000 + user.pk, balance=opening_balance)
+            for user in created
+        ],
+        batch_size=1000,
+    )
+    accounts = list(UserBankAccount.objects.filter(user__in=created).select_related('user'))
+    history = []
+    for account in accounts:
+        for i in range(transactions_per_user):
+            history.append(Transaction(
+                account = account,
+                amount = Decimal('500'),
+                transaction_type = DEPOSIT if i % 2 == 0 else WITHDRAWAL,
+                balance_after_transaction = opening_balance,
+            ))
+        if len(history) >= 5000:
+            Transaction.objects.bulk_create(history)
+            history = []
+    Transaction.objects.bulk_create(history)
+    return accounts
+
+
+# Settings layered over DATABASES['default'] for each connection mode.
+CONNECTION_MODES = {
+    'per_request' : {'CONN_MAX_AGE' : 0, 'CONN_HEALTH_CHECKS' : False},
+    'persistent' : {'CONN_MAX_AGE' : 600, 'CONN_HEALTH_CHECKS' : False},
+    'persistent_health_checks' : {'CONN_MAX_AGE' : 600, 'CONN_HEALTH_CHECKS' : True},
+    'pool' : {'CONN_MAX_AGE' : 0, 'CONN_HEALTH_CHECKS' : False, 'OPTIONS' : {'pool' : {'min_size' : 1, 'max_size' : 16}}},
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarise(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests' : len(latencies),
+        'errors' : errors,
+        'elapsed_s' : round(elapsed, 3),
+        'throughput_rps' : round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms' : {
+            'mean' : round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            'p50' : round(percentile(latencies, 50) * 1000, 3),
+            'p90' : round(percentile(latencies, 90) * 1000, 3),
+            'p95' : round(percentile(latencies, 95) * 1000, 3),
+            'p99' : round(percentile(latencies, 99) * 1000, 3),
+            'max' : round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+
+def run_endpoint(endpoint, accounts, requests, clients):
+    """
+    Fire ``requests`` requests at ``endpoint`` from ``clients`` concurrent
+    clients, each logged in as a different seeded user.
+    """
+    url = reverse(endpoint.url_name)
+    per_client = split_requests(requests, clients)
+
+    def worker(index):
+        account, others = client_accounts(accounts, index)
+        client = Client()
+        client.force_login(account.user)
+        latencies, errors = [], 0
+        try:
+            for _ in range(per_client[index]):
+                data = endpoint.data(others) if endpoint.data else None
+                start = time.perf_counter()
+                response = getattr(client, endpoint.method)(url, data)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+        finally:
+            if clients > 1:
+                connection.close()
+        return latencies, errors
+
+    start = time.perf_counter()
+    if clients == 1:
+        results = [worker(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(worker, range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result[0]]
+    return summarise(latencies, sum(result[1] for result in results), elapsed)
+
+
+def run_endpoint_async(endpoint, accounts, requests, clients):
+    """
+    Like run_endpoint(), but each client is a coroutine sending requests
+    through the ASGI handler (AsyncClient, in process), all on one event
+    loop.
+    """
+    url = reverse(endpoint.url_name)
+    per_client = split_requests(requests, clients)
+
+    async def worker(index):
+        account, others = client_accounts(accounts, index)
+        # Like the ASGI handler does per request, so each client's sync
+        # work (and database connection) gets a thread of its own.
+        async with ThreadSensitiveContext():
+            client = AsyncClient()
+            await client.aforce_login(account.user)
+            latencies, errors = [], 0
+            try:
+                for _ in range(per_client[index]):
+                    data = endpoint.data(others) if endpoint.data else None
+                    start = time.perf_counter()
+                    response = await getattr(client, endpoint.method)(url, data)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors += 1
+            finally:
+                if clients > 1:
+                    await sync_to_async(close_connection)()
+        return latencies, errors
+
+    async def run_all():
+        return await asyncio.gather(*(worker(index) for index in range(clients)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result[0]]
+    return summarise(latencies, sum(result[1] for result in results), elapsed)
+
+
+def run_connection_mode(mode, requests, clients, query='SELECT 1'):
+    """
+    Time ``requests`` simulated requests that each run ``query``, from
+    ``clients`` threads, with the settings of ``CONNECTION_MODES[mode]``.
+    Each request closes old connections on start and finish, as Django's
+    request_started / request_finished handlers do, so the timings include
+    whatever connecting, health checking or pool checkout the mode costs.
+    """
+    settings_dict = copy.deepcopy(connection.settings_dict)
+    overrides = copy.deepcopy(CONNECTION_MODES[mode])
+    settings_dict['OPTIONS'].update(overrides.pop('OPTIONS', {}))
+    settings_dict.update(overrides)
+    backend = load_backend(settings_dict['ENGINE'])
+    alias = f'benchmark_{mode}'
+    per_client = split_requests(requests, clients)
+
+    def worker(index):
+        wrapper = backend.DatabaseWrapper(settings_dict, alias)
+        latencies, errors = [], 0
+        try:
+            for _ in range(per_client[index]):
+                start = time.perf_counter()
+                wrapper.close_if_unusable_or_obsolete()
+                try:
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(query)
+                        cursor.fetchall()
+                except DatabaseError:
+                    errors += 1
+                wrapper.close_if_unusable_or_obsolete()
+                latencies.append(time.perf_counter() - start)
+        finally:
+            wrapper.close()
+        return latencies, errors
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(worker, range(clients)))
+    finally:
+        if 'pool' in settings_dict['OPTIONS']:
+            backend.DatabaseWrapper(settings_dict, alias).close_pool()
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result[0]]
+    return summarise(latencies, sum(result[1] for result in results), elapsed)
+
+
+def interest_inputs(accounts, days, activity_days, rng):
+    # Synthetic transactions.interest.month_balances() output: random
+    # balances in cents and `activity_days` snapshot days per account.
+    openings = [rng.randrange(10 ** 8) for _ in range(accounts)]
+    closings = ([], [], [])
+    for row in range(accounts):
+        for day in sorted(rng.sample(range(days), activity_days)):
+            closings[0].append(row)
+            closings[1].append(day)
+            closings[2].append(rng.randrange(10 ** 8))
+    return openings, [0] * accounts, closings
+
+
+def run_interest_accrual(accounts, chunk_size, use_numpy, activity_days=3, days=30, seed=0):
+    """
+    Time the month-end interest calculation (forward fill plus interest)
+    for ``accounts`` synthetic accounts in chunks of ``chunk_size``, as
+    ``manage.py accrue_interest`` runs it between its queries. Input
+    generation isn't timed; the same ``seed`` gives every mode the same
+    accounts, so their ``interest_cents`` totals must match.
+    """
+    rng = random.Random(seed)
+    rate = interest.rate_table({'saving' : '0.035'})['saving']
+    elapsed, total = 0.0, 0
+    for start in range(0, accounts, chunk_size):
+        size = min(chunk_size, accounts - start)
+        openings, opened, closings = interest_inputs(size, days, activity_days, rng)
+        started = time.perf_counter()
+        balance_days = interest.balance_days(openings, opened, closings, days, use_numpy)
+        if use_numpy:
+            total += int(interest.interest_cents(balance_days, rate).sum())
+        else:
+            total += sum(interest.interest_cents(value, rate) for value in balance_days)
+        elapsed += time.perf_counter() - started
+    return {
+        'seconds' : round(elapsed, 3),
+        'accounts_per_s' : round(accounts / elapsed) if elapsed else None,
+        'interest_cents' : total,
+    }
+
+
+def close_connection():
+    # Resolves `connection` in the calling thread, unlike a bound method
+    # looked up on the event loop.
+    connection.close()
+
+
+def split_requests(requests, clients):
+    return [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+
+
+def client_accounts(accounts, index):
+    # The account a client logs in as, and the others it can transfer to.
+    account = accounts[index % len(accounts)]
+    return account, [other for other in accounts if other.pk != account.pk] or accounts
+
+
+def compare(current, baseline):
+    # Percentage change per endpoint for throughput and p95 latency.
+    changes = {}
+    for name, stats in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            'throughput_rps' : _change(before['throughput_rps'], stats['throughput_rps']),
+            'p95_ms' : _change(before['latency_ms']['p95'], stats['latency_ms']['p95']),
+        }
+    return changes
+
+
+def _change(before, after):
+    return round((after - before) / before * 100, 1) if before else None
@@ -0,0 +1,64 @@
+"""
+Read replica routing.
+
+With ``DATABASE_REPLICA_URL`` set there is a ``replica`` database alias.
+Writes always go to ``default``. Reads go to the replica only inside
+``replica_reads()``, which ``core.middleware.ReadReplicaMiddleware`` enters
+for GET requests to the views in ``REPLICA_READ_VIEWS``, and never while a
+transaction is open on ``default``: a read that is part of a write has to
+see the primary.
+
+Locally, point ``DATABASE_REPLICA_URL`` at a second SQLite file or
+PostgreSQL database (loaded from a dump of the first) to try it out. In
+tests the replica mirrors the default test database.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+
+_reads = ContextVar('replica_reads', default=None)
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+def replica_alias():
+    # Where read-only reports should read from.
+    return REPLICA if replica_configured() else DEFAULT_DB_ALIAS
+
+
+def enable_replica_reads():
+    _reads.set(REPLICA)
+
+
+def disable_replica_reads():
+    _reads.set(None)
+
+
+@contextmanager
+def replica_reads():
+    token = _reads.set(REPLICA)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _reads.get() == REPLICA and replica_configured() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Even for instances that were read from the replica.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # the same data on both
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,100 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+
+# Collapse literals and IN lists so the same query with different
+# arguments maps to one "shape".
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def sql_shape(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """
+    ``execute_wrapper`` that records every query run on a connection: its
+    SQL and how long it took.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        # Shapes issued more than once, the usual sign of an N+1 loop.
+        shapes = Counter(sql_shape(sql) for sql, _ in self.queries)
+        return {shape: count for shape, count in shapes.items() if count > 1}
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+class RenderTimings:
+    """
+    Render count and time per template name, for this process. Fed by the
+    transactional emails and, with ``QUERY_INSTRUMENTATION``, by every
+    TemplateResponse.
+    """
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            count, total = self.data.get(name, (0, 0))
+            self.data[name] = (count + 1, total + seconds)
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.data)
+        return {
+            name : {
+                'renders' : count,
+                'total_ms' : round(total * 1000, 2),
+                'avg_ms' : round(total * 1000 / count, 3),
+            }
+            for name, (count, total) in sorted(data.items())
+        }
+
+    def reset(self):
+        with self.lock:
+            self.data = {}
+
+
+render_timings = RenderTimings()
+
+
+@contextmanager
+def timed_render(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        render_timings.add(name, time.perf_counter() - start)
@@ -0,0 +1,111 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from core import benchmark
+from core.instrumentation import render_timings
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the money-movement endpoints against a throwaway test '
+        'database and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--transactions', type=int, default=100, help='History rows seeded per user')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent clients')
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(benchmark.ENDPOINTS), default=list(benchmark.ENDPOINTS))
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for request data')
+        parser.add_argument(
+            '--handler', choices=['wsgi', 'asgi'], default='wsgi',
+            help='Serve requests through the WSGI handler and sync views, or the ASGI handler and async views (in process, no server)',
+        )
+
+    def handle(self, *args, **options):
+        benchmark.random.seed(options['seed'])
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Can't read {options['compare']}: {exc}")
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and options['clients'] > 1:
+            # The default in-memory test database can't take concurrent
+            # writers; use a file so SQLite's locking applies.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'bank_benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        # Measure the endpoints themselves, not the rate limiter refusing them.
+        urlconf = 'bank_management.asgi_urls' if options['handler'] == 'asgi' else settings.ROOT_URLCONF
+        try:
+            with override_settings(ROOT_URLCONF=urlconf, RATE_LIMIT_ENABLED=False):
+                results = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if baseline:
+            results['compared_to'] = baseline.get('meta', {}).get('commit')
+            results['change_pct'] = benchmark.compare(results, baseline)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def run_benchmark(self, options):
+        if not options['keepdb'] or not benchmark.User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists():
+            self.stderr.write(f"Seeding {options['users']} users x {options['transactions']} transactions...")
+            benchmark.seed(options['users'], options['transactions'])
+        accounts = list(
+            benchmark.UserBankAccount.objects.filter(user__username__startswith=benchmark.USERNAME_PREFIX).select_related('user')
+        )
+
+        render_timings.reset()
+        run_endpoint = benchmark.run_endpoint_async if options['handler'] == 'asgi' else benchmark.run_endpoint
+        endpoints = {}
+        for name in options['endpoints']:
+            self.stderr.write(f'Running {name}...')
+            endpoints[name] = run_endpoint(
+                benchmark.ENDPOINTS[name], accounts, options['requests'], options['clients']
+            )
+
+        return {
+            'meta' : {
+                'timestamp' : datetime.now(timezone.utc).isoformat(),
+                'commit' : self.git_commit(),
+                'database' : connection.vendor,
+                'python' : platform.python_version(),
+                'users' : options['users'],
+                'transactions_per_user' : options['transactions'],
+                'requests' : options['requests'],
+                'clients' : options['clients'],
+                'handler' : options['handler'],
+            },
+            'endpoints' : endpoints,
+            'templates' : render_timings.snapshot(),
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,55 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from bank_management.database import psycopg
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the per-request cost of getting a database connection with '
+        'a new connection per request, persistent connections (with and '
+        'without health checks) and a psycopg pool, against DATABASES["default"]'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Simulated requests per mode')
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent threads')
+        parser.add_argument('--modes', nargs='+', choices=list(benchmark.CONNECTION_MODES), default=list(benchmark.CONNECTION_MODES))
+        parser.add_argument('--query', default='SELECT 1', help='SQL run by each request')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        modes = options['modes']
+        if 'pool' in modes and (connection.vendor != 'postgresql' or psycopg is None):
+            self.stderr.write('Skipping pool: it needs PostgreSQL and psycopg 3')
+            modes = [mode for mode in modes if mode != 'pool']
+        if not modes:
+            raise CommandError('No connection mode to run')
+
+        results = {}
+        for mode in modes:
+            self.stderr.write(f'Running {mode}...')
+            results[mode] = benchmark.run_connection_mode(mode, options['requests'], options['clients'], options['query'])
+
+        baseline = results.get('per_request')
+        output = json.dumps({
+            'meta' : {
+                'database' : connection.vendor,
+                'host' : connection.settings_dict['HOST'] or 'local socket',
+                'python' : platform.python_version(),
+                'requests' : options['requests'],
+                'clients' : options['clients'],
+            },
+            'modes' : results,
+            # Mean latency saved per request compared to connecting every time.
+            'saved_ms' : {
+                mode : round(baseline['latency_ms']['mean'] - stats['latency_ms']['mean'], 3)
+                for mode, stats in results.items() if baseline and mode != 'per_request'
+            },
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
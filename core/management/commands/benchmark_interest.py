@@ -0,0 +1,55 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from core import benchmark
+from transactions.interest import numpy
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the month-end interest calculation of accrue_interest on '
+        'synthetic accounts, vectorized with NumPy and in plain Python. '
+        'No database is used.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1000000, help='Synthetic accounts')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Accounts computed together')
+        parser.add_argument('--activity-days', type=int, default=3, help='Days with a balance change per account')
+        parser.add_argument('--modes', nargs='+', choices=['numpy', 'python'], default=['numpy', 'python'])
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        modes = options['modes']
+        if 'numpy' in modes and numpy is None:
+            self.stderr.write('Skipping numpy: it is not installed')
+            modes = [mode for mode in modes if mode != 'numpy']
+        if not modes:
+            raise CommandError('No mode to run')
+
+        results = {}
+        for mode in modes:
+            self.stderr.write(f'Running {mode}...')
+            results[mode] = benchmark.run_interest_accrual(
+                options['accounts'], options['chunk_size'], mode == 'numpy', options['activity_days'],
+            )
+
+        output = json.dumps({
+            'meta' : {
+                'accounts' : options['accounts'],
+                'chunk_size' : options['chunk_size'],
+                'activity_days' : options['activity_days'],
+                'python' : platform.python_version(),
+                'numpy' : numpy.__version__ if numpy else None,
+            },
+            'modes' : results,
+            'totals_match' : len({stats['interest_cents'] for stats in results.values()}) == 1,
+            'speedup' : (
+                round(results['python']['seconds'] / results['numpy']['seconds'], 1)
+                if {'numpy', 'python'} <= results.keys() and results['numpy']['seconds'] else None
+            ),
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
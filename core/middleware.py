@@ -0,0 +1,222 @@
+import logging
+import math
+import time
+from types import MethodType
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from . import db_router
+from .instrumentation import record_queries, render_timings
+from .ratelimit import MemoryBackend, RateLimiter
+
+logger = logging.getLogger('core.queries')
+
+
+def _inline(hook):
+    # Bound like the hook: Django names the middleware from `__self__`.
+    async def run(self, *args):
+        return hook(*args)
+    return MethodType(run, hook.__self__)
+
+
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that runs in either mode, so requests to the async
+    views under ASGI don't switch threads around it.
+
+    In async mode Django also runs sync ``process_*`` hooks through
+    ``sync_to_async``, a thread switch each. The hooks named in
+    ``inline_hooks`` run on the event loop instead: their ``a``-prefixed
+    version if there is one, else the hook itself, which mustn't block.
+    """
+    sync_capable = True
+    async_capable = True
+    inline_hooks = ()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            for name in self.inline_hooks:
+                setattr(self, name, getattr(self, f'a{name}', None) or _inline(getattr(self, name)))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class QueryInstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Records query count, DB time and repeated SQL shapes for every request.
+
+    Enabled by ``QUERY_INSTRUMENTATION`` (on in DEBUG). Figures are added as
+    ``X-DB-*`` response headers and logged per view at DEBUG level; a warning is logged when
+    a view goes over its entry in ``QUERY_BUDGETS``.
+    """
+    inline_hooks = ('process_template_response',)
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        # The wrappers go on the connections of the thread the request's
+        # queries run in (sync_to_async's), not the event loop's. Two thread
+        # switches, but only while instrumenting.
+        recording = record_queries()
+        recorder = await sync_to_async(recording.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recording.__exit__)(None, None, None)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        duplicates = recorder.duplicates()
+        response['X-DB-Query-Count'] = str(recorder.count)
+        response['X-DB-Time-Ms'] = f'{recorder.total_time * 1000:.2f}'
+        response['X-DB-Duplicate-Queries'] = str(sum(duplicates.values()) - len(duplicates))
+        render_time = getattr(request, '_template_render_time', None)
+        if render_time is not None:
+            response['X-Template-Time-Ms'] = f'{render_time * 1000:.2f}'
+
+        stats = {
+            'view' : view_name,
+            'path' : request.path,
+            'queries' : recorder.count,
+            'db_time_ms' : round(recorder.total_time * 1000, 2),
+            'duplicates' : duplicates,
+            'template_ms' : round(render_time * 1000, 2) if render_time is not None else None,
+        }
+        budget = settings.QUERY_BUDGETS.get(view_name)
+        if budget is not None and recorder.count > budget:
+            logger.warning('Query budget exceeded for %s: %s > %s', view_name, recorder.count, budget, extra={'query_stats' : stats})
+        else:
+            logger.debug('%s: %s queries in %sms', view_name, recorder.count, stats['db_time_ms'], extra={'query_stats' : stats})
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before the response is rendered; the callback right after.
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._template_render_time = time.perf_counter() - start
+            name = response.template_name
+            render_timings.add(name if isinstance(name, str) else name[0], request._template_render_time)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class RateLimitMiddleware(AsyncCapableMiddleware):
+    """
+    Applies ``RATE_LIMITS`` (see ``core.ratelimit``) by URL name.
+
+    Sits after AuthenticationMiddleware so user and account limits can read
+    the session. Refusals are a bare 429 with ``Retry-After``, returned
+    before the view runs: no template, no user or account query, no email.
+    """
+    def __init__(self, get_response):
+        if not settings.RATE_LIMIT_ENABLED:
+            raise MiddlewareNotUsed
+        self.limiter = RateLimiter()
+        # The cache backend does I/O (the database cache can't run on the
+        # event loop at all), so only in-process counts are checked inline.
+        if isinstance(self.limiter.backend, MemoryBackend):
+            self.inline_hooks = ('process_view',)
+        super().__init__(get_response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.url_name
+        if route not in self.limiter.rules:
+            return None
+        return self.refuse(self.limiter.check(route, request))
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.url_name
+        if route not in self.limiter.rules:
+            return None
+        if any(rule.key != 'ip' for rule in self.limiter.rules[route]):
+            # Load the session without blocking; check() then reads it from memory.
+            await request.session.aget(SESSION_KEY)
+        return self.refuse(self.limiter.check(route, request))
+
+    def refuse(self, decision):
+        if decision is None:
+            return None
+        return HttpResponse(
+            'Too many requests, please try again later.',
+            status = 429,
+            content_type = 'text/plain',
+            headers = {'Retry-After' : str(math.ceil(decision.retry_after))},
+        )
+
+
+class ReadReplicaMiddleware(AsyncCapableMiddleware):
+    """
+    Sends the reads of GET requests to ``REPLICA_READ_VIEWS`` (by URL name)
+    to the replica, see ``core.db_router``.
+
+    Read-your-writes: any other method sets a ``REPLICA_PIN_COOKIE`` for
+    ``REPLICA_PIN_SECONDS``, and while the client has it its reads stay on
+    the primary. So the report right after a deposit already shows it,
+    however far the replica lags. Unused without a replica.
+    """
+    safe_methods = ('GET', 'HEAD')
+    # Inline, it also sets the ContextVar in the request's own context.
+    inline_hooks = ('process_view',)
+
+    def __init__(self, get_response):
+        if not db_router.replica_configured():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.views = set(settings.REPLICA_READ_VIEWS)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.disable_replica_reads()
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_router.disable_replica_reads()
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if request.method not in self.safe_methods:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age = settings.REPLICA_PIN_SECONDS, httponly = True, samesite = 'Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method in self.safe_methods
+            and request.resolver_match.view_name in self.views
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES
+        ):
+            # Reset in __call__, after the response (and its template) is rendered.
+            db_router.enable_replica_reads()
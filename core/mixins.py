@@ -0,0 +1,30 @@
+from django.contrib.auth.mixins import AccessMixin
+from accounts.models import UserBankAccount
+
+
+async def aload_user(request):
+    """
+    Resolve ``request.user`` and its bank account on the event loop.
+
+    Async views can't touch the lazy ``request.user`` (or ``user.account``
+    in the navbar) without a synchronous query, so both are loaded up
+    front and the resolved user replaces the lazy object.
+    """
+    user = await request.auser()
+    # AccountModelBackend has usually joined the account in already.
+    if user.is_authenticated and not type(user).account.is_cached(user):
+        try:
+            user.account = await UserBankAccount.objects.aget(user=user)
+        except UserBankAccount.DoesNotExist:
+            pass
+    request.user = user
+    return user
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    # LoginRequiredMixin for views whose handlers are coroutines.
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aload_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
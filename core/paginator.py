@@ -0,0 +1,43 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables.
+
+    On PostgreSQL an unfiltered queryset is counted from the planner's row
+    estimate in ``pg_class`` instead of a full ``COUNT(*)``. Filtered
+    querysets, small tables and other databases use the exact count.
+    """
+    exact_count_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where:
+            estimate = self.estimated_count(queryset)
+            if estimate is not None and estimate > self.exact_count_threshold:
+                return estimate
+        return super().count
+
+    def estimated_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        # A partitioned table has no rows of its own (reltuples is 0 or -1):
+        # its estimate is the sum of its partitions'.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT CASE WHEN parent.relkind = 'p' THEN ("
+                "    SELECT SUM(GREATEST(child.reltuples, 0)) FROM pg_inherits"
+                "    JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+                "    WHERE pg_inherits.inhparent = parent.oid"
+                ") ELSE parent.reltuples END::bigint "
+                "FROM pg_class parent WHERE parent.oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row and row[0] > 0 else None
@@ -0,0 +1,235 @@
+"""
+Rate limits for ``core.middleware.RateLimitMiddleware``.
+
+``settings.RATE_LIMITS`` maps a URL name to a list of rules::
+
+    'deposite': [
+        {'key': 'user', 'rate': '20/m', 'algorithm': 'token_bucket', 'burst': 5},
+        {'key': 'ip', 'rate': '120/m'},
+    ]
+
+``key`` is ``ip``, ``user`` or ``account``. ``rate`` is
+``<count>/<s|m|h|d>``. ``algorithm`` is ``sliding_window`` (the default)
+or ``token_bucket``. ``burst`` is the bucket size, defaulting to the
+count. ``methods`` defaults to ``['POST']``.
+
+Users and accounts are identified from the session, not the database.
+Login stores the account id there too (see ``accounts.signals``).
+"""
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+
+ACCOUNT_SESSION_KEY = '_account_id'
+PERIODS = {'s' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400}
+
+Decision = namedtuple('Decision', ['allowed', 'retry_after'])
+
+
+def parse_rate(rate):
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period]
+
+
+class MemoryBackend:
+    # Per-process state. Cheapest, but every worker process counts alone.
+    max_entries = 10000
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def update(self, key, func, ttl):
+        # Applies func(state) -> (new_state, result) atomically.
+        now = time.monotonic()
+        with self.lock:
+            entry = self.data.get(key)
+            state = entry[0] if entry and entry[1] > now else None
+            state, result = func(state)
+            self.data[key] = (state, now + ttl)
+            if len(self.data) > self.max_entries:
+                self.data = {k: v for k, v in self.data.items() if v[1] > now}
+        return result
+
+    # Counters, for transactions.velocity. `ttl` None never expires; incr()
+    # keeps the expiry the counter was created with.
+    def add(self, key, value, ttl):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.data.get(key)
+            if entry and entry[1] > now:
+                return False
+            self.data[key] = (value, now + ttl if ttl is not None else float('inf'))
+        return True
+
+    def incr(self, key, delta, ttl):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.data.get(key)
+            if entry and entry[1] > now:
+                self.data[key] = (entry[0] + delta, entry[1])
+            else:
+                self.data[key] = (delta, now + ttl if ttl is not None else float('inf'))
+            return self.data[key][0]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        entries = {key: self.data.get(key) for key in keys}
+        return {key: entry[0] for key, entry in entries.items() if entry and entry[1] > now}
+
+    def set_many(self, values, ttl):
+        now = time.monotonic()
+        with self.lock:
+            for key, value in values.items():
+                self.data[key] = (value, now + ttl if ttl is not None else float('inf'))
+
+
+class CacheBackend:
+    """
+    State in a Django cache shared by every process. The read-modify-write
+    of update() isn't atomic across processes: a burst of concurrent
+    requests may get a few more hits through than the rule allows. add()
+    and incr() are atomic wherever the cache's are (Redis, Memcached,
+    locmem).
+    """
+    def __init__(self, alias='default', prefix='ratelimit'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def update(self, key, func, ttl):
+        key = f'{self.prefix}:{key}'
+        state, result = func(self.cache.get(key))
+        self.cache.set(key, state, ttl)
+        return result
+
+    def add(self, key, value, ttl):
+        return self.cache.add(f'{self.prefix}:{key}', value, ttl)
+
+    def incr(self, key, delta, ttl):
+        key = f'{self.prefix}:{key}'
+        while True:
+            self.cache.add(key, 0, ttl)
+            try:
+                return self.cache.incr(key, delta)
+            except ValueError:
+                # Expired between add() and incr().
+                continue
+
+    def get_many(self, keys):
+        found = self.cache.get_many([f'{self.prefix}:{key}' for key in keys])
+        return {key[len(self.prefix) + 1:]: value for key, value in found.items()}
+
+    def set_many(self, values, ttl):
+        self.cache.set_many({f'{self.prefix}:{key}': value for key, value in values.items()}, ttl)
+
+
+BACKENDS = {
+    'memory' : MemoryBackend,
+    'cache' : CacheBackend,
+}
+
+
+class TokenBucket:
+    # Allows bursts of up to `burst` requests, refilled at the rate.
+    def __init__(self, rate, burst=None):
+        self.count, self.period = parse_rate(rate)
+        self.capacity = burst or self.count
+        self.refill = self.count / self.period
+
+    def hit(self, backend, key, now):
+        def take(state):
+            tokens, last = state or (self.capacity, now)
+            tokens = min(self.capacity, tokens + (now - last) * self.refill)
+            if tokens >= 1:
+                return (tokens - 1, now), Decision(True, 0)
+            return (tokens, now), Decision(False, (1 - tokens) / self.refill)
+        return backend.update(key, take, self.period * 2)
+
+
+class SlidingWindow:
+    # Sliding window counter: this window's count plus the previous one's,
+    # weighted by how much of it still overlaps the last `period` seconds.
+    def __init__(self, rate, burst=None):
+        self.count, self.period = parse_rate(rate)
+
+    def hit(self, backend, key, now):
+        window = int(now // self.period)
+        elapsed = now - window * self.period
+
+        def count(state):
+            current_window, current, previous = state or (window, 0, 0)
+            if current_window != window:
+                previous = current if current_window == window - 1 else 0
+                current = 0
+            estimate = previous * (1 - elapsed / self.period) + current
+            if estimate + 1 > self.count:
+                return (window, current, previous), Decision(False, self.period - elapsed)
+            return (window, current + 1, previous), Decision(True, 0)
+        return backend.update(key, count, self.period * 2)
+
+
+ALGORITHMS = {
+    'token_bucket' : TokenBucket,
+    'sliding_window' : SlidingWindow,
+}
+
+
+class Rule:
+    def __init__(self, key, rate, algorithm='sliding_window', burst=None, methods=('POST',)):
+        if key not in ('ip', 'user', 'account'):
+            raise ValueError(f'Unknown rate limit key {key!r}')
+        self.key = key
+        self.rate = rate
+        self.limiter = ALGORITHMS[algorithm](rate, burst)
+        self.methods = {method.upper() for method in methods}
+
+
+def client_ip(request):
+    # Each proxy appends the address it got the request from to
+    # X-Forwarded-For style headers, so only the last RATE_LIMIT_PROXY_COUNT
+    # entries can be trusted: the client can send any left of those.
+    entries = [entry.strip() for entry in request.META.get(settings.RATE_LIMIT_IP_META, '').split(',')]
+    entries = [entry for entry in entries if entry]
+    if not entries:
+        return request.META.get('REMOTE_ADDR', '')
+    return entries[-min(settings.RATE_LIMIT_PROXY_COUNT, len(entries))]
+
+
+def identity(request, key):
+    if key == 'ip':
+        return client_ip(request)
+    session = getattr(request, 'session', None)
+    if session is None:
+        return None
+    return session.get(SESSION_KEY if key == 'user' else ACCOUNT_SESSION_KEY)
+
+
+class RateLimiter:
+    def __init__(self, config=None, backend=None):
+        config = settings.RATE_LIMITS if config is None else config
+        self.rules = {
+            route: sorted((Rule(**rule) for rule in rules), key=lambda rule: rule.key != 'ip')
+            for route, rules in config.items()
+        }
+        self.backend = backend or BACKENDS[settings.RATE_LIMIT_BACKEND]()
+
+    def check(self, route, request):
+        """
+        Count the request against every rule for ``route`` and return the
+        first refusal, or None. IP rules run first since they need nothing
+        but the request; user and account rules read the session.
+        """
+        now = time.time()
+        for rule in self.rules.get(route, ()):
+            if request.method not in rule.methods:
+                continue
+            value = identity(request, rule.key)
+            if value is None:
+                continue
+            decision = rule.limiter.hit(self.backend, f'{route}:{rule.key}:{value}:{rule.rate}', now)
+            if not decision.allowed:
+                return decision
+        return None
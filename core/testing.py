@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+from django.conf import settings
+from .instrumentation import record_queries
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin to keep views within the query budgets in
+    ``settings.QUERY_BUDGETS``::
+
+        with self.assertQueryBudget('report'):
+            self.client.get(reverse('report'))
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, view_name, budget=None):
+        if budget is None:
+            budget = settings.QUERY_BUDGETS[view_name]
+        with record_queries() as recorder:
+            yield recorder
+        if recorder.count > budget:
+            details = '\n'.join(f'  {count}x {shape}' for shape, count in recorder.duplicates().items())
+            self.fail(
+                f'{view_name} ran {recorder.count} queries, budget is {budget}'
+                + (f'\nRepeated queries:\n{details}' if details else '')
+            )
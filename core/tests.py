@@ -1,3 +1,266 @@
-from django.test import TestCase
+import os
+from decimal import Decimal
+from unittest import mock
+import environ
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.cache import cache
+from django.db import connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import resolve, reverse
+from transactions import ledger
+from transactions.constants import DEPOSIT
+from transactions.models import Transaction
+from transactions.tests import create_account
+from bank_management.database import database_config
+from . import benchmark, db_router, ratelimit
+from .middleware import QueryInstrumentationMiddleware, RateLimitMiddleware, ReadReplicaMiddleware
+from .testing import QueryBudgetMixin
 
 # Create your tests here.
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.account = create_account('budget', balance=0)
+        self.other = create_account('other', balance=0)
+        for _ in range(20):
+            ledger.post(self.account, Decimal('500'), DEPOSIT)
+        self.client.force_login(self.account.user)
+
+    def test_pages_stay_within_budget(self):
+        for name in ('home', 'report', 'loan_list', 'deposite', 'withdraw', 'loan_request', 'transfer_money', 'profile_update'):
+            with self.subTest(name), self.assertQueryBudget(name):
+                self.client.get(reverse(name))
+
+    def test_money_movement_stays_within_budget(self):
+        with self.assertQueryBudget('deposite'):
+            self.client.post(reverse('deposite'), {'amount': '600'})
+        with self.assertQueryBudget('transfer_money'):
+            self.client.post(reverse('transfer_money'), {'account_no': self.other.account_no, 'amount': '600'})
+
+    def test_user_and_account_load_in_one_query(self):
+        # The session row plus one joined user/account query.
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_cookie_sessions_leave_one_query_before_the_view(self):
+        self.client.force_login(self.account.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Balance : 10000')
+        self.client.logout()
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home'))
+
+    def test_over_budget_reports_repeated_queries(self):
+        with self.assertRaisesMessage(AssertionError, '3x SELECT'):
+            with self.assertQueryBudget('loop', budget=1):
+                for _ in range(3):
+                    self.account.__class__.objects.get(pk=self.account.pk)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_middleware_adds_query_headers(self):
+        response = self.client.get(reverse('report'))
+        self.assertEqual(int(response['X-DB-Query-Count']), 3)
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+        self.assertIn('X-Template-Time-Ms', response)
+
+    @override_settings(QUERY_INSTRUMENTATION=True, ROOT_URLCONF='bank_management.asgi_urls')
+    async def test_middleware_counts_async_view_queries(self):
+        # Counted in the thread the async view's queries run in.
+        await self.async_client.aforce_login(self.account.user)
+        response = await self.async_client.get(reverse('report'))
+        self.assertEqual(int(response['X-DB-Query-Count']), 3)
+        self.assertIn('X-Template-Time-Ms', response)
+
+    @override_settings(QUERY_INSTRUMENTATION=True, RATE_LIMIT_BACKEND='memory')
+    def test_middleware_runs_natively_in_both_modes(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware_class in (QueryInstrumentationMiddleware, RateLimitMiddleware):
+            with self.subTest(middleware_class.__name__):
+                self.assertFalse(iscoroutinefunction(middleware_class(HttpResponse)))
+                middleware = middleware_class(get_response)
+                self.assertTrue(iscoroutinefunction(middleware))
+                hook = getattr(middleware, 'process_view', None) or middleware.process_template_response
+                self.assertTrue(iscoroutinefunction(hook))
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class BenchmarkTests(TestCase):
+    def test_seed_and_run_endpoints(self):
+        accounts = benchmark.seed(users=3, transactions_per_user=4)
+        self.assertEqual(len(accounts), 3)
+        self.assertEqual(Transaction.objects.filter(account__in=accounts).count(), 12)
+
+        for name in ('deposite', 'transfer_money', 'report'):
+            stats = benchmark.run_endpoint(benchmark.ENDPOINTS[name], accounts, requests=4, clients=1)
+            self.assertEqual(stats['requests'], 4)
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['latency_ms']['p50'], stats['latency_ms']['max'])
+
+    def test_connection_modes_run_the_query(self):
+        for mode in ('per_request', 'persistent_health_checks'):
+            stats = benchmark.run_connection_mode(mode, requests=4, clients=2)
+            self.assertEqual((stats['requests'], stats['errors']), (4, 0))
+
+    def test_compare_reports_percentage_change(self):
+        before = {'endpoints': {'report': {'throughput_rps': 100, 'latency_ms': {'p95': 20}}}}
+        after = {'endpoints': {'report': {'throughput_rps': 150, 'latency_ms': {'p95': 10}}}}
+        self.assertEqual(benchmark.compare(after, before), {'report': {'throughput_rps': 50.0, 'p95_ms': -50.0}})
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.account = create_account('throttled', balance=0)
+        self.other = create_account('other_throttled', balance=0)
+
+    def test_token_bucket_and_sliding_window(self):
+        backend = ratelimit.MemoryBackend()
+        bucket = ratelimit.TokenBucket('60/m', burst=2)
+        self.assertEqual([bucket.hit(backend, 'b', 0).allowed for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(bucket.hit(backend, 'b', 0).retry_after, 1)
+        self.assertTrue(bucket.hit(backend, 'b', 1).allowed)  # one token refilled
+
+        window = ratelimit.SlidingWindow('2/m')
+        self.assertEqual([window.hit(backend, 'w', t).allowed for t in (0, 10, 20)], [True, True, False])
+        # Half of the previous window still counts: 2 * 0.5 = 1, so one more fits.
+        self.assertEqual([window.hit(backend, 'w', t).allowed for t in (90, 91)], [True, False])
+
+    @override_settings(RATE_LIMITS={'deposite': [{'key': 'user', 'rate': '2/h'}], 'login': [{'key': 'ip', 'rate': '1/h'}]})
+    def test_over_limit_requests_get_a_cheap_429(self):
+        self.client.force_login(self.account.user)
+        for _ in range(2):
+            self.client.post(reverse('deposite'), {'amount': '600'})
+        with self.assertNumQueries(1):  # the session, nothing else
+            response = self.client.post(reverse('deposite'), {'amount': '600'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 2)
+
+        # Limits are per user: someone else is unaffected.
+        self.client.force_login(self.other.user)
+        self.assertEqual(self.client.post(reverse('deposite'), {'amount': '600'}).status_code, 302)
+
+        # Per IP, with no session needed at all.
+        self.client.logout()
+        self.client.post(reverse('login'), {'username': 'throttled', 'password': 'wrong'})
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('login'), {'username': 'throttled', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(RATE_LIMIT_BACKEND='cache')
+    def test_cache_backend_shares_counts(self):
+        cache.clear()
+        limiter = ratelimit.RateLimiter({'transfer_money': [{'key': 'account', 'rate': '1/m'}]})
+        other = ratelimit.RateLimiter({'transfer_money': [{'key': 'account', 'rate': '1/m'}]})
+        request = RequestFactory().post('/')
+        request.session = {ratelimit.ACCOUNT_SESSION_KEY: self.account.pk}
+        self.assertIsNone(limiter.check('transfer_money', request))
+        self.assertFalse(other.check('transfer_money', request).allowed)
+
+
+    @override_settings(RATE_LIMIT_IP_META='HTTP_X_FORWARDED_FOR', RATE_LIMIT_PROXY_COUNT=1)
+    def test_client_ip_ignores_client_supplied_forwarded_entries(self):
+        request = RequestFactory().post('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7')
+        self.assertEqual(ratelimit.client_ip(request), '203.0.113.7')
+        with self.settings(RATE_LIMIT_PROXY_COUNT=2):
+            self.assertEqual(ratelimit.client_ip(request), '1.2.3.4')
+        self.assertEqual(ratelimit.client_ip(RequestFactory().post('/')), '127.0.0.1')
+
+
+class DatabaseConfigTests(TestCase):
+    def config(self, **environment):
+        # Only the variables under test: the real DATABASE_URL and DB_* would override them.
+        with mock.patch.dict(os.environ, environment, clear=True):
+            return database_config(environ.Env())
+
+    def test_database_url_is_required(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'Set DATABASE_URL'):
+            self.config()
+
+    def test_transaction_pooler_disables_server_side_cursors(self):
+        config = self.config(DATABASE_URL='postgres://bank@pooler.example.com:6543/bank')
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual((config['CONN_MAX_AGE'], config['CONN_HEALTH_CHECKS']), (60, True))
+
+        config = self.config(DATABASE_URL='postgres://bank@localhost:5432/bank', DB_CONN_MAX_AGE='300')
+        self.assertFalse(config.get('DISABLE_SERVER_SIDE_CURSORS'))
+        self.assertEqual(config['CONN_MAX_AGE'], 300)
+
+    def test_pool_replaces_persistent_connections(self):
+        with mock.patch('bank_management.database.psycopg', object()):
+            config = self.config(DATABASE_URL='postgres://bank@pooler.example.com:6543/bank', DB_POOL='on', DB_POOL_MAX_SIZE='20')
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 20)
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+
+        with self.assertRaises(ImproperlyConfigured):
+            self.config(DATABASE_URL='sqlite:///bank.sqlite3', DB_POOL='on')
+
+
+@mock.patch('core.db_router.replica_configured', return_value=True)
+class ReplicaRoutingTests(SimpleTestCase):
+    def test_router(self, configured):
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+        with db_router.replica_reads():
+            self.assertEqual(router.db_for_read(Transaction), 'replica')
+            self.assertEqual(router.db_for_write(Transaction), 'default')
+            # Reads inside a transaction are part of a write.
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                self.assertEqual(router.db_for_read(Transaction), 'default')
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+
+    def read_from(self, method, path, **cookies):
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Transaction))
+            return HttpResponse()
+
+        def get_response(request):
+            request.resolver_match = resolve(request.path)
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReadReplicaMiddleware(get_response)
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies)
+        response = middleware(request)
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+        return seen[0], response
+
+    def test_middleware_reads_report_from_replica(self, configured):
+        self.assertEqual(self.read_from('get', reverse('report'))[0], 'replica')
+        self.assertEqual(self.read_from('get', reverse('deposite'))[0], 'default')
+
+    def test_middleware_pins_client_after_a_write(self, configured):
+        using, response = self.read_from('post', reverse('deposite'))
+        self.assertEqual(using, 'default')
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(self.read_from('get', reverse('report'), **{settings.REPLICA_PIN_COOKIE : '1'})[0], 'default')
+
+    async def test_async_middleware_reads_report_from_replica(self, configured):
+        seen = []
+
+        async def get_response(request):
+            request.resolver_match = resolve(request.path)
+            await middleware.process_view(request, None, (), {})
+            seen.append(router.db_for_read(Transaction))
+            return HttpResponse()
+
+        middleware = ReadReplicaMiddleware(get_response)
+        response = await middleware(RequestFactory().get(reverse('report')))
+        self.assertEqual(seen, ['replica'])
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+        response = await middleware(RequestFactory().post(reverse('deposite')))
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_unused_without_replica(self, configured):
+        configured.return_value = False
+        with self.assertRaises(MiddlewareNotUsed):
+            ReadReplicaMiddleware(HttpResponse)
@@ -1,7 +1,14 @@
 from django.shortcuts import render
 from django.views.generic import TemplateView
+from .mixins import aload_user
 
 # Create your views here.
 class HomeView(TemplateView):
     template_name = 'index.html'
-    
\ No newline at end of file
+
+
+class AsyncHomeView(HomeView):
+    async def get(self, request, *args, **kwargs):
+        # Loaded here so the navbar's balance doesn't query while rendering.
+        await aload_user(request)
+        return self.render_to_response(self.get_context_data(**kwargs))
@@ -1,6 +1,9 @@
-from django.contrib import admin
-from .models import Transaction, BankSettings
-from .views import send_transaction_email
+from django.contrib import admin, messages
+from django.db import transaction
+from core.paginator import EstimatedCountPaginator
+from .models import Transaction, BankSettings, EmailOutbox, InterestAccrual, Loan, PendingNotification
+from .emails import queue_transaction_emails
+from . import loans as loan_states
 
 
 # Register your models here.
@@ -9,13 +12,69 @@ from .views import send_transaction_email
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve', 'timestamp']
+    list_select_related = ['account__user']
+    list_filter = ['transaction_type', 'loan_approve', 'timestamp']
+    raw_id_fields = ['account']
+    # Loans are approved through the Loan model so its state, the balance
+    # and the account's active loan counter move together.
+    readonly_fields = ['loan_approve']
+    actions = ['approve_loans']
+    # Millions of rows: estimate the total and skip the second full COUNT(*).
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    def save_model(self, request, obj, form, change):
-        if obj.loan_approve:
-            obj.account.balance += obj.amount
-            obj.balance_after_transaction = obj.account.balance
-            obj.account.save()
-            send_transaction_email(obj.account.user, obj.amount, 'Loan Approval', 'loan_approve.html')
-        return super().save_model(request, obj, form, change)
+    # Rows are written by transactions.ledger only; saving one here would
+    # change history without moving the balance or the ledger.
+    def has_add_permission(self, request):
+        return False
 
-admin.site.register(BankSettings)
\ No newline at end of file
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Approve selected loans')
+    def approve_loans(self, request, queryset):
+        approve_and_notify(self, request, Loan.objects.filter(request_transaction__in=queryset).values_list('pk', flat=True))
+
+
+def approve_and_notify(modeladmin, request, loan_ids):
+    with transaction.atomic():
+        loans = loan_states.approve_loans(loan_ids)
+        queue_transaction_emails(((loan.account.user, loan.principal) for loan in loans), 'Loan Approval', 'loan_approve.html')
+    modeladmin.message_user(request, f'{len(loans)} loan(s) approved', messages.SUCCESS)
+
+
+@admin.register(Loan)
+class LoanAdmin(admin.ModelAdmin):
+    list_display = ['id', 'account', 'principal', 'outstanding', 'status', 'requested_at', 'approved_at', 'repaid_at']
+    list_select_related = ['account__user']
+    list_filter = ['status']
+    raw_id_fields = ['account', 'request_transaction', 'repayment_transaction']
+    readonly_fields = ['status', 'outstanding', 'approved_at', 'repaid_at']
+    actions = ['approve_selected']
+
+    @admin.action(description='Approve selected loans')
+    def approve_selected(self, request, queryset):
+        approve_and_notify(self, request, queryset.values_list('pk', flat=True))
+
+
+admin.site.register(BankSettings)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+
+
+@admin.register(PendingNotification)
+class PendingNotificationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'subject', 'amount', 'created_at', 'digest_at']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+
+@admin.register(InterestAccrual)
+class InterestAccrualAdmin(admin.ModelAdmin):
+    list_display = ['account', 'month', 'amount', 'created_at']
+    list_filter = ['month']
+    raw_id_fields = ['account', 'transaction']
@@ -0,0 +1,195 @@
+"""
+Cold Transaction history, kept as gzipped NDJSON files.
+
+``manage.py archive_transactions`` moves every month older than
+``TRANSACTION_RETENTION_MONTHS`` out of the database and into
+``TRANSACTION_ARCHIVE_DIR``, then drops the month's partition (or deletes
+its rows where the table isn't partitioned). Ledger entries, loans and the
+daily balance snapshots stay in the database.
+
+Each month is three files:
+
+- ``transactions-YYYY-MM.ndjson.gz``: one JSON object per row, grouped by
+  account and each account compressed as a gzip member of its own. It is
+  still an ordinary .gz file, ``zcat`` reads all of it.
+- ``transactions-YYYY-MM.idx``: fixed-size ``(account id, offset, length)``
+  records sorted by account id, so reading one account's rows is a binary
+  search plus decompressing that account's member only.
+- ``transactions-YYYY-MM.json``: row and account counts, written last. A
+  month without it isn't archived.
+"""
+import gzip
+import json
+import os
+import struct
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import groupby
+from pathlib import Path
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.functions import TruncMonth
+from .models import Transaction
+from .partitions import TABLE, add_months, drop_partition, month_bounds, month_start, partitions
+
+FIELDS = ['id', 'account_id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approve']
+
+INDEX_RECORD = struct.Struct('<qQQ')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_dir():
+    return Path(settings.TRANSACTION_ARCHIVE_DIR)
+
+
+def archive_paths(month):
+    # (rows, index, manifest) paths of a month.
+    stem = archive_dir() / f'transactions-{month:%Y-%m}'
+    return stem.with_suffix('.ndjson.gz'), stem.with_suffix('.idx'), stem.with_suffix('.json')
+
+
+def archived_months():
+    months = []
+    for path in archive_dir().glob('transactions-*.json'):
+        months.append(datetime.strptime(path.stem, 'transactions-%Y-%m').date())
+    return sorted(months)
+
+
+def archivable_months(retention_months, using=DEFAULT_DB_ALIAS, today=None):
+    # Months (UTC, like the partitions) that still have rows in the database
+    # and ended more than `retention_months` ago.
+    cutoff, _ = month_bounds(add_months(month_start(today or datetime.now(timezone.utc)), -retention_months))
+    months = (
+        Transaction.objects.using(using).filter(timestamp__lt=cutoff)
+        .annotate(month=TruncMonth('timestamp', tzinfo=timezone.utc))
+        .order_by('month').values_list('month', flat=True).distinct()
+    )
+    return [month_start(month) for month in months]
+
+
+def _write_atomically(path, write):
+    # Write to a temporary file and rename, so a crash leaves no partial file.
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def _encode(row):
+    row = dict(zip(FIELDS, row))
+    row['timestamp'] = row['timestamp'].isoformat()
+    row['amount'] = str(row['amount'])
+    row['balance_after_transaction'] = str(row['balance_after_transaction'])
+    return (json.dumps(row) + '\n').encode()
+
+
+def write_archive(month, using=DEFAULT_DB_ALIAS):
+    # Write the month's rows and index; returns (rows, accounts).
+    rows_path, index_path, _ = archive_paths(month)
+    start, end = month_bounds(month)
+    rows = (
+        Transaction.objects.using(using).filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by('account_id', 'timestamp', 'id').values_list(*FIELDS)
+        .iterator(chunk_size=settings.STATEMENT_EXPORT_CHUNK_SIZE)
+    )
+    index = []
+    count = 0
+
+    def write_rows(file):
+        nonlocal count
+        for account_id, account_rows in groupby(rows, key=lambda row: row[1]):
+            offset = file.tell()
+            with gzip.GzipFile(fileobj=file, mode='wb', mtime=0) as member:
+                for row in account_rows:
+                    member.write(_encode(row))
+                    count += 1
+            index.append(INDEX_RECORD.pack(account_id, offset, file.tell() - offset))
+
+    _write_atomically(rows_path, write_rows)
+    _write_atomically(index_path, lambda file: file.write(b''.join(index)))
+    return count, len(index)
+
+
+def remove_month(month, using=DEFAULT_DB_ALIAS):
+    # Drop the month's partition, then delete whatever of the month sits in
+    # the default partition (or in the plain table on other databases).
+    # Raw SQL: Django's delete() would null out the loans' references.
+    if month in partitions(using):
+        drop_partition(month, using)
+    connection = connections[using]
+    bounds = [connection.ops.adapt_datetimefield_value(bound) for bound in month_bounds(month)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE "timestamp" >= %s AND "timestamp" < %s', bounds)
+
+
+def archive_month(month, using=DEFAULT_DB_ALIAS):
+    """
+    Move one month of transactions to the archive and return its row count.
+    Safe to run again after a failure: a month whose files are complete but
+    whose rows are still in the database is only removed.
+    """
+    _, _, manifest_path = archive_paths(month)
+    start, end = month_bounds(month)
+    with transaction.atomic(using=using):
+        live = Transaction.objects.using(using).filter(timestamp__gte=start, timestamp__lt=end).count()
+        if manifest_path.exists():
+            rows = json.loads(manifest_path.read_text())['rows']
+            if live not in (0, rows):
+                raise ArchiveError(f'{month:%Y-%m} is archived with {rows} rows but the database has {live}')
+        else:
+            archive_dir().mkdir(parents=True, exist_ok=True)
+            rows, accounts = write_archive(month, using)
+            manifest = {'month' : f'{month:%Y-%m}', 'rows' : rows, 'accounts' : accounts}
+            _write_atomically(manifest_path, lambda file: file.write(json.dumps(manifest).encode()))
+        remove_month(month, using)
+    return rows
+
+
+def _find(index_file, account_id):
+    # Binary search the sorted index for the account's (offset, length).
+    low, high = 0, os.fstat(index_file.fileno()).st_size // INDEX_RECORD.size
+    while low < high:
+        middle = (low + high) // 2
+        index_file.seek(middle * INDEX_RECORD.size)
+        found, offset, length = INDEX_RECORD.unpack(index_file.read(INDEX_RECORD.size))
+        if found == account_id:
+            return offset, length
+        if found < account_id:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+
+def archived_rows(account_id, fields, start=None, end=None):
+    """
+    Yield an account's archived transactions as tuples of ``fields``, in
+    ``(timestamp, id)`` order like ``pagination.stream_values``. ``start``
+    and ``end`` limit the rows to ``start <= timestamp < end``.
+    """
+    for month in archived_months():
+        month_first, month_end = month_bounds(month)
+        if (start and month_end <= start) or (end and month_first >= end):
+            continue
+        rows_path, index_path, _ = archive_paths(month)
+        with open(index_path, 'rb') as index_file:
+            found = _find(index_file, account_id)
+        if found is None:
+            continue
+        offset, length = found
+        with open(rows_path, 'rb') as rows_file:
+            rows_file.seek(offset)
+            lines = gzip.decompress(rows_file.read(length)).splitlines()
+        for line in lines:
+            row = json.loads(line)
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            if (start and row['timestamp'] < start) or (end and row['timestamp'] >= end):
+                continue
+            row['amount'] = Decimal(row['amount'])
+            row['balance_after_transaction'] = Decimal(row['balance_after_transaction'])
+            yield tuple(row[field] for field in fields)
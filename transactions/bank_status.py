@@ -0,0 +1,64 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import BankSettings
+
+CACHE_KEY = 'transactions:bank_is_bankrupt'
+
+_lock = threading.Lock()
+_cached = {'value' : None, 'expires' : 0.0}
+
+
+def is_bankrupt():
+    """
+    Cached ``BankSettings.is_bankrupt``.
+
+    The flag is kept in process memory for ``BANK_SETTINGS_CACHE_TTL``
+    seconds and, when ``BANK_SETTINGS_USE_CACHE`` is on, shared through
+    Django's cache so one query serves every worker. Saving or deleting
+    ``BankSettings`` invalidates both through signals; other processes'
+    memory copies expire within the TTL.
+    """
+    now = time.monotonic()
+    if _cached['expires'] > now:
+        return _cached['value']
+
+    value = cache.get(CACHE_KEY) if settings.BANK_SETTINGS_USE_CACHE else None
+    if value is None:
+        bank_settings = BankSettings.objects.first()
+        value = bool(bank_settings and bank_settings.is_bankrupt)
+        if settings.BANK_SETTINGS_USE_CACHE:
+            cache.set(CACHE_KEY, value, settings.BANK_SETTINGS_CACHE_TTL)
+
+    return _remember(value, now)
+
+
+async def ais_bankrupt():
+    # is_bankrupt() for async views, using the async cache and ORM APIs.
+    now = time.monotonic()
+    if _cached['expires'] > now:
+        return _cached['value']
+
+    value = await cache.aget(CACHE_KEY) if settings.BANK_SETTINGS_USE_CACHE else None
+    if value is None:
+        bank_settings = await BankSettings.objects.afirst()
+        value = bool(bank_settings and bank_settings.is_bankrupt)
+        if settings.BANK_SETTINGS_USE_CACHE:
+            await cache.aset(CACHE_KEY, value, settings.BANK_SETTINGS_CACHE_TTL)
+
+    return _remember(value, now)
+
+
+def _remember(value, now):
+    with _lock:
+        _cached['value'] = value
+        _cached['expires'] = now + settings.BANK_SETTINGS_CACHE_TTL
+    return value
+
+
+def invalidate(**kwargs):
+    with _lock:
+        _cached['expires'] = 0.0
+    if settings.BANK_SETTINGS_USE_CACHE:
+        cache.delete(CACHE_KEY)
@@ -4,6 +4,7 @@ LOAN = 3
 LOAN_PAID = 4
 TRANSFER_OUT = 5
 TRANSFER_IN = 6
+INTEREST = 7
 
 TRANSACTION_TYPE = (
     (DEPOSIT, 'Deposite'),
@@ -12,4 +13,30 @@ TRANSACTION_TYPE = (
     (LOAN_PAID, 'Loan Paid'),
     (TRANSFER_IN, 'Transfer In'),
     (TRANSFER_OUT, 'Transfer Out'),  
-)
\ No newline at end of file
+    (INTEREST, 'Interest'),
+)
+
+# Transaction types that take money out of the account.
+DEBIT_TYPES = (WITHDRAWAL, LOAN_PAID, TRANSFER_OUT)
+
+LOAN_REQUESTED = 'requested'
+LOAN_ACTIVE = 'active'
+LOAN_REPAID = 'repaid'
+
+LOAN_STATUS = (
+    (LOAN_REQUESTED, 'Requested'),
+    (LOAN_ACTIVE, 'Active'),
+    (LOAN_REPAID, 'Repaid'),
+)
+
+MAX_ACTIVE_LOANS = 3
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+OUTBOX_STATUS = (
+    (OUTBOX_PENDING, 'Pending'),
+    (OUTBOX_SENT, 'Sent'),
+    (OUTBOX_DEAD, 'Dead'),
+)
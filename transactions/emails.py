@@ -0,0 +1,213 @@
+from datetime import timedelta
+from itertools import groupby
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+from core.instrumentation import timed_render
+from accounts.constants import NOTIFY_IMMEDIATE, NOTIFY_HOURLY
+from .models import EmailOutbox, PendingNotification
+from .constants import OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_DEAD
+
+
+def email_context(user, amount=None, account=None, **extra):
+    # Plain values only: rendering never touches the ORM, and dict lookups
+    # are the cheapest way for the template engine to resolve a variable.
+    account = account or getattr(user, 'account', None)
+    context = {
+        'user' : {
+            'first_name' : user.first_name,
+            'last_name' : user.last_name,
+            'account' : {'account_no' : account.account_no, 'balance' : account.balance} if account else {},
+        },
+        'amount' : amount,
+    }
+    context.update(extra)
+    return context
+
+
+def html_to_text(html):
+    # The plain part: the HTML without tags, one paragraph per line.
+    lines = (line.strip() for line in strip_tags(html).splitlines())
+    return '\n\n'.join(line for line in lines if line)
+
+
+def render_email(template, context):
+    """
+    Render ``template`` into a ``(text, html)`` pair. The cached template
+    loader keeps the compiled template, so only the first render in a
+    process parses the file.
+    """
+    compiled = get_template(template)
+    with timed_render(template):
+        html = compiled.render(context)
+    return html_to_text(html), html
+
+
+def outbox_email(to_email, subject, template, context):
+    text, html = render_email(template, context)
+    return EmailOutbox(to_email=to_email, subject=subject, text_body=text, html_body=html)
+
+
+def send_transaction_email(user, amount, subject, template, digest=True):
+    # The email is only queued here. It is committed together with the
+    # surrounding transaction and sent by the `send_outbox_emails` worker,
+    # so the request never waits on the SMTP server. Accounts on a digest
+    # get a PendingNotification instead; pass digest=False for emails that
+    # must go out straight away.
+    if digest and digest_frequency(user):
+        return PendingNotification.objects.create(**pending_notification(user, amount, subject))
+    email = outbox_email(user.email, subject, template, email_context(user, amount))
+    email.save()
+    return email
+
+
+def queue_transaction_emails(recipients, subject, template):
+    # send_transaction_email for many ``(user, amount)`` pairs, one INSERT per table.
+    emails, pending = [], []
+    for user, amount in recipients:
+        if digest_frequency(user):
+            pending.append(PendingNotification(**pending_notification(user, amount, subject)))
+        else:
+            emails.append(outbox_email(user.email, subject, template, email_context(user, amount)))
+    PendingNotification.objects.bulk_create(pending)
+    return EmailOutbox.objects.bulk_create(emails)
+
+
+def digest_frequency(user):
+    account = getattr(user, 'account', None)
+    if account is None or account.notification_frequency == NOTIFY_IMMEDIATE:
+        return None
+    return account.notification_frequency
+
+
+def pending_notification(user, amount, subject):
+    now = timezone.now()
+    return {
+        'user' : user,
+        'subject' : subject,
+        'amount' : amount or 0,
+        'created_at' : now,
+        'digest_at' : next_digest_at(digest_frequency(user), now),
+    }
+
+
+def next_digest_at(frequency, now):
+    # The top of the next hour, or the next local midnight.
+    local = timezone.localtime(now)
+    if frequency == NOTIFY_HOURLY:
+        return local.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+
+def queue_digests(now=None, batch_size=500):
+    """
+    Fold every due PendingNotification into one outbox email per user,
+    rendered once from all of that user's events. Works through
+    ``batch_size`` users per transaction; rows another worker holds are
+    skipped. Returns a ``(digests, notifications)`` tuple.
+    """
+    now = now or timezone.now()
+    digests = notifications = 0
+    # Users are walked in id order, so a batch whose rows are all locked
+    # is passed over rather than ending the run.
+    last_user_id = 0
+    while True:
+        with transaction.atomic():
+            user_ids = list(
+                PendingNotification.objects.filter(digest_at__lte=now, user_id__gt=last_user_id)
+                .order_by('user_id').values_list('user_id', flat=True).distinct()[:batch_size]
+            )
+            if not user_ids:
+                return digests, notifications
+            last_user_id = user_ids[-1]
+            events = list(
+                PendingNotification.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('user__account')
+                .filter(user_id__in=user_ids, digest_at__lte=now)
+                .order_by('user_id', 'created_at', 'pk')
+            )
+            emails = []
+            for _, group in groupby(events, key=lambda event: event.user_id):
+                group = list(group)
+                user = group[0].user
+                context = email_context(user, events=[
+                    {'subject' : event.subject, 'amount' : event.amount, 'created_at' : event.created_at}
+                    for event in group
+                ])
+                emails.append(outbox_email(user.email, 'Your account activity', 'digest_email.html', context))
+            EmailOutbox.objects.bulk_create(emails)
+            PendingNotification.objects.filter(pk__in=[event.pk for event in events]).delete()
+        digests += len(emails)
+        notifications += len(events)
+
+
+def retry_delay(attempts):
+    # Exponential backoff: base, 2 * base, 4 * base ... capped at one day.
+    base = settings.EMAIL_OUTBOX_RETRY_DELAY
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 24 * 60 * 60))
+
+
+def deliver_outbox(batch_size=None, connection=None):
+    """
+    Send one batch of due outbox emails over a single SMTP connection.
+
+    Returns a ``(sent, failed)`` tuple. Failed emails are rescheduled with
+    backoff and marked dead once they reach ``EMAIL_OUTBOX_MAX_ATTEMPTS``.
+    A ``connection`` passed in is left open for the caller's next batch.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+
+    with transaction.atomic():
+        # skip_locked lets several workers drain the outbox side by side.
+        batch = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=OUTBOX_PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if not batch:
+            return sent, failed
+
+        owned = connection is None
+        connection = connection or get_connection()
+        try:
+            connection.open()  # a no-op for an SMTP connection that is already open
+        except Exception as exc:
+            for email in batch:
+                _mark_failed(email, exc)
+            failed = len(batch)
+        else:
+            try:
+                for email in batch:
+                    message = EmailMultiAlternatives(email.subject, email.text_body, to=[email.to_email], connection=connection)
+                    message.attach_alternative(email.html_body, 'text/html')
+                    try:
+                        message.send()
+                    except Exception as exc:
+                        _mark_failed(email, exc)
+                        failed += 1
+                    else:
+                        email.attempts += 1
+                        email.status = OUTBOX_SENT
+                        email.sent_at = timezone.now()
+                        sent += 1
+            finally:
+                if owned:
+                    connection.close()
+
+        EmailOutbox.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    return sent, failed
+
+
+def _mark_failed(email, exc):
+    email.attempts += 1
+    email.last_error = repr(exc)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OUTBOX_DEAD  # dead-lettered, left in the table for inspection
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
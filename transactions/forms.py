@@ -1,8 +1,10 @@
+import time
 from django import forms
 from .models import Transaction
 from accounts.models import UserBankAccount
-from datetime import datetime
 from .constants import TRANSFER_OUT, TRANSFER_IN
+from .ledger import Posting, post, post_many
+from . import velocity
 
 class TransactionForm(forms.ModelForm):
     class Meta:
@@ -16,9 +18,9 @@ class TransactionForm(forms.ModelForm):
         self.fields['transaction_type'].widget = forms.HiddenInput() # This will hide the transaction_type field
 
     def save(self, commit=True):
-        self.instance.account = self.account
-        self.instance.balance_after_transaction = self.account.balance
-        return super().save()
+        # Money only moves through the ledger, which records the balance
+        # after the change.
+        return post(self.account, self.cleaned_data['amount'], self.cleaned_data['transaction_type'])
     
 
 class DepositeForm(TransactionForm):
@@ -68,7 +70,7 @@ class TransferMoneyForm(forms.Form):
         account_no = self.cleaned_data['account_no']
 
         try:
-            receiver_account = UserBankAccount.objects.get(account_no = account_no)
+            receiver_account = UserBankAccount.objects.select_related('user').get(account_no = account_no)
         except UserBankAccount.DoesNotExist:
             raise forms.ValidationError("Invalid account number")
         
@@ -94,30 +96,22 @@ class TransferMoneyForm(forms.Form):
             raise forms.ValidationError("Insufficient balance")
         
         return amount
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.receiver_account and 'amount' in cleaned_data:
+            # Scored from in-memory counters, without a query.
+            assessment = velocity.assess(self.sender_account.pk, cleaned_data['amount'], self.receiver_account.pk, time.time())
+            if assessment.blocked:
+                raise forms.ValidationError("This transfer can't be made right now. Please contact the bank.")
+        return cleaned_data
     
     def save(self):
         amount = self.cleaned_data['amount']
 
-        self.sender_account.balance -= self.cleaned_data['amount']
-        self.receiver_account.balance += self.cleaned_data['amount']
-        self.sender_account.save(update_fields = ['balance'])
-        self.receiver_account.save(update_fields = ['balance'])
-
-        Transaction.objects.create(
-            account=self.sender_account,
-            amount=-amount,  # Deducted amount as negative
-            transaction_type= TRANSFER_OUT,
-            balance_after_transaction = self.sender_account.balance,
-            # description=f'Transfer to {self.receiver_account.account_no}',
-            timestamp=datetime.now(),
-        )
-
-        # Create transaction for receiver
-        Transaction.objects.create(
-            account=self.receiver_account,
-            amount=amount,  # Added amount as positive
-            transaction_type= TRANSFER_IN,
-            balance_after_transaction = self.receiver_account.balance,
-            # description=f'Transfer from {self.sender_account.account_no}',
-            timestamp=datetime.now(),
-        )
\ No newline at end of file
+        # Both legs are applied in one atomic block; the ledger raises
+        # InsufficientFunds if the sender's balance changed since clean().
+        return post_many([
+            Posting(self.sender_account, -amount, TRANSFER_OUT, self.receiver_account),  # Deducted amount as negative
+            Posting(self.receiver_account, amount, TRANSFER_IN, self.sender_account),
+        ])
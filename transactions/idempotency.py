@@ -0,0 +1,91 @@
+"""
+Idempotency keys for the money-moving POSTs.
+
+Clients send a key in the ``Idempotency-Key`` header, or the forms embed
+one in a hidden ``idempotency_key`` field. The view saves the outcome
+under that key inside the posting's own transaction. A retry then finds
+it with one lookup on the ``(user, key)`` unique index and gets the same
+redirect back without balances being touched again.
+"""
+import hashlib
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from .models import IdempotencyKey
+
+FIELD_NAME = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+# Not part of what the client asked for, so left out of the fingerprint.
+IGNORED_FIELDS = {FIELD_NAME, 'csrfmiddlewaretoken'}
+
+
+def get_key(request):
+    key = (request.headers.get('Idempotency-Key') or request.POST.get(FIELD_NAME) or '').strip()
+    return key if 0 < len(key) <= MAX_KEY_LENGTH else None
+
+
+def form_key(request):
+    # Key for the hidden form field. A re-rendered invalid form keeps its
+    # key, since nothing was saved under it.
+    return get_key(request) if request.method == 'POST' else uuid.uuid4().hex
+
+
+def fingerprint(request):
+    fields = sorted((name, value) for name, value in request.POST.items() if name not in IGNORED_FIELDS)
+    return hashlib.sha256(repr((request.path, fields)).encode()).hexdigest()
+
+
+def _stored_or_none(stored):
+    # Expired rows are deleted so the key can be used again.
+    if stored is not None and stored.expires_at <= timezone.now():
+        stored.delete()
+        return None
+    return stored
+
+
+def lookup(request):
+    stored = IdempotencyKey.objects.filter(user=request.user, key=get_key(request)).first()
+    return _stored_or_none(stored)
+
+
+async def alookup(request):
+    stored = await IdempotencyKey.objects.filter(user=request.user, key=get_key(request)).afirst()
+    if stored is not None and stored.expires_at <= timezone.now():
+        await stored.adelete()
+        return None
+    return stored
+
+
+def save(request, location, message=''):
+    """
+    Record the outcome of ``request``. Call it inside the transaction
+    that moves the money: a concurrent retry that got there first makes
+    this raise IntegrityError and roll the duplicate posting back.
+    """
+    key = get_key(request)
+    if key is None:
+        return None
+    return IdempotencyKey.objects.create(
+        user = request.user,
+        key = key,
+        fingerprint = fingerprint(request),
+        location = location,
+        message = message,
+        expires_at = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    )
+
+
+def replay(request, stored):
+    if stored.fingerprint != fingerprint(request):
+        return HttpResponse('Idempotency key was already used for a different request', status=422)
+    if stored.message:
+        messages.success(request, stored.message)
+    return redirect(stored.location)
+
+
+def purge_expired():
+    return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
@@ -0,0 +1,227 @@
+"""
+Month-end interest on savings-type accounts.
+
+``manage.py accrue_interest`` credits every account whose type has an
+annual rate in ``INTEREST_RATES`` with a month of interest on its daily
+balances::
+
+    interest = sum of the month's daily balances * annual rate / 365
+
+rounded half up to the cent. Daily balances come from DailyBalanceSnapshot,
+which only has rows for days with activity: a day without one keeps the
+previous day's closing balance, and the month opens at the last closing
+balance before it. Days before the account was opened count as zero.
+
+Accounts are taken in primary key ranges. Each range is two queries, whose
+balances (already in integer cents) go into an accounts x days array, so
+the forward fill and the interest of the whole range are a few NumPy
+operations. The arithmetic stays in integers and is exact. Without NumPy
+the same calculation runs in plain Python, much slower.
+
+The credits are posted through ``ledger.BalanceBatch``, a bulk write per
+range, together with an InterestAccrual row per account: running the same
+month again skips the accounts already credited.
+"""
+import calendar
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import BigIntegerField, DecimalField, F, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, ExtractDay, Round
+from django.utils import timezone
+from accounts.models import UserBankAccount
+from .constants import INTEREST
+from .ledger import BalanceBatch, lock_accounts
+from .models import DailyBalanceSnapshot, InterestAccrual, Transaction
+from .reconcile import account_ranges
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAYS_IN_YEAR = 365
+# Rates are held as integer millionths.
+RATE_SCALE = 10 ** 6
+
+# Interest for one account, in cents.
+Accrual = namedtuple('Accrual', ['account_id', 'account_type', 'cents'])
+
+
+def rate_table(rates=None):
+    # {account type: annual rate in millionths} from INTEREST_RATES.
+    table = {}
+    for account_type, rate in (settings.INTEREST_RATES if rates is None else rates).items():
+        scaled = Decimal(rate) * RATE_SCALE
+        if scaled < 0 or scaled != scaled.to_integral_value():
+            raise ImproperlyConfigured(f'Interest rate {rate} for {account_type!r} must be positive with at most 6 decimal places')
+        table[account_type] = int(scaled)
+    return table
+
+
+def interest_cents(balance_days, rate):
+    """
+    ``balance_days * rate / (RATE_SCALE * DAYS_IN_YEAR)`` rounded half up,
+    exactly, for Python ints or int64 arrays. Splitting off the whole
+    multiples of the denominator first keeps every product far from
+    overflowing 64 bits.
+    """
+    denominator = RATE_SCALE * DAYS_IN_YEAR
+    whole, rest = divmod(balance_days, denominator)
+    return whole * rate + (2 * rest * rate + denominator) // (2 * denominator)
+
+
+def balance_days(openings, opened, closings, days, use_numpy=None):
+    """
+    Sum of each account's daily balances over a month of ``days`` days, in
+    cents. ``openings`` are the balances the month starts at, ``opened``
+    the index of each account's first day (0 unless it opened during the
+    month) and ``closings`` three columns: account indexes, day indexes and
+    closing balances.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if not use_numpy:
+        return _balance_days_python(openings, opened, closings, days)
+
+    count = len(openings)
+    # Column 0 is the opening balance, column d + 1 the closing of day d.
+    values = numpy.zeros((count, days + 1), dtype=numpy.int64)
+    known = numpy.zeros((count, days + 1), dtype=bool)
+    values[:, 0] = openings
+    known[:, 0] = True
+    rows, columns, amounts = (numpy.asarray(column, dtype=numpy.int64) for column in closings)
+    if len(rows):
+        values[rows, columns + 1] = amounts
+        known[rows, columns + 1] = True
+    # Forward fill: every day takes the latest known column up to it.
+    latest = numpy.maximum.accumulate(numpy.where(known, numpy.arange(days + 1), 0), axis=1)
+    daily = numpy.take_along_axis(values, latest, axis=1)[:, 1:]
+    daily[numpy.arange(days) < numpy.asarray(opened)[:, None]] = 0
+    return daily.sum(axis=1)
+
+
+def _balance_days_python(openings, opened, closings, days):
+    changes = defaultdict(dict)
+    for row, day, amount in zip(*closings):
+        changes[row][day] = amount
+    totals = []
+    for row, balance in enumerate(openings):
+        account_changes = changes.get(row, {})
+        total = 0
+        for day in range(days):
+            balance = account_changes.get(day, balance)
+            if day >= opened[row]:
+                total += balance
+        totals.append(total)
+    return totals
+
+
+def cents(expression):
+    # Decimal column to integer cents, in the database.
+    return Cast(Round(expression * 100), BigIntegerField())
+
+
+def month_balances(start, end, month, rates):
+    """
+    The accounts with a rate among primary keys ``[start, end)`` opened by
+    the end of ``month``, as ``(ids, types, openings, opened, closings)``
+    ready for ``balance_days()``.
+    """
+    days = calendar.monthrange(month.year, month.month)[1]
+    last = month.replace(day=days)
+    before = DailyBalanceSnapshot.objects.filter(account=OuterRef('pk'), date__lt=month).order_by('-date')
+    since = DailyBalanceSnapshot.objects.filter(account=OuterRef('pk'), date__gte=month).order_by('date')
+    accounts = list(
+        UserBankAccount.objects.filter(pk__gte=start, pk__lt=end, account_type__in=rates, initial_deposite_date__lte=last)
+        .annotate(opening=Coalesce(
+            Subquery(before.values('closing_balance')[:1]),
+            Subquery(since.values('opening_balance')[:1]),
+            F('balance'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+        .annotate(opening_cents=cents(F('opening')))
+        .order_by('pk').values_list('pk', 'account_type', 'opening_cents', 'initial_deposite_date')
+    )
+    if not accounts:
+        return [], [], [], [], ([], [], [])
+    ids, types, openings, opened_dates = zip(*accounts)
+    opened = [(opened_date - month).days if opened_date > month else 0 for opened_date in opened_dates]
+
+    rows = {pk: row for row, pk in enumerate(ids)}
+    snapshots = (
+        DailyBalanceSnapshot.objects.filter(
+            account_id__gte=start, account_id__lt=end, account__account_type__in=rates, date__gte=month, date__lte=last,
+        )
+        .annotate(day=ExtractDay('date'), closing_cents=cents(F('closing_balance')))
+        .order_by('account_id', 'date').values_list('account_id', 'day', 'closing_cents')
+    )
+    closings = ([], [], [])
+    for account_id, day, amount in snapshots:
+        if account_id in rows:
+            closings[0].append(rows[account_id])
+            closings[1].append(day - 1)
+            closings[2].append(amount)
+    return ids, types, openings, opened, closings
+
+
+def compute_range(start, end, month, rates, use_numpy=None):
+    # [Accrual] for the accounts in [start, end) that earn anything.
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    ids, types, openings, opened, closings = month_balances(start, end, month, rates)
+    if not ids:
+        return []
+    totals = balance_days(openings, opened, closings, calendar.monthrange(month.year, month.month)[1], use_numpy)
+    if use_numpy:
+        amounts = interest_cents(totals, numpy.array([rates[account_type] for account_type in types], dtype=numpy.int64)).tolist()
+    else:
+        amounts = [interest_cents(total, rates[account_type]) for total, account_type in zip(totals, types)]
+    return [Accrual(*accrual) for accrual in zip(ids, types, amounts) if accrual[2] > 0]
+
+
+def post_accruals(month, accruals):
+    # Credit the accruals in one transaction; accounts already credited
+    # for the month are skipped. Returns the accruals posted.
+    with transaction.atomic():
+        done = set(
+            InterestAccrual.objects.filter(month=month, account_id__in=[accrual.account_id for accrual in accruals])
+            .values_list('account_id', flat=True)
+        )
+        accruals = [accrual for accrual in accruals if accrual.account_id not in done]
+        accounts = lock_accounts([accrual.account_id for accrual in accruals])
+        batch = BalanceBatch()
+        records, rows = [], []
+        for accrual in accruals:
+            account = accounts[accrual.account_id]
+            amount = Decimal(accrual.cents).scaleb(-2)
+            record = Transaction(account=account, amount=amount, transaction_type=INTEREST)
+            record.balance_after_transaction = batch.apply(account, amount, INTEREST, record)
+            records.append(record)
+            rows.append(InterestAccrual(account=account, month=month, amount=amount, transaction=record))
+        Transaction.objects.bulk_create(records)
+        batch.save()
+        InterestAccrual.objects.bulk_create(rows)
+    return accruals
+
+
+def accrue(month, chunk_size=10000, dry_run=False):
+    """
+    Accrue ``month``'s interest (``month`` is its first day) for every
+    account and return ``{account type: (accounts, total)}``. ``dry_run``
+    computes without posting.
+    """
+    if month.replace(day=calendar.monthrange(month.year, month.month)[1]) >= timezone.localdate():
+        raise ValueError(f'{month:%Y-%m} has not ended yet')
+    rates = rate_table()
+    summary = defaultdict(lambda: (0, Decimal('0.00')))
+    for start, end in account_ranges(chunk_size, DEFAULT_DB_ALIAS):
+        accruals = compute_range(start, end, month, rates)
+        if not dry_run and accruals:
+            accruals = post_accruals(month, accruals)
+        for accrual in accruals:
+            count, total = summary[accrual.account_type]
+            summary[accrual.account_type] = (count + 1, total + Decimal(accrual.cents).scaleb(-2))
+    return dict(summary)
@@ -0,0 +1,199 @@
+"""
+Single entry point for every balance change.
+
+Balances are moved with a conditional ``UPDATE ... SET balance = balance + delta``
+so concurrent requests can never lose an update, and the matching
+``Transaction`` rows are written in the same atomic block. When several
+accounts are touched at once their rows are updated (and therefore locked)
+in primary key order, so two opposite transfers can't deadlock.
+
+Every change also appends a ``LedgerEntry`` carrying the account's next
+sequence number and the running balance. The sequence counter lives on
+the account row and moves in the same UPDATE as the balance. Debits feed
+``transactions.velocity`` once they commit.
+"""
+from collections import namedtuple
+from itertools import islice
+from django.db import transaction
+from django.db.models import F
+from accounts.models import UserBankAccount
+from .constants import DEBIT_TYPES
+from . import velocity
+from .models import LedgerEntry, Transaction
+from .snapshots import record_daily_balance, record_daily_balances, ZERO
+
+
+# `counterparty` is the other account of a transfer.
+Posting = namedtuple('Posting', ['account', 'amount', 'transaction_type', 'counterparty'], defaults=[None])
+
+# Same as Posting, but the account is only known by its number (bulk imports).
+PostingRow = namedtuple('PostingRow', ['account_no', 'amount', 'transaction_type'])
+
+BulkPostResult = namedtuple('BulkPostResult', ['posted', 'rejected'])
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, account):
+        self.account = account
+        super().__init__(f"Insufficient balance in account {account.account_no}")
+
+
+def balance_delta(transaction_type, amount):
+    # Debits are stored with either sign (transfers out are negative,
+    # withdrawals positive), so normalise before touching the balance.
+    if transaction_type in DEBIT_TYPES:
+        return -abs(amount)
+    return amount
+
+
+def apply_delta(account, delta):
+    """
+    Move ``account.balance`` by ``delta`` in the database and return the new
+    balance. Raises ``InsufficientFunds`` if a debit would overdraw it.
+    ``account.ledger_sequence`` is left at the sequence number for the
+    change's ``LedgerEntry``.
+    """
+    with transaction.atomic(savepoint=False):
+        queryset = UserBankAccount.objects.filter(pk=account.pk)
+        if delta < 0:
+            queryset = queryset.filter(balance__gte=-delta)
+        if not queryset.update(balance=F('balance') + delta, ledger_sequence=F('ledger_sequence') + 1):
+            raise InsufficientFunds(account)
+        # The UPDATE holds the row lock until commit, so this read is exact.
+        account.balance, account.ledger_sequence = (
+            UserBankAccount.objects.values_list('balance', 'ledger_sequence').get(pk=account.pk)
+        )
+        record_daily_balance(account.pk, delta, account.balance)
+    return account.balance
+
+
+def ledger_entry(account, delta, transaction_type, record=None, counterparty=None):
+    # The entry for a change just applied to ``account``.
+    return LedgerEntry(
+        account = account,
+        sequence = account.ledger_sequence,
+        amount = delta,
+        balance = account.balance,
+        transaction_type = transaction_type,
+        transaction = record,
+        counterparty = counterparty,
+    )
+
+
+def post_many(postings):
+    """
+    Apply every posting and write its ``Transaction`` row atomically.
+    Returns the created transactions in the order the postings were given.
+    """
+    order = sorted(range(len(postings)), key=lambda i: postings[i].account.pk)
+    records = [None] * len(postings)
+
+    entries = []
+
+    with transaction.atomic():
+        for i in order:
+            posting = postings[i]
+            delta = balance_delta(posting.transaction_type, posting.amount)
+            balance = apply_delta(posting.account, delta)
+            records[i] = Transaction(
+                account = posting.account,
+                amount = posting.amount,
+                transaction_type = posting.transaction_type,
+                balance_after_transaction = balance,
+            )
+            entries.append(ledger_entry(posting.account, delta, posting.transaction_type, records[i], posting.counterparty))
+        Transaction.objects.bulk_create(records)
+        LedgerEntry.objects.bulk_create(entries)
+        velocity.record_after_commit(entries)
+    return records
+
+
+def post(account, amount, transaction_type):
+    return post_many([Posting(account, amount, transaction_type)])[0]
+
+
+def bulk_post(rows, chunk_size=1000):
+    """
+    Post a (possibly huge) iterable of ``PostingRow`` in chunks.
+
+    Each chunk resolves its accounts with one locking ``in_bulk`` query,
+    writes every touched balance with a single ``bulk_update`` and every
+    ``Transaction`` with a single ``bulk_create``, all in one transaction.
+    Rows for unknown accounts or that would overdraw are skipped and
+    returned in ``rejected`` as ``(row, reason)`` pairs.
+    """
+    posted = 0
+    rejected = []
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        posted += _bulk_post_chunk(chunk, rejected)
+    return BulkPostResult(posted, rejected)
+
+
+class BalanceBatch:
+    """
+    Applies many balance changes to accounts the caller has locked, then
+    writes every touched balance, ledger entry and daily snapshot back in
+    bulk.
+    """
+    def __init__(self):
+        self.touched = {}
+        self.daily = {}
+        self.entries = []
+
+    def apply(self, account, delta, transaction_type, record=None):
+        # Returns the new balance, or None if the change would overdraw.
+        # ``record`` is the change's Transaction, saved before save() runs.
+        balance = account.balance + delta
+        if balance < 0:
+            return None
+        opening, _, credits, debits = self.daily.get(account.pk, (account.balance, None, ZERO, ZERO))
+        self.daily[account.pk] = (opening, balance, credits + max(delta, ZERO), debits + max(-delta, ZERO))
+        account.balance = balance
+        account.ledger_sequence += 1
+        self.touched[account.pk] = account
+        self.entries.append(ledger_entry(account, delta, transaction_type, record))
+        return balance
+
+    def save(self, fields=()):
+        # ``fields`` lets callers write other columns they changed on the
+        # same locked accounts in the same UPDATE.
+        UserBankAccount.objects.bulk_update(self.touched.values(), ['balance', 'ledger_sequence', *fields])
+        LedgerEntry.objects.bulk_create(self.entries)
+        record_daily_balances(self.daily)
+        velocity.record_after_commit(self.entries)
+
+
+def lock_accounts(values, field_name='pk'):
+    # Balances are written back as absolute values by BalanceBatch, so the
+    # rows must stay locked (in primary key order) until the commit.
+    return (
+        UserBankAccount.objects.select_for_update(of=('self',))
+        .select_related('user')
+        .order_by('pk')
+        .in_bulk(values, field_name=field_name)
+    )
+
+
+def _bulk_post_chunk(chunk, rejected):
+    with transaction.atomic():
+        accounts = lock_accounts({row.account_no for row in chunk}, field_name='account_no')
+        batch = BalanceBatch()
+        records = []
+        for row in chunk:
+            account = accounts.get(row.account_no)
+            if account is None:
+                rejected.append((row, 'Invalid account number'))
+                continue
+            record = Transaction(account=account, amount=row.amount, transaction_type=row.transaction_type)
+            record.balance_after_transaction = batch.apply(account, balance_delta(row.transaction_type, row.amount), row.transaction_type, record)
+            if record.balance_after_transaction is None:
+                rejected.append((row, 'Insufficient balance'))
+                continue
+            records.append(record)
+        Transaction.objects.bulk_create(records)
+        batch.save()
+    return len(records)
@@ -0,0 +1,96 @@
+"""
+Loan state transitions.
+
+Every transition updates the ``Loan`` row, posts the money through the
+ledger and keeps ``UserBankAccount.active_loan_count`` in step, all in
+one transaction, so the loan limit is a field read instead of a count.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import UserBankAccount
+from . import ledger
+from .constants import LOAN, LOAN_PAID, LOAN_REQUESTED, LOAN_ACTIVE, LOAN_REPAID
+from .models import Loan, Transaction
+
+
+class LoanNotActive(Exception):
+    pass
+
+
+def request_loan(account, amount):
+    # The LOAN row moves no money until the loan is approved.
+    with transaction.atomic(savepoint=False):
+        request = Transaction.objects.create(
+            account = account,
+            amount = amount,
+            transaction_type = LOAN,
+            balance_after_transaction = account.balance,
+        )
+        return Loan.objects.create(
+            account = account,
+            principal = amount,
+            request_transaction = request,
+            requested_at = request.timestamp,
+        )
+
+
+def approve_loans(loan_ids):
+    """
+    Approve requested loans and credit every borrower in one transaction.
+    Loans that are no longer requested are skipped. Returns the approved
+    loans with ``account.user`` loaded for notifications.
+    """
+    with transaction.atomic():
+        loans = list(
+            Loan.objects.select_for_update(of=('self',))
+            .select_related('request_transaction')
+            .filter(pk__in=list(loan_ids), status=LOAN_REQUESTED, principal__gt=0)
+            .order_by('pk')
+        )
+        accounts = ledger.lock_accounts({loan.account_id for loan in loans})
+        batch = ledger.BalanceBatch()
+        now = timezone.now()
+        requests = []
+        for loan in loans:
+            loan.account = accounts[loan.account_id]
+            balance = batch.apply(loan.account, loan.principal, LOAN, loan.request_transaction)
+            loan.account.active_loan_count += 1
+            loan.status = LOAN_ACTIVE
+            loan.outstanding = loan.principal
+            loan.approved_at = now
+            if loan.request_transaction:
+                loan.request_transaction.loan_approve = True
+                loan.request_transaction.balance_after_transaction = balance
+                requests.append(loan.request_transaction)
+        batch.save(fields=['active_loan_count'])
+        Loan.objects.bulk_update(loans, ['status', 'outstanding', 'approved_at'])
+        Transaction.objects.bulk_update(requests, ['loan_approve', 'balance_after_transaction'])
+    return loans
+
+
+def repay_loan(loan_id, user):
+    """
+    Pay off an active loan of ``user`` in full with a LOAN_PAID posting.
+    Raises ``LoanNotActive`` if it isn't active (e.g. a double click) and
+    ``ledger.InsufficientFunds`` if the balance doesn't cover it.
+    """
+    # A savepoint, so the caller's transaction stays usable after either
+    # error: InsufficientFunds is raised inside the block.
+    with transaction.atomic():
+        loan = (
+            Loan.objects.select_for_update(of=('self',))
+            .select_related('account__user')
+            .filter(pk=loan_id, account__user=user, status=LOAN_ACTIVE)
+            .first()
+        )
+        if loan is not None:
+            loan.repayment_transaction = ledger.post(loan.account, loan.outstanding, LOAN_PAID)
+            loan.status = LOAN_REPAID
+            loan.outstanding = 0
+            loan.repaid_at = timezone.now()
+            loan.save(update_fields = ['repayment_transaction', 'status', 'outstanding', 'repaid_at'])
+            UserBankAccount.objects.filter(pk=loan.account_id).update(active_loan_count=F('active_loan_count') - 1)
+    if loan is None:
+        raise LoanNotActive(loan_id)
+    return loan
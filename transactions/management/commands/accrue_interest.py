@@ -0,0 +1,41 @@
+from datetime import datetime
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from transactions.interest import accrue, numpy
+from transactions.partitions import add_months, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Credit a month of interest to every account whose type has a rate '
+        'in INTEREST_RATES, from the daily balance snapshots. Accounts '
+        'already credited for the month are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM (default: last month)')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Account ids computed and posted together')
+        parser.add_argument('--dry-run', action='store_true', help='Compute and report without posting')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--month must be in YYYY-MM format')
+        else:
+            month = add_months(month_start(timezone.localdate()), -1)
+        if numpy is None:
+            self.stderr.write('NumPy is not installed, computing in plain Python')
+
+        try:
+            summary = accrue(month, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        for account_type, (accounts, total) in sorted(summary.items()):
+            self.stdout.write(f'{account_type}: {total} to {accounts} accounts')
+        accounts = sum(count for count, _ in summary.values())
+        total = sum((amount for _, amount in summary.values()), Decimal('0.00'))
+        verb = 'would be credited' if options['dry_run'] else 'credited'
+        self.stdout.write(self.style.SUCCESS(f'{month:%Y-%m}: {total} interest {verb} to {accounts} accounts'))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transactions.archive import ArchiveError, archivable_months, archive_month, archive_paths
+
+
+class Command(BaseCommand):
+    help = (
+        'Move transactions older than TRANSACTION_RETENTION_MONTHS to gzipped '
+        'NDJSON files in TRANSACTION_ARCHIVE_DIR, one month at a time, and '
+        'drop them from the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-months', type=int, default=settings.TRANSACTION_RETENTION_MONTHS, help='Months to keep in the database')
+        parser.add_argument('--database', default='default', help='Database alias')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the months that would be archived')
+
+    def handle(self, *args, **options):
+        months = archivable_months(options['retention_months'], using=options['database'])
+        total = 0
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write(f'{month:%Y-%m}')
+                continue
+            try:
+                rows = archive_month(month, using=options['database'])
+            except ArchiveError as exc:
+                raise CommandError(exc)
+            total += rows
+            self.stdout.write(f'{month:%Y-%m}: {rows} rows -> {archive_paths(month)[0]}')
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{total} transactions in {len(months)} month(s) archived'))
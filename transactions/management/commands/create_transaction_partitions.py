@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from transactions.partitions import create_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Create the monthly Transaction partitions for the coming months on PostgreSQL (run it from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3, help='Months after the current one to create')
+        parser.add_argument('--database', default='default', help='Database alias')
+
+    def handle(self, *args, **options):
+        if not is_partitioned(options['database']):
+            self.stdout.write('The transaction table is not partitioned on this database')
+            return
+        created = create_partitions(options['months_ahead'], using=options['database'])
+        for name in created:
+            self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} partition(s) created'))
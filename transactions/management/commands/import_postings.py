@@ -0,0 +1,73 @@
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from transactions.constants import DEPOSIT, WITHDRAWAL, TRANSFER_IN, TRANSFER_OUT
+from transactions.ledger import PostingRow, bulk_post
+from transactions.models import Transaction
+
+# Accepted values for the `type` column, either the name or the numeric code.
+POSTING_TYPES = {
+    'deposit': DEPOSIT,
+    'deposite': DEPOSIT,
+    'withdrawal': WITHDRAWAL,
+    'transfer_in': TRANSFER_IN,
+    'transfer_out': TRANSFER_OUT,
+}
+POSTING_TYPES.update({str(code): code for code in set(POSTING_TYPES.values())})
+
+# Amounts have to fit Transaction.amount exactly: caught here, a bad row is
+# invalid, while in bulk_create it would stop the import after earlier
+# chunks committed (or be rounded silently).
+AMOUNT_FIELD = Transaction._meta.get_field('amount')
+AMOUNT_STEP = Decimal(1).scaleb(-AMOUNT_FIELD.decimal_places)
+AMOUNT_LIMIT = Decimal(10) ** (AMOUNT_FIELD.max_digits - AMOUNT_FIELD.decimal_places)
+
+
+class Command(BaseCommand):
+    help = 'Post a CSV of (account_no, amount, type) rows, e.g. a payroll batch, through the ledger in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.invalid = 0
+        started = time.perf_counter()
+        try:
+            with open(options['csv_file'], newline='') as csv_file:
+                result = bulk_post(self.read_rows(csv_file), chunk_size=options['chunk_size'])
+        except OSError as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+
+        for row, reason in result.rejected:
+            self.stderr.write(f'Rejected {row.account_no} {row.amount}: {reason}')
+
+        total = result.posted + len(result.rejected) + self.invalid
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} rows in {elapsed:.2f}s ({rate:.0f} rows/sec): '
+            f'{result.posted} posted, {len(result.rejected)} rejected, {self.invalid} invalid'
+        ))
+
+    def read_rows(self, csv_file):
+        reader = csv.DictReader(csv_file)
+        missing = {'account_no', 'amount', 'type'} - set(reader.fieldnames or ())
+        if missing:
+            raise CommandError(f"Missing CSV column(s): {', '.join(sorted(missing))}")
+
+        for line, record in enumerate(reader, start=2):
+            try:
+                account_no = int(record['account_no'])
+                amount = Decimal(record['amount'])
+                transaction_type = POSTING_TYPES[record['type'].strip().lower()]
+                if not amount.is_finite() or not 0 < amount < AMOUNT_LIMIT or amount != amount.quantize(AMOUNT_STEP):
+                    raise InvalidOperation
+            except (KeyError, AttributeError, ValueError, InvalidOperation):
+                self.invalid += 1
+                self.stderr.write(f'Line {line}: invalid row {record}')
+                continue
+            if transaction_type == TRANSFER_OUT:
+                amount = -amount  # stored negative, like TransferMoneyForm does
+            yield PostingRow(account_no, amount, transaction_type)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from transactions.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys past IDEMPOTENCY_KEY_TTL (run it from cron)'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired idempotency key(s) deleted'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import UserBankAccount
+from transactions.snapshots import ledger_start, rebuild_daily_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily balance snapshots from transaction history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_no', nargs='*', type=int, help='Only rebuild these accounts (default: all)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Accounts rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        account_ids = UserBankAccount.objects.order_by('pk')
+        if options['account_no']:
+            account_ids = account_ids.filter(account_no__in=options['account_no'])
+        account_ids = list(account_ids.values_list('pk', flat=True))
+
+        since = ledger_start()
+        total = 0
+        chunk_size = options['chunk_size']
+        for start in range(0, len(account_ids), chunk_size):
+            with transaction.atomic():
+                # Lock the accounts so no posting lands between reading the
+                # balance and rewriting the snapshots.
+                accounts = UserBankAccount.objects.select_for_update().filter(
+                    pk__in=account_ids[start:start + chunk_size]
+                ).order_by('pk')
+                total += rebuild_daily_balances(accounts, since)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} snapshots for {len(account_ids)} accounts'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from transactions.velocity import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the transfer velocity counters from the ledger, e.g. after the cache restarted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Account ids read per query')
+
+    def handle(self, *args, **options):
+        stored = rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Velocity counters rebuilt for {stored} accounts'))
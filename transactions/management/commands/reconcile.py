@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import UserBankAccount
+from core.db_router import replica_alias
+from transactions.reconcile import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify every account balance against its ledger entries: sequence '
+        'numbers without gaps, running balances that add up and an account '
+        'balance equal to the last entry. Exits with an error if anything '
+        'is off.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Account ids checked per query')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks checked in parallel')
+        parser.add_argument('--database', help='Database alias to check (default: the replica if there is one)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        using = options['database'] or replica_alias()
+        discrepancies = reconcile(chunk_size=options['chunk_size'], workers=options['workers'], using=using)
+        for discrepancy in discrepancies:
+            self.stdout.write(f'{discrepancy.account_no}: {discrepancy.problem}: {discrepancy.detail}')
+
+        accounts = UserBankAccount.objects.using(using).count()
+        elapsed = time.perf_counter() - started
+        if discrepancies:
+            raise CommandError(f'{len(discrepancies)} discrepancies in {accounts} accounts')
+        self.stdout.write(self.style.SUCCESS(f'{accounts} accounts reconciled in {elapsed:.2f}s'))
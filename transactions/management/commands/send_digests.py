@@ -0,0 +1,28 @@
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from transactions.emails import queue_digests
+
+
+class Command(BaseCommand):
+    help = (
+        'Turn due notifications for hourly and daily digest accounts into '
+        'one email per customer. Run it from cron (every few minutes is '
+        'fine: notifications carry their own due time) or with --loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Customers per transaction')
+        parser.add_argument('--deliver', action='store_true', help='Drain the outbox afterwards, as send_outbox_emails does')
+        parser.add_argument('--loop', action='store_true', help='Keep running instead of exiting once nothing is due')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds to sleep between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            digests, notifications = queue_digests(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Queued {digests} digest(s) covering {notifications} notification(s)'))
+            if options['deliver'] and digests:
+                call_command('send_outbox_emails', stdout=self.stdout)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,34 @@
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from transactions.emails import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued transaction emails from the outbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is drained')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep between polls when the outbox is empty')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        # One SMTP session for every batch until the outbox is drained.
+        connection = get_connection()
+        try:
+            while True:
+                sent, failed = deliver_outbox(batch_size=options['batch_size'], connection=connection)
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'Sent {sent}, failed {failed}')
+                    continue
+                if not options['loop']:
+                    break
+                connection.close()  # don't hold an idle session while sleeping
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS(f'Outbox drained: {total_sent} sent, {total_failed} failed'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_useraddress_post_code_and_more'),
+        ('transactions', '0004_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'timestamp', 'id'], name='transaction_account_1b25b2_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_useraddress_post_code_and_more'),
+        ('transactions', '0005_transaction_account_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('credits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('debits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_daily_balance_snapshot')],
+            },
+        ),
+    ]
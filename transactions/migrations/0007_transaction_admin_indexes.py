@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_useraddress_post_code_and_more'),
+        ('transactions', '0006_dailybalancesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'loan_approve'], name='transaction_transac_a27df2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp'], name='transaction_timesta_20dac7_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_userbankaccount_active_loan_count'),
+        ('transactions', '0008_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Loan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('principal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('status', models.CharField(choices=[('requested', 'Requested'), ('active', 'Active'), ('repaid', 'Repaid')], default='requested', max_length=10)),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('approved_at', models.DateTimeField(blank=True, null=True)),
+                ('repaid_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loans', to='accounts.userbankaccount')),
+                ('repayment_transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='repaid_loan', to='transactions.transaction')),
+                ('request_transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loan', to='transactions.transaction')),
+            ],
+            options={
+                'ordering': ['requested_at'],
+                'indexes': [models.Index(fields=['account', 'requested_at'], name='loan_account_requested_idx'), models.Index(condition=models.Q(('status', 'active')), fields=['account'], name='loan_active_account_idx'), models.Index(condition=models.Q(('status', 'requested')), fields=['requested_at'], name='loan_pending_idx')],
+            },
+        ),
+    ]
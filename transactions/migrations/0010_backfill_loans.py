@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Count
+
+# Constants as they were when this migration was written.
+LOAN = 3
+LOAN_PAID = 4
+
+
+def backfill_loans(apps, schema_editor):
+    # One Loan per LOAN row. Rows that PayLoanView turned into LOAN_PAID
+    # in place were loans that have since been repaid.
+    Transaction = apps.get_model('transactions', 'Transaction')
+    Loan = apps.get_model('transactions', 'Loan')
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+
+    rows = Transaction.objects.filter(transaction_type__in=[LOAN, LOAN_PAID]).order_by('pk').iterator(chunk_size=2000)
+    loans = []
+    for row in rows:
+        if row.transaction_type == LOAN_PAID:
+            status, outstanding, approved_at, repaid_at = 'repaid', 0, row.timestamp, row.timestamp
+        elif row.loan_approve:
+            status, outstanding, approved_at, repaid_at = 'active', row.amount, row.timestamp, None
+        else:
+            status, outstanding, approved_at, repaid_at = 'requested', 0, None, None
+        loans.append(Loan(
+            account_id = row.account_id,
+            principal = abs(row.amount),
+            outstanding = outstanding,
+            status = status,
+            request_transaction_id = row.pk,
+            requested_at = row.timestamp,
+            approved_at = approved_at,
+            repaid_at = repaid_at,
+        ))
+        if len(loans) >= 2000:
+            Loan.objects.bulk_create(loans)
+            loans = []
+    Loan.objects.bulk_create(loans)
+
+    active = Loan.objects.filter(status='active').values('account_id').annotate(count=Count('id')).order_by()
+    for row in active:
+        UserBankAccount.objects.filter(pk=row['account_id']).update(active_loan_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0009_loan'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_loans, migrations.RunPython.noop),
+    ]
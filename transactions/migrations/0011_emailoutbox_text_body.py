@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_backfill_loans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='text_body',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations
+
+# Existing balances can't be rebuilt from the old Transaction rows (some
+# recorded the balance before the change, loan rows were edited in place),
+# so each account's ledger starts from its balance at migration time.
+
+APPEND_ONLY_SQL = """
+CREATE OR REPLACE FUNCTION transactions_ledgerentry_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'transactions_ledgerentry is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER transactions_ledgerentry_append_only
+    BEFORE UPDATE OR DELETE ON transactions_ledgerentry
+    FOR EACH ROW EXECUTE FUNCTION transactions_ledgerentry_append_only();
+"""
+
+DROP_APPEND_ONLY_SQL = """
+DROP TRIGGER IF EXISTS transactions_ledgerentry_append_only ON transactions_ledgerentry;
+DROP FUNCTION IF EXISTS transactions_ledgerentry_append_only();
+"""
+
+
+def opening_entries(apps, schema_editor):
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    LedgerEntry = apps.get_model('transactions', 'LedgerEntry')
+
+    accounts = UserBankAccount.objects.exclude(balance=0).order_by('pk').iterator(chunk_size=2000)
+    entries = []
+    for account in accounts:
+        entries.append(LedgerEntry(account_id=account.pk, sequence=1, amount=account.balance, balance=account.balance))
+        if len(entries) >= 2000:
+            LedgerEntry.objects.bulk_create(entries)
+            entries = []
+    LedgerEntry.objects.bulk_create(entries)
+    UserBankAccount.objects.exclude(balance=0).update(ledger_sequence=1)
+
+
+def add_trigger(apps, schema_editor):
+    # Enforced by the database on PostgreSQL; elsewhere only by the model.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(APPEND_ONLY_SQL)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_APPEND_ONLY_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0013_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(opening_entries, migrations.RunPython.noop),
+        migrations.RunPython(add_trigger, drop_trigger),
+    ]
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+import django.db.models.deletion
+from django.db import migrations, models
+
+# On PostgreSQL transactions_transaction is rebuilt as a table partitioned
+# by month on "timestamp" (see transactions/partitions.py), with partitions
+# for every month that has rows up to three months ahead. A partitioned
+# table's primary key has to include the partition key, so it becomes
+# (id, timestamp) and nothing can reference id alone: the loan foreign keys
+# lose their database constraint, like LedgerEntry.transaction already has.
+#
+# The rows are copied with one INSERT ... SELECT inside the migration's
+# transaction, which holds an ACCESS EXCLUSIVE lock on the table until it
+# commits: no transaction can be read or posted meanwhile, for a time that
+# grows with the table. Apply it during a maintenance window.
+
+TABLE = 'transactions_transaction'
+MONTHS_AHEAD = 3
+
+
+def add_months(year, month, months):
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def table_definitions(cursor):
+    # Index and foreign key DDL of the table, to recreate on the new one.
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s',
+        [TABLE, f'{TABLE}_pkey'],
+    )
+    indexes = [indexdef for indexdef, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    return indexes, cursor.fetchall()
+
+
+def rebuild(cursor, partition_by, primary_key, months=()):
+    indexes, foreign_keys = table_definitions(cursor)
+    cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+    cursor.execute(f'CREATE TABLE {TABLE} (LIKE {TABLE}_old) {partition_by}')
+    for year, month in months:
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(*add_months(year, month, 1), 1, tzinfo=timezone.utc)
+        cursor.execute(
+            f'CREATE TABLE {TABLE}_y{year:04d}m{month:02d} PARTITION OF {TABLE} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    if months:
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+    cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+    # Takes the old id sequence and indexes (whose names are reused) with it.
+    cursor.execute(f'DROP TABLE {TABLE}_old')
+
+    cursor.execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+    cursor.execute(f"SELECT setval('{TABLE}_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM {TABLE}")
+    cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+    cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})')
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN("timestamp") FROM {TABLE}')
+        first = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        year, month = (first.year, first.month) if first else (now.year, now.month)
+        months = []
+        while (year, month) <= add_months(now.year, now.month, MONTHS_AHEAD):
+            months.append((year, month))
+            year, month = add_months(year, month, 1)
+        rebuild(cursor, 'PARTITION BY RANGE ("timestamp")', 'id, "timestamp"', months)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        rebuild(cursor, '', 'id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0014_ledger_opening_entries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loan',
+            name='repayment_transaction',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='repaid_loan', to='transactions.transaction'),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='request_transaction',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loan', to='transactions.transaction'),
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
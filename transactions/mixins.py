@@ -0,0 +1,68 @@
+from django.contrib import messages
+from django.db import IntegrityError
+from django.shortcuts import redirect
+from . import bank_status, idempotency
+
+
+class BankNotBankruptMixin:
+    # Blocks the view while the bank is flagged bankrupt in BankSettings.
+    bankrupt_message = "The bank is currently bankrupt. This operation is not allowed."
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        if bank_status.is_bankrupt():
+            messages.error(request, self.bankrupt_message)
+            return redirect('home')  # Redirect to a safe page
+        return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        if await bank_status.ais_bankrupt():
+            messages.error(request, self.bankrupt_message)
+            return redirect('home')
+        return await super().dispatch(request, *args, **kwargs)
+
+
+
+class IdempotentPostMixin:
+    # Replays the saved outcome of a POST retried with the same idempotency
+    # key. The view calls idempotency.save() inside its posting transaction.
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['idempotency_key'] = idempotency.form_key(self.request)
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'POST' or idempotency.get_key(request) is None:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.adispatch_idempotent(request, *args, **kwargs)
+        if not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        stored = idempotency.lookup(request)
+        if stored:
+            return idempotency.replay(request, stored)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except IntegrityError:
+            # A concurrent retry saved the key first and this posting was
+            # rolled back with it.
+            stored = idempotency.lookup(request)
+            if stored is None:
+                raise
+            return idempotency.replay(request, stored)
+
+    async def adispatch_idempotent(self, request, *args, **kwargs):
+        # Async views resolve request.user before getting here.
+        stored = await idempotency.alookup(request)
+        if stored:
+            return idempotency.replay(request, stored)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except IntegrityError:
+            stored = await idempotency.alookup(request)
+            if stored is None:
+                raise
+            return idempotency.replay(request, stored)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from accounts.models import UserBankAccount
-from .constants import TRANSACTION_TYPE
+from .constants import TRANSACTION_TYPE, OUTBOX_STATUS, OUTBOX_PENDING, LOAN_STATUS, LOAN_REQUESTED, LOAN_ACTIVE
 
 # Create your models here.
 class Transaction(models.Model):
@@ -13,9 +15,191 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Seek pagination and date range filters on the report page.
+            models.Index(fields=['account', 'timestamp', 'id']),
+            # Admin changelist filters and default ordering.
+            models.Index(fields=['transaction_type', 'loan_approve']),
+            models.Index(fields=['timestamp']),
+        ]
+
+class LedgerEntryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError('Ledger entries are append-only')
+
+    def delete(self):
+        raise TypeError('Ledger entries are append-only')
+
+
+class LedgerEntry(models.Model):
+    # Append-only record of every balance change, written by
+    # transactions.ledger. `sequence` numbers an account's entries from 1
+    # without gaps and `balance` is the running balance after the entry;
+    # `manage.py reconcile` checks both against UserBankAccount.balance.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.PROTECT, related_name='ledger_entries')
+    sequence = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # signed: debits are negative
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    # None for the opening entry carried over when the ledger was introduced.
+    transaction_type = models.IntegerField(choices=TRANSACTION_TYPE, null=True, blank=True)
+    # The other account of a transfer, which transactions.velocity needs to
+    # tell new receivers from known ones.
+    counterparty = models.ForeignKey(
+        UserBankAccount, null=True, blank=True, on_delete=models.PROTECT, related_name='+',
+    )
+    # No FK constraint: the entry outlives its Transaction row if that is archived.
+    transaction = models.OneToOneField(
+        Transaction, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='ledger_entry',
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = LedgerEntryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['account', 'sequence']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_ledger_sequence'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} #{self.sequence}: {self.amount} -> {self.balance}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError('Ledger entries are append-only')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError('Ledger entries are append-only')
+
+class InterestAccrual(models.Model):
+    # One month's interest credited to an account by transactions.interest;
+    # the unique constraint keeps a rerun from crediting it twice.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='interest_accruals')
+    month = models.DateField()  # first day of the month
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    transaction = models.OneToOneField(
+        Transaction, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='interest_accrual',
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['month']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'month'], name='unique_interest_accrual'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} - {self.month:%Y-%m}: {self.amount}"
+
+class Loan(models.Model):
+    # Current state of a loan. The money itself moves through Transaction
+    # postings: the LOAN row credited on approval and the LOAN_PAID row
+    # debited on repayment.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='loans')
+    principal = models.DecimalField(max_digits=12, decimal_places=2)
+    outstanding = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    status = models.CharField(max_length=10, choices=LOAN_STATUS, default=LOAN_REQUESTED)
+    # No FK constraints: the partitioned Transaction table has no unique id
+    # to reference, and the rows may be archived.
+    request_transaction = models.OneToOneField(
+        Transaction, null=True, blank=True, on_delete=models.SET_NULL, db_constraint=False, related_name='loan',
+    )
+    repayment_transaction = models.OneToOneField(
+        Transaction, null=True, blank=True, on_delete=models.SET_NULL, db_constraint=False, related_name='repaid_loan',
+    )
+    requested_at = models.DateTimeField(default=timezone.now)
+    approved_at = models.DateTimeField(null=True, blank=True)
+    repaid_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['requested_at']
+        indexes = [
+            # The borrower's loan list.
+            models.Index(fields=['account', 'requested_at'], name='loan_account_requested_idx'),
+            # Only the few open loans are indexed for these two lookups.
+            models.Index(fields=['account'], condition=models.Q(status=LOAN_ACTIVE), name='loan_active_account_idx'),
+            models.Index(fields=['requested_at'], condition=models.Q(status=LOAN_REQUESTED), name='loan_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account.account_no} - {self.principal} ({self.status})"
+
+class DailyBalanceSnapshot(models.Model):
+    # One row per account per day with activity, kept current by the ledger
+    # and rebuilt from history with `manage.py rebuild_daily_balances`.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    credits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    debits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_daily_balance_snapshot'),
+        ]
+
+    def __str__(self):
+        return f"{self.account.account_no} - {self.date}"
 
 class BankSettings(models.Model):
     is_bankrupt = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.is_bankrupt}"
\ No newline at end of file
+        return f"{self.is_bankrupt}"
+
+class EmailOutbox(models.Model):
+    # Rows are written in the same DB transaction as the balance change and
+    # delivered later by the `send_outbox_emails` management command.
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField(blank=True)
+    html_body = models.TextField()
+    status = models.CharField(max_length=10, choices=OUTBOX_STATUS, default=OUTBOX_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.subject} ({self.status})"
+
+class PendingNotification(models.Model):
+    # A transaction email for an account on an hourly or daily digest. Held
+    # until `digest_at`, then folded into one email by `send_digests`.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='pending_notifications')
+    subject = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+    digest_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.subject} (due {self.digest_at})"
+
+
+class IdempotencyKey(models.Model):
+    # Outcome of a money-moving POST, written in the same DB transaction as
+    # the posting and replayed when the client retries with the same key.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    location = models.CharField(max_length=255)
+    message = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
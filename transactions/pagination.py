@@ -0,0 +1,100 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+from django.db import connections
+
+
+# `object_list` is in (timestamp, id) order; a cursor is None when there
+# is nothing further that way.
+KeysetPage = namedtuple('KeysetPage', ['object_list', 'older_cursor', 'newer_cursor'])
+
+
+def encode_cursor(obj):
+    # Microseconds since the epoch plus the id, e.g. "1733900000000000.42".
+    epoch_us = int(obj.timestamp.timestamp()) * 1_000_000 + obj.timestamp.microsecond
+    return f"{epoch_us}.{obj.pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        epoch_us, pk = cursor.split('.')
+        epoch_us, pk = int(epoch_us), int(pk)
+        timestamp = datetime.fromtimestamp(epoch_us // 1_000_000, tz=timezone.utc)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+    return timestamp.replace(microsecond=epoch_us % 1_000_000), pk
+
+
+def keyset_paginate(queryset, older=None, newer=None, page_size=50):
+    """
+    Seek pagination over ``(timestamp, id)``, newest page first.
+
+    Unlike OFFSET, every page is a bounded range scan on the
+    ``(account, timestamp, id)`` index, so page N costs the same as page 1.
+    ``older`` / ``newer`` are cursors returned on a previous page.
+    """
+    older, newer = decode_cursor(older) if older else None, decode_cursor(newer) if newer else None
+    return _make_page(list(_seek(queryset, older, newer, page_size)), older, newer, page_size)
+
+
+async def akeyset_paginate(queryset, older=None, newer=None, page_size=50):
+    # keyset_paginate() for async views.
+    older, newer = decode_cursor(older) if older else None, decode_cursor(newer) if newer else None
+    rows = [row async for row in _seek(queryset, older, newer, page_size)]
+    return _make_page(rows, older, newer, page_size)
+
+
+def _seek(queryset, older, newer, page_size):
+    # One row more than the page, to tell whether another page follows.
+    if newer:
+        timestamp, pk = newer
+        return (
+            queryset.filter(timestamp__gte=timestamp)
+            .exclude(timestamp=timestamp, id__lte=pk)
+            .order_by('timestamp', 'id')[:page_size + 1]
+        )
+    if older:
+        timestamp, pk = older
+        queryset = queryset.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=pk)
+    return queryset.order_by('-timestamp', '-id')[:page_size + 1]
+
+
+def _make_page(rows, older, newer, page_size):
+    if newer:
+        has_newer = len(rows) > page_size
+        rows = rows[:page_size]
+        has_older = True
+    else:
+        # Read newest first; shown oldest first like the rest of the report.
+        has_older = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_newer = older is not None
+
+    return KeysetPage(
+        rows,
+        encode_cursor(rows[0]) if rows and has_older else None,
+        encode_cursor(rows[-1]) if rows and has_newer else None,
+    )
+
+
+def stream_values(queryset, fields, chunk_size):
+    """
+    Yield ``values_list(*fields)`` rows in ``(timestamp, id)`` order with
+    flat memory. ``fields`` must include both.
+
+    Normally a server-side cursor streams the rows. Behind a transaction
+    pooler (``DISABLE_SERVER_SIDE_CURSORS``) ``.iterator()`` would fetch the
+    whole result at once, so the rows are read in keyset pages instead.
+    """
+    queryset = queryset.order_by('timestamp', 'id')
+    if not connections[queryset.db].settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        yield from queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+        return
+    timestamp_index, id_index = fields.index('timestamp'), fields.index('id')
+    page = queryset
+    while True:
+        rows = list(page.values_list(*fields)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        timestamp, pk = rows[-1][timestamp_index], rows[-1][id_index]
+        page = queryset.filter(timestamp__gte=timestamp).exclude(timestamp=timestamp, id__lte=pk)
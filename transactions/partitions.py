@@ -0,0 +1,128 @@
+"""
+Monthly partitions of the Transaction table on PostgreSQL.
+
+Migration 0015 makes ``transactions_transaction`` a table partitioned by
+range on ``timestamp``: one partition per calendar month (UTC), named like
+``transactions_transaction_y2026m01``, plus a default partition for rows
+outside all of them. Queries filtered on ``timestamp`` (the report, the
+statement export, date ranges) only scan the months they cover, and old
+months can be dropped whole once ``manage.py archive_transactions`` has
+written them out.
+
+``manage.py create_transaction_partitions`` creates the coming months ahead
+of time. A month it missed has its rows in the default partition; they are
+moved into the month's partition when it is created. On other databases the
+table isn't partitioned and these helpers do nothing.
+
+Migration 0015 copies the whole table into the partitioned one in a single
+transaction, holding an exclusive lock on it throughout: transactions can't
+be read or written until it finishes, which takes time proportional to the
+table's size. Run it in a maintenance window.
+"""
+import re
+from datetime import date, datetime, timezone
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from .models import Transaction
+
+TABLE = Transaction._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+_partition_name = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    # [start, end) of the month in UTC, the partition bounds.
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end = add_months(month, 1)
+    return start, datetime(end.year, end.month, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def partitions(using=DEFAULT_DB_ALIAS):
+    # {month: partition name} of the monthly partitions that exist.
+    if not is_partitioned(using):
+        return {}
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [TABLE],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = _partition_name.match(name)
+        if match:
+            months[date(int(match[1]), int(match[2]), 1)] = name
+    return dict(sorted(months.items()))
+
+
+def create_partitions(months_ahead=3, using=DEFAULT_DB_ALIAS, today=None):
+    """
+    Make sure this month and the next ``months_ahead`` have a partition and
+    return the names of the ones created.
+    """
+    if not is_partitioned(using):
+        return []
+    existing = partitions(using)
+    current = month_start(today or datetime.now(timezone.utc))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            create_partition(month, using)
+            created.append(partition_name(month))
+    return created
+
+
+def create_partition(month, using=DEFAULT_DB_ALIAS):
+    # PostgreSQL refuses a partition for rows the default partition holds,
+    # so when it has some of the month's the default is detached while they
+    # move across, all in one transaction.
+    name = partition_name(month)
+    start, end = month_bounds(month)
+    # Bounds are literals in DDL, which takes no query parameters.
+    create = (
+        f'CREATE TABLE {name} PARTITION OF {TABLE} '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    in_month = '"timestamp" >= %s AND "timestamp" < %s'
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_month} LIMIT 1', [start, end])
+        if cursor.fetchone() is None:
+            cursor.execute(create)
+            return
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(create)
+        cursor.execute(f'INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}', [start, end])
+        cursor.execute(f'DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}', [start, end])
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+
+
+def drop_partition(month, using=DEFAULT_DB_ALIAS):
+    name = partition_name(month)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
@@ -0,0 +1,96 @@
+"""
+Ledger checks behind ``manage.py reconcile``.
+
+Accounts are split into primary key ranges and each range is checked with
+two queries, so the work happens in the database (window functions over
+the ledger) rather than in Python loops, and ranges can run in parallel.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import DecimalField, F, Max, Min, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import Abs, Coalesce, RowNumber
+from accounts.models import UserBankAccount
+from .models import LedgerEntry
+
+# Running sums come back as floats on SQLite, so allow for rounding.
+TOLERANCE = Decimal('0.005')
+
+Discrepancy = namedtuple('Discrepancy', ['account_no', 'problem', 'detail'])
+
+
+def entry_discrepancies(start, end, using):
+    # Entries whose sequence or running balance doesn't follow from the
+    # entries before them.
+    window = {'partition_by' : [F('account_id')], 'order_by' : F('sequence').asc()}
+    entries = (
+        LedgerEntry.objects.using(using).filter(account_id__gte=start, account_id__lt=end)
+        .annotate(
+            running = Window(Sum('amount'), output_field=DecimalField(max_digits=14, decimal_places=2), **window),
+            position = Window(RowNumber(), **window),
+        )
+        .annotate(drift=Abs(F('running') - F('balance')))
+        .filter(Q(drift__gte=TOLERANCE) | ~Q(position=F('sequence')))
+        .order_by('account_id', 'sequence')
+        .values_list('account__account_no', 'sequence', 'position', 'balance', 'running', 'drift')
+    )
+    for account_no, sequence, position, balance, running, drift in entries:
+        if sequence != position:
+            yield Discrepancy(account_no, 'sequence', f'entry #{position} has sequence {sequence}')
+        if drift >= TOLERANCE:
+            yield Discrepancy(account_no, 'running balance', f'entry #{sequence} says {balance}, entries sum to {running}')
+
+
+def account_discrepancies(start, end, using):
+    # Accounts whose balance or sequence counter doesn't match their last entry.
+    latest = LedgerEntry.objects.filter(account=OuterRef('pk')).order_by('-sequence')
+    accounts = (
+        UserBankAccount.objects.using(using).filter(pk__gte=start, pk__lt=end)
+        .annotate(
+            ledger_balance = Coalesce(Subquery(latest.values('balance')[:1]), Decimal(0), output_field=DecimalField()),
+            last_sequence = Coalesce(Subquery(latest.values('sequence')[:1]), 0),
+        )
+        .filter(~Q(balance=F('ledger_balance')) | ~Q(ledger_sequence=F('last_sequence')))
+        .order_by('pk')
+        .values_list('account_no', 'balance', 'ledger_balance', 'ledger_sequence', 'last_sequence')
+    )
+    for account_no, balance, ledger_balance, ledger_sequence, last_sequence in accounts:
+        if balance != ledger_balance:
+            yield Discrepancy(account_no, 'account balance', f'balance is {balance}, ledger says {ledger_balance}')
+        if ledger_sequence != last_sequence:
+            yield Discrepancy(account_no, 'account sequence', f'counter is {ledger_sequence}, last entry is #{last_sequence}')
+
+
+def reconcile_range(bounds, using):
+    start, end = bounds
+    return [*entry_discrepancies(start, end, using), *account_discrepancies(start, end, using)]
+
+
+def _reconcile_in_thread(bounds, using):
+    try:
+        return reconcile_range(bounds, using)
+    finally:
+        connections[using].close()  # each worker thread opened its own
+
+
+def account_ranges(chunk_size, using):
+    bounds = UserBankAccount.objects.using(using).aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    return [(start, start + chunk_size) for start in range(bounds['low'], bounds['high'] + 1, chunk_size)]
+
+
+def reconcile(chunk_size=10000, workers=4, using=DEFAULT_DB_ALIAS):
+    """
+    Check every account on database ``using`` and return the list of
+    ``Discrepancy`` found. Ranges of ``chunk_size`` primary keys are
+    checked on ``workers`` threads, each with its own connection.
+    """
+    ranges = account_ranges(chunk_size, using)
+    if workers <= 1:
+        results = [reconcile_range(bounds, using) for bounds in ranges]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_reconcile_in_thread, ranges, [using] * len(ranges)))
+    return [discrepancy for chunk in results for discrepancy in chunk]
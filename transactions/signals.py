@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import BankSettings
+from . import bank_status
+
+
+@receiver(post_save, sender=BankSettings)
+@receiver(post_delete, sender=BankSettings)
+def invalidate_bank_status(sender, **kwargs):
+    bank_status.invalidate()
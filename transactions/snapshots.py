@@ -0,0 +1,170 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.db.models.functions import Abs, TruncDate
+from django.utils import timezone
+from .constants import DEBIT_TYPES, LOAN, LOAN_PAID
+from .models import DailyBalanceSnapshot, LedgerEntry, Transaction
+
+ZERO = Decimal('0.00')
+
+
+def date_range_filter(start_date, end_date):
+    # Compare the raw timestamp against the day boundaries instead of
+    # `timestamp__date`, which casts the column and can't use the index.
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return {'timestamp__gte' : start, 'timestamp__lt' : end}
+
+
+def record_daily_balances(changes, date=None):
+    """
+    Fold balance changes into today's snapshot rows.
+
+    ``changes`` maps an account id to ``(opening, closing, credits, debits)``
+    for this batch. Callers hold the account rows locked, so the snapshot
+    rows can be written back with absolute values.
+    """
+    date = date or timezone.localdate()
+    existing = {
+        snapshot.account_id: snapshot
+        for snapshot in DailyBalanceSnapshot.objects.filter(account_id__in=changes, date=date)
+    }
+    created = []
+    for account_id, (opening, closing, credits, debits) in changes.items():
+        snapshot = existing.get(account_id)
+        if snapshot is None:
+            created.append(DailyBalanceSnapshot(
+                account_id = account_id,
+                date = date,
+                opening_balance = opening,
+                closing_balance = closing,
+                credits = credits,
+                debits = debits,
+            ))
+        else:
+            snapshot.closing_balance = closing
+            snapshot.credits += credits
+            snapshot.debits += debits
+    if existing:
+        DailyBalanceSnapshot.objects.bulk_update(existing.values(), ['closing_balance', 'credits', 'debits'])
+    if created:
+        DailyBalanceSnapshot.objects.bulk_create(created)
+
+
+def record_daily_balance(account_id, delta, balance):
+    record_daily_balances({
+        account_id: (balance - delta, balance, max(delta, ZERO), max(-delta, ZERO)),
+    })
+
+
+def balance_summary(account, start_date, end_date):
+    """
+    Opening/closing balance and credit/debit totals for a date range in two
+    indexed snapshot queries, however many transactions the range holds.
+    """
+    opening, totals = _summary_queries(account, start_date, end_date)
+    return _summary(opening.first(), totals.aggregate(credits=Sum('credits'), debits=Sum('debits')))
+
+
+async def abalance_summary(account, start_date, end_date):
+    # balance_summary() for async views.
+    opening, totals = _summary_queries(account, start_date, end_date)
+    return _summary(await opening.afirst(), await totals.aaggregate(credits=Sum('credits'), debits=Sum('debits')))
+
+
+def _summary_queries(account, start_date, end_date):
+    opening = (
+        DailyBalanceSnapshot.objects.filter(account=account, date__lt=start_date)
+        .order_by('-date').values_list('closing_balance', flat=True)
+    )
+    totals = DailyBalanceSnapshot.objects.filter(account=account, date__gte=start_date, date__lte=end_date)
+    return opening, totals
+
+
+def _summary(opening, totals):
+    opening = opening or ZERO
+    credits = totals['credits'] or ZERO
+    debits = totals['debits'] or ZERO
+    return {
+        'opening_balance' : opening,
+        'closing_balance' : opening + credits - debits,
+        'credits' : credits,
+        'debits' : debits,
+    }
+
+
+def balance_delta_expression():
+    # SQL version of ledger.balance_delta(). Loan requests only move money
+    # once they are approved. Loans repaid before repayments were postings
+    # of their own had their LOAN row turned into LOAN_PAID in place: that
+    # row stands for both the credit and the repayment, so it nets to zero.
+    # Repayments posted since are separate rows that were never approved.
+    return Case(
+        When(transaction_type=LOAN_PAID, loan_approve=True, then=Value(ZERO)),
+        When(transaction_type__in=DEBIT_TYPES, then=-Abs('amount')),
+        When(transaction_type=LOAN, loan_approve=False, then=Value(ZERO)),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def ledger_start():
+    """
+    When the ledger's opening entries were written (migration 0014), or
+    None. Transactions from before then don't add up to the balances they
+    left (see that migration), so snapshots start there, seeded like the
+    ledger from the balance the account had.
+    """
+    return (
+        LedgerEntry.objects.filter(sequence=1, transaction_type__isnull=True)
+        .order_by('created_at').values_list('created_at', flat=True).first()
+    )
+
+
+def rebuild_daily_balances(accounts, since=None):
+    """
+    Recompute every snapshot for ``accounts`` from their transactions at or
+    after ``since`` (all of them if None).
+
+    Daily credit/debit totals are aggregated in the database. Balances are
+    then walked backwards from each account's current balance, which is
+    the one figure known to be right.
+    """
+    accounts = {account.pk: account for account in accounts}
+    days = defaultdict(list)
+    transactions = Transaction.objects.filter(account_id__in=accounts)
+    if since is not None:
+        transactions = transactions.filter(timestamp__gte=since)
+    rows = (
+        transactions
+        .annotate(delta=balance_delta_expression())
+        .values('account_id', day=TruncDate('timestamp'))
+        .annotate(
+            credits=Sum(Case(When(delta__gt=0, then=F('delta')), default=Value(ZERO))),
+            debits=Sum(Case(When(delta__lt=0, then=-F('delta')), default=Value(ZERO))),
+        )
+        .order_by()
+    )
+    for row in rows:
+        days[row['account_id']].append((row['day'], row['credits'], row['debits']))
+
+    snapshots = []
+    for account_id, account_days in days.items():
+        closing = accounts[account_id].balance
+        for day, credits, debits in sorted(account_days, reverse=True):
+            opening = closing - credits + debits
+            snapshots.append(DailyBalanceSnapshot(
+                account_id = account_id,
+                date = day,
+                opening_balance = opening,
+                closing_balance = closing,
+                credits = credits,
+                debits = debits,
+            ))
+            closing = opening
+
+    DailyBalanceSnapshot.objects.filter(account_id__in=accounts).delete()
+    DailyBalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
@@ -1,3 +1,923 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from io import StringIO
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from accounts.constants import NOTIFY_HOURLY
+from accounts.models import UserBankAccount
+from core.instrumentation import render_timings
+from core.paginator import EstimatedCountPaginator
+from core.testing import QueryBudgetMixin
+from . import archive, bank_status, idempotency, interest, ledger, loans, pagination, partitions, reconcile, snapshots, velocity
+from .constants import DEPOSIT, WITHDRAWAL, INTEREST, LOAN, LOAN_PAID, TRANSFER_IN, TRANSFER_OUT, OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_DEAD, LOAN_ACTIVE, LOAN_REPAID
+from .emails import deliver_outbox, queue_digests, queue_transaction_emails
+from .models import BankSettings, DailyBalanceSnapshot, EmailOutbox, IdempotencyKey, InterestAccrual, LedgerEntry, Loan, PendingNotification, Transaction
 
 # Create your tests here.
+
+def create_account(username, balance=0, account_no=None):
+    user = User.objects.create_user(username=username, password='pass12345', email=f'{username}@example.com')
+    account = UserBankAccount.objects.create(
+        user = user,
+        account_type = 'saving',
+        gender = 'Male',
+        account_no = account_no or 100000 + user.id,
+        balance = Decimal(balance),
+    )
+    return account
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('SMTP server unavailable')
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    connections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingEmailBackend.connections += 1
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def test_deposit_queues_email_instead_of_sending(self):
+        self.client.post(reverse('deposite'), {'amount': '600'})
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.status, OUTBOX_PENDING)
+        self.assertEqual(queued.to_email, 'alice@example.com')
+
+    def test_worker_delivers_queued_emails(self):
+        self.client.post(reverse('deposite'), {'amount': '600'})
+        call_command('send_outbox_emails', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Deposite Confirmation')
+        self.assertIn('Thank you for depositing 600 to your account.', mail.outbox[0].body)
+        self.assertNotIn('<p>', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0].mimetype, 'text/html')
+        self.assertEqual(EmailOutbox.objects.get().status, OUTBOX_SENT)
+
+    def test_bulk_emails_render_without_queries_and_are_timed(self):
+        users = [create_account(f'payee{i}', balance=i).user for i in range(50)]
+        users = list(User.objects.filter(pk__in=[u.pk for u in users]).select_related('account').order_by('pk'))
+        render_timings.reset()
+        with self.assertNumQueries(1):  # the INSERT
+            queue_transaction_emails(((user, 10) for user in users), 'Deposite Confirmation', 'deposite_email.html')
+        self.assertEqual(render_timings.snapshot()['deposite_email.html']['renders'], 50)
+        email = EmailOutbox.objects.get(to_email='payee7@example.com')
+        self.assertIn('balance is BDT 7', email.text_body)
+        self.assertIn('<h3> Hello Mr.', email.html_body)
+
+    @override_settings(EMAIL_BACKEND='transactions.tests.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_emails_are_retried_then_dead_lettered(self):
+        queued = EmailOutbox.objects.create(to_email='alice@example.com', subject='Test', html_body='<p>x</p>')
+
+        self.assertEqual(deliver_outbox(), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OUTBOX_PENDING)
+        self.assertGreater(queued.next_attempt_at, queued.created_at)
+
+        # Not due yet, so the next run leaves it alone.
+        self.assertEqual(deliver_outbox(), (0, 0))
+
+        EmailOutbox.objects.update(next_attempt_at=queued.created_at)
+        self.assertEqual(deliver_outbox(), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OUTBOX_DEAD)
+        self.assertIn('SMTP server unavailable', queued.last_error)
+
+
+@override_settings(EMAIL_BACKEND='transactions.tests.CountingEmailBackend')
+class DigestTests(TestCase):
+    def setUp(self):
+        self.account = create_account('merchant', balance=0)
+        UserBankAccount.objects.filter(pk=self.account.pk).update(notification_frequency=NOTIFY_HOURLY)
+        self.client.force_login(self.account.user)
+
+    def test_digest_accounts_get_one_email_per_period(self):
+        for amount in ('600', '700', '800'):
+            self.client.post(reverse('deposite'), {'amount': amount})
+        self.assertFalse(EmailOutbox.objects.exists())
+        due = PendingNotification.objects.get(amount=600).digest_at
+        self.assertEqual((due.minute, due.second), (0, 0))
+
+        self.assertEqual(queue_digests(now=due - timedelta(seconds=1)), (0, 0))
+        self.assertEqual(queue_digests(now=due), (1, 3))
+        self.assertFalse(PendingNotification.objects.exists())
+
+        digest = EmailOutbox.objects.get()
+        self.assertEqual(digest.subject, 'Your account activity')
+        self.assertEqual(digest.text_body.count('Deposite Confirmation'), 3)
+        self.assertIn('balance is BDT 2100', digest.text_body)
+
+    def test_immediate_emails_and_delivery_share_a_connection(self):
+        self.client.post(reverse('change_password'), {
+            'old_password': 'pass12345', 'new_password1': 'N3w-secret-pass', 'new_password2': 'N3w-secret-pass',
+        })
+        other = create_account('shopper', balance=0)
+        merchant = User.objects.select_related('account').get(pk=self.account.user_id)
+        queue_transaction_emails([(other.user, 10), (merchant, 10)] * 2, 'Deposite Confirmation', 'deposite_email.html')
+        self.assertEqual(EmailOutbox.objects.count(), 3)  # password change and shopper's two
+        self.assertEqual(PendingNotification.objects.count(), 2)
+
+        CountingEmailBackend.connections = 0
+        call_command('send_outbox_emails', '--batch-size=1', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(CountingEmailBackend.connections, 1)
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class DigestLockingTests(TransactionTestCase):
+    def test_batches_held_by_another_worker_are_skipped(self):
+        due = timezone.now()
+        held, free = create_account('held', balance=0), create_account('free', balance=0)
+        for account in (held, free):
+            PendingNotification.objects.create(user=account.user, subject='Deposite Confirmation', amount=10, digest_at=due)
+
+        # Another worker in the middle of the first user's batch.
+        other = connections.create_connection(connection.alias)
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute(f'SELECT id FROM {PendingNotification._meta.db_table} WHERE user_id = %s FOR UPDATE', [held.user_id])
+            self.assertEqual(queue_digests(now=due, batch_size=1), (1, 1))
+        finally:
+            other.rollback()
+            other.close()
+
+        self.assertEqual(EmailOutbox.objects.get().to_email, free.user.email)
+        self.assertEqual(PendingNotification.objects.get().user_id, held.user_id)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.sender = create_account('sender', balance=1000)
+        self.receiver = create_account('receiver', balance=0)
+
+    def test_transfer_moves_both_balances_and_writes_both_rows(self):
+        out, incoming = ledger.post_many([
+            ledger.Posting(self.sender, Decimal('-600'), TRANSFER_OUT),
+            ledger.Posting(self.receiver, Decimal('600'), TRANSFER_IN),
+        ])
+
+        self.sender.refresh_from_db()
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('400'))
+        self.assertEqual(self.receiver.balance, Decimal('600'))
+        self.assertEqual(out.balance_after_transaction, Decimal('400'))
+        self.assertEqual(incoming.balance_after_transaction, Decimal('600'))
+
+    def test_overdraft_rolls_back_the_whole_posting(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.post_many([
+                ledger.Posting(self.receiver, Decimal('1500'), TRANSFER_IN),
+                ledger.Posting(self.sender, Decimal('-1500'), TRANSFER_OUT),
+            ])
+
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, Decimal('0'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_stale_form_balance_cannot_overdraw(self):
+        self.client.force_login(self.sender.user)
+        UserBankAccount.objects.filter(pk=self.sender.pk).update(balance=100)
+
+        response = self.client.post(reverse('withdraw'), {'amount': '600'})
+
+        self.assertEqual(response.status_code, 200)
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('100'))
+
+    def test_stale_account_copies_do_not_lose_updates(self):
+        # Two requests that loaded the account before either posted.
+        first = UserBankAccount.objects.get(pk=self.sender.pk)
+        second = UserBankAccount.objects.get(pk=self.sender.pk)
+
+        ledger.post(first, Decimal('100'), DEPOSIT)
+        ledger.post(second, Decimal('-1050'), TRANSFER_OUT)
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.post(UserBankAccount.objects.get(pk=self.sender.pk), Decimal('-100'), TRANSFER_OUT)
+
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('50'))
+        entries = LedgerEntry.objects.filter(account=self.sender).values_list('sequence', 'balance')
+        self.assertEqual(list(entries), [(1, 1100), (2, 50)])
+
+    def test_accounts_are_updated_in_primary_key_order(self):
+        # Opposite transfers lock their two rows in the same order.
+        with mock.patch.object(ledger, 'apply_delta', wraps=ledger.apply_delta) as apply_delta:
+            ledger.post_many([
+                ledger.Posting(self.receiver, Decimal('100'), TRANSFER_IN),
+                ledger.Posting(self.sender, Decimal('-100'), TRANSFER_OUT),
+            ])
+            ledger.post_many([
+                ledger.Posting(self.sender, Decimal('50'), TRANSFER_IN),
+                ledger.Posting(self.receiver, Decimal('-50'), TRANSFER_OUT),
+            ])
+
+        locked = [call.args[0].pk for call in apply_delta.call_args_list]
+        self.assertEqual(locked, [self.sender.pk, self.receiver.pk] * 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class LedgerConcurrencyTests(TransactionTestCase):
+    threads = 8
+    postings_per_thread = 25
+
+    def test_concurrent_deposits_are_not_lost(self):
+        account = create_account('busy', balance=0)
+
+        def deposit():
+            try:
+                for _ in range(self.postings_per_thread):
+                    ledger.post(UserBankAccount.objects.get(pk=account.pk), Decimal('10'), DEPOSIT)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=deposit) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        account.refresh_from_db()
+        total = self.threads * self.postings_per_thread
+        self.assertEqual(account.balance, Decimal('10') * total)
+        self.assertEqual(account.transactions.count(), total)
+
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.first = create_account('ledger1', balance=0)
+        self.second = create_account('ledger2', balance=0)
+        ledger.post(self.first, Decimal('1000'), DEPOSIT)
+        ledger.post_many([
+            ledger.Posting(self.first, Decimal('-300'), TRANSFER_OUT),
+            ledger.Posting(self.second, Decimal('300'), TRANSFER_IN),
+        ])
+        ledger.bulk_post([ledger.PostingRow(self.second.account_no, Decimal('50'), WITHDRAWAL)])
+        loans.approve_loans([loans.request_loan(self.second, Decimal('500')).pk])
+
+    def test_entries_carry_sequence_and_running_balance(self):
+        entries = list(LedgerEntry.objects.filter(account=self.second).values_list('sequence', 'amount', 'balance', 'transaction_type'))
+        self.assertEqual(entries, [(1, 300, 300, TRANSFER_IN), (2, -50, 250, WITHDRAWAL), (3, 500, 750, LOAN)])
+        self.assertEqual(UserBankAccount.objects.get(pk=self.second.pk).ledger_sequence, 3)
+        self.assertEqual(reconcile.reconcile(chunk_size=1, workers=1), [])
+
+    def test_reports_tampered_balances_and_entries(self):
+        UserBankAccount.objects.filter(pk=self.first.pk).update(balance=Decimal('999'))
+        # Bypasses the ledger: wrong running balance and a skipped sequence number.
+        LedgerEntry.objects.bulk_create([LedgerEntry(account=self.second, sequence=5, amount=Decimal('10'), balance=Decimal('700'))])
+
+        problems = {(d.account_no, d.problem) for d in reconcile.reconcile(workers=1)}
+        self.assertEqual(problems, {
+            (self.first.account_no, 'account balance'),
+            (self.second.account_no, 'running balance'),
+            (self.second.account_no, 'sequence'),
+            (self.second.account_no, 'account balance'),
+            (self.second.account_no, 'account sequence'),
+        })
+        with self.assertRaisesMessage(CommandError, '5 discrepancies'):
+            call_command('reconcile', '--workers=1', '--database=default', stdout=StringIO())
+
+    def test_entries_are_append_only(self):
+        entry = LedgerEntry.objects.filter(account=self.first).first()
+        with self.assertRaises(TypeError):
+            entry.save()
+        with self.assertRaises(TypeError):
+            LedgerEntry.objects.filter(account=self.first).delete()
+        if connection.vendor == 'postgresql':
+            with self.assertRaises(DatabaseError), transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('UPDATE transactions_ledgerentry SET balance = 0')
+
+
+class VelocityTests(TestCase):
+    rules = [
+        {'rule': 'outgoing_total', 'window': '1h', 'limit': 1500, 'score': 30},
+        {'rule': 'new_receivers', 'window': '1d', 'limit': 1, 'score': 50},
+        {'rule': 'unusual_amount', 'factor': 10, 'min_history': 2, 'score': 30},
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(override_settings(FRAUD_RULES=self.rules, FRAUD_BLOCK_SCORE=70))
+        self.sender = create_account('mover', balance=10000)
+        self.receivers = [create_account(f'payee{i}', balance=0) for i in range(3)]
+        self.client.force_login(self.sender.user)
+
+    def transfer(self, receiver, amount='600'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('transfer_money'), {'account_no': receiver.account_no, 'amount': amount})
+
+    def test_blocks_transfers_once_the_rules_add_up(self):
+        self.transfer(self.receivers[0])
+        self.transfer(self.receivers[1])  # second new receiver: 50
+        state = velocity.state(self.sender.pk, self.receivers[1].pk, time.time())
+        self.assertEqual(state.windows, {('new', 86400): 2, ('out', 3600): 120000})
+        self.assertEqual((state.count, state.total, state.known_receiver), (2, 120000, True))
+
+        # A third new receiver and over 1500 in the hour: 80.
+        with self.assertLogs('transactions.velocity', 'WARNING'):
+            response = self.transfer(self.receivers[2])
+        self.assertContains(response, 'Please contact the bank')
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('8800'))
+
+        # A known receiver still counts the two new ones of the day.
+        assessment = velocity.assess(self.sender.pk, Decimal('100'), self.receivers[0].pk, time.time())
+        self.assertEqual((assessment.score, assessment.blocked), (50, False))
+        with self.assertLogs('transactions.velocity', 'WARNING'):
+            assessment = velocity.assess(self.sender.pk, Decimal('6001'), self.receivers[0].pk, time.time())
+        self.assertEqual(assessment.score, 110)  # over the hourly total and 10x the average too
+
+    def test_rebuild_from_ledger_matches_live_counters(self):
+        self.transfer(self.receivers[0])
+        self.transfer(self.receivers[0], amount='700')
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.post(self.sender, Decimal('500'), WITHDRAWAL)
+        now = time.time()
+        live = velocity.state(self.sender.pk, self.receivers[0].pk, now)
+        self.assertEqual(live, velocity.VelocityState({('new', 86400): 1, ('out', 3600): 180000}, 2, 130000, True))
+
+        cache.clear()
+        out = StringIO()
+        call_command('rebuild_velocity', stdout=out)
+        self.assertIn('rebuilt for 1 accounts', out.getvalue())
+        self.assertEqual(velocity.state(self.sender.pk, self.receivers[0].pk, now), live)
+
+    def test_concurrent_debits_all_count(self):
+        # Folded per account within a batch, atomic increments across them.
+        def entry(receiver):
+            return LedgerEntry(
+                account_id = self.sender.pk,
+                amount = Decimal('-10'),
+                transaction_type = TRANSFER_OUT,
+                counterparty_id = receiver.pk,
+                created_at = timezone.now(),
+            )
+
+        def post():
+            for _ in range(20):
+                velocity.record([entry(self.receivers[0]), entry(self.receivers[1])])
+
+        threads = [threading.Thread(target=post) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        state = velocity.state(self.sender.pk, self.receivers[2].pk, time.time())
+        self.assertEqual(state.windows, {('new', 86400): 2, ('out', 3600): 200000})
+        self.assertEqual((state.count, state.total, state.known_receiver), (200, 200000, False))
+
+
+class BulkPostTests(TestCase):
+    def test_import_postings_aggregates_per_account(self):
+        first = create_account('payroll1', balance=0, account_no=500001)
+        second = create_account('payroll2', balance=100, account_no=500002)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('account_no,amount,type\n')
+            csv_file.write('500001,1000,deposit\n500001,250.50,deposit\n500002,300,withdrawal\n')
+            csv_file.write('999999,10,deposit\n500001,abc,deposit\n')
+        self.addCleanup(os.remove, csv_file.name)
+
+        out = StringIO()
+        call_command('import_postings', csv_file.name, chunk_size=2, stdout=out, stderr=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.balance, Decimal('1250.50'))
+        self.assertEqual(second.balance, Decimal('100'))  # overdraft rejected
+        self.assertEqual(list(first.transactions.values_list('balance_after_transaction', flat=True)), [Decimal('1000'), Decimal('1250.50')])
+        self.assertIn('2 posted, 2 rejected, 1 invalid', out.getvalue())
+
+    def test_import_postings_rejects_amounts_the_column_cannot_hold(self):
+        account = create_account('payroll3', balance=0, account_no=500003)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('account_no,amount,type\n')
+            for amount in ['Infinity', 'NaN', '10000000000', '1.005', '-5', '9999999999.99']:
+                csv_file.write(f'500003,{amount},deposit\n')
+        self.addCleanup(os.remove, csv_file.name)
+
+        out = StringIO()
+        call_command('import_postings', csv_file.name, stdout=out, stderr=StringIO())
+
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('9999999999.99'))
+        self.assertIn('1 posted, 0 rejected, 5 invalid', out.getvalue())
+
+
+class TransactionReportPaginationTests(TestCase):
+    def setUp(self):
+        self.account = create_account('reader', balance=0)
+        self.client.force_login(self.account.user)
+        for _ in range(7):
+            ledger.post(self.account, Decimal('500'), DEPOSIT)
+        # Several rows sharing one timestamp must still page without gaps.
+        first = self.account.transactions.order_by('id').first()
+        self.account.transactions.filter(id__lte=first.id + 3).update(timestamp=first.timestamp)
+
+    def test_opens_on_the_newest_rows_and_walks_both_ways(self):
+        url = reverse('report')
+        query = 'page_size=3'
+        pages = []
+        while query:
+            response = self.client.get(f'{url}?{query}')
+            pages.append([t.id for t in response.context['object_list']])
+            query = response.context['older_page_query']
+
+        expected = list(self.account.transactions.order_by('timestamp', 'id').values_list('id', flat=True))
+        self.assertEqual(pages, [expected[4:], expected[1:4], expected[:1]])
+        self.assertIsNone(self.client.get(f'{url}?page_size=3').context['newer_page_query'])
+
+        response = self.client.get(f'{url}?page_size=3&newer={pagination.encode_cursor(Transaction.objects.get(id=pages[2][0]))}')
+        self.assertEqual([t.id for t in response.context['object_list']], pages[1])
+        self.assertIsNotNone(response.context['newer_page_query'])
+
+
+class StatementExportTests(TestCase):
+    def setUp(self):
+        self.account = create_account('auditor', balance=0)
+        self.client.force_login(self.account.user)
+        ledger.post(self.account, Decimal('500'), DEPOSIT)
+        ledger.post(self.account, Decimal('700'), DEPOSIT)
+
+    def test_streams_csv(self):
+        response = self.client.get(reverse('statement_export'), {'format': 'csv'})
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,transaction_type,amount,balance_after_transaction')
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].endswith(',Deposite,700.00,1200.00'))
+
+    def test_streams_ndjson_within_date_range(self):
+        today = timezone.now().date().isoformat()
+        response = self.client.get(reverse('statement_export'), {'format': 'ndjson', 'start_date': today, 'end_date': today})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['balance_after_transaction'] for row in rows], ['500.00', '1200.00'])
+
+        response = self.client.get(reverse('statement_export'), {'format': 'ndjson', 'start_date': '2000-01-01', 'end_date': '2000-01-31'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_streams_in_keyset_pages_without_server_side_cursors(self):
+        for _ in range(3):
+            ledger.post(self.account, Decimal('100'), DEPOSIT)
+        queryset = Transaction.objects.filter(account=self.account)
+        expected = list(queryset.order_by('timestamp', 'id').values_list('id', 'timestamp'))
+        with mock.patch.dict(connection.settings_dict, {'DISABLE_SERVER_SIDE_CURSORS': True}):
+            with self.assertNumQueries(3):  # pages of 2, 2 and 1 rows
+                self.assertEqual(list(pagination.stream_values(queryset, ['id', 'timestamp'], 2)), expected)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(TRANSACTION_ARCHIVE_DIR=self.archive_dir))
+        self.account = create_account('historian', balance=0)
+        self.other = create_account('bystander', balance=0)
+        self.client.force_login(self.account.user)
+        self.old_month = partitions.add_months(partitions.month_start(timezone.now()), -36)
+        # On PostgreSQL the old rows go to a partition of their own, which
+        # the archive drops.
+        partitions.create_partitions(months_ahead=0, today=self.old_month)
+        for account, amount in ((self.account, '100'), (self.other, '50'), (self.account, '200')):
+            record = ledger.post(account, Decimal(amount), DEPOSIT)
+            Transaction.objects.filter(pk=record.pk).update(timestamp=datetime(self.old_month.year, self.old_month.month, 2, tzinfo=dt_timezone.utc))
+        ledger.post(self.account, Decimal('300'), DEPOSIT)
+        # Fire the deferred FK checks of these inserts, which would otherwise
+        # keep PostgreSQL from dropping the partition in the same transaction.
+        connection.check_constraints()
+
+    def export(self, **params):
+        response = self.client.get(reverse('statement_export'), {'format': 'ndjson', **params})
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_archives_old_months_and_exports_them(self):
+        before = self.export()
+        out = StringIO()
+        call_command('archive_transactions', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().split(), [f'{self.old_month:%Y-%m}'])
+        self.assertEqual(Transaction.objects.count(), 4)
+
+        call_command('archive_transactions', stdout=out)
+
+        self.assertIn('3 transactions in 1 month(s) archived', out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertNotIn(self.old_month, partitions.partitions())
+        self.assertEqual(self.export(), before)
+        self.assertEqual([row['amount'] for row in before], ['100.00', '200.00', '300.00'])
+
+        old_day = date(self.old_month.year, self.old_month.month, 2).isoformat()
+        self.assertEqual([row['amount'] for row in self.export(start_date=old_day, end_date=old_day)], ['100.00', '200.00'])
+
+        rows_path = archive.archive_paths(self.old_month)[0]
+        with gzip.open(rows_path) as rows_file:
+            self.assertEqual(len(rows_file.read().splitlines()), 3)
+
+    def test_rerun_after_partial_archive(self):
+        archive.write_archive(self.old_month)
+        self.assertEqual(archive.archive_month(self.old_month), 3)
+        self.assertEqual(archive.archive_month(self.old_month), 3)  # nothing left to remove
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Transactions are partitioned on PostgreSQL only')
+class PartitionTests(TestCase):
+    def test_rows_land_in_monthly_partitions(self):
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(partitions.create_partitions(months_ahead=3), [])
+        month = partitions.add_months(partitions.month_start(timezone.now()), 4)
+        self.assertEqual(partitions.create_partitions(months_ahead=4), [partitions.partition_name(month)])
+
+        account = create_account('partitioned', balance=0)
+        record = ledger.post(account, Decimal('100'), DEPOSIT)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM transactions_transaction WHERE id = %s', [record.pk])
+            self.assertEqual(cursor.fetchone()[0], partitions.partition_name(partitions.month_start(record.timestamp)))
+
+    def test_admin_count_estimate_sums_the_partitions(self):
+        account = create_account('estimated', balance=0)
+        for _ in range(3):
+            ledger.post(account, Decimal('100'), DEPOSIT)
+        # Autovacuum analyzes the partitions, never the partitioned table.
+        with connection.cursor() as cursor:
+            for name in [*partitions.partitions().values(), partitions.DEFAULT_PARTITION]:
+                cursor.execute(f'ANALYZE {name}')
+        paginator = EstimatedCountPaginator(Transaction.objects.all(), 50)
+        self.assertEqual(paginator.estimated_count(Transaction.objects.all()), 3)
+
+    def test_missed_month_is_moved_out_of_the_default_partition(self):
+        account = create_account('latecomer', balance=0)
+        record = ledger.post(account, Decimal('100'), DEPOSIT)
+        month = partitions.add_months(partitions.month_start(timezone.now()), 5)
+        Transaction.objects.filter(pk=record.pk).update(timestamp=partitions.month_bounds(month)[0] + timedelta(days=2))
+
+        created = partitions.create_partitions(months_ahead=5)
+        self.assertEqual(created, [partitions.partition_name(partitions.add_months(month, -1)), partitions.partition_name(month)])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM transactions_transaction WHERE id = %s', [record.pk])
+            self.assertEqual(cursor.fetchone()[0], partitions.partition_name(month))
+            cursor.execute(f'SELECT COUNT(*) FROM {partitions.DEFAULT_PARTITION}')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            # Attached again.
+            cursor.execute('SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass', [partitions.DEFAULT_PARTITION])
+            self.assertIsNotNone(cursor.fetchone())
+
+
+class DailyBalanceSnapshotTests(TestCase):
+    def setUp(self):
+        self.account = create_account('saver', balance=0)
+        ledger.post(self.account, Decimal('1000'), DEPOSIT)
+        ledger.post(self.account, Decimal('300'), WITHDRAWAL)
+
+    def test_postings_maintain_todays_snapshot(self):
+        snapshot = self.account.daily_balances.get()
+        self.assertEqual(
+            (snapshot.opening_balance, snapshot.closing_balance, snapshot.credits, snapshot.debits),
+            (Decimal('0'), Decimal('700'), Decimal('1000'), Decimal('300')),
+        )
+
+    def test_rebuild_and_range_summary(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        deposit = self.account.transactions.get(transaction_type=DEPOSIT)
+        Transaction.objects.filter(pk=deposit.pk).update(timestamp=deposit.timestamp - timedelta(days=1))
+
+        call_command('rebuild_daily_balances', stdout=StringIO())
+
+        self.assertEqual(
+            list(self.account.daily_balances.values_list('date', 'opening_balance', 'closing_balance')),
+            [(yesterday, Decimal('0'), Decimal('1000')), (today, Decimal('1000'), Decimal('700'))],
+        )
+        summary = snapshots.balance_summary(self.account, today, today)
+        self.assertEqual(summary['opening_balance'], Decimal('1000'))
+        self.assertEqual(summary['closing_balance'], Decimal('700'))
+
+        self.client.force_login(self.account.user)
+        response = self.client.get(reverse('report'), {'start_date': today.isoformat(), 'end_date': today.isoformat()})
+        self.assertEqual(response.context['curr_balance'], Decimal('-300'))
+        self.assertEqual(len(response.context['object_list']), 1)
+
+    def test_rebuild_nets_loans_repaid_in_place(self):
+        # A loan from before repayments were separate postings: credited on
+        # approval, then its own row turned into LOAN_PAID when repaid.
+        Transaction.objects.create(
+            account = self.account,
+            amount = Decimal('5000'),
+            balance_after_transaction = Decimal('700'),
+            transaction_type = LOAN_PAID,
+            loan_approve = True,
+        )
+        call_command('rebuild_daily_balances', stdout=StringIO())
+        snapshot = self.account.daily_balances.get()
+        self.assertEqual(
+            (snapshot.opening_balance, snapshot.closing_balance, snapshot.credits, snapshot.debits),
+            (Decimal('0'), Decimal('700'), Decimal('1000'), Decimal('300')),
+        )
+
+
+    def test_rebuild_starts_at_the_ledger_opening(self):
+        legacy = create_account('legacy', balance=700)
+        opened = timezone.now() - timedelta(hours=1)
+        LedgerEntry.objects.create(account=legacy, sequence=1, amount=Decimal('700'), balance=Decimal('700'), created_at=opened)
+        UserBankAccount.objects.filter(pk=legacy.pk).update(ledger_sequence=1)
+        # History from before the ledger that doesn't add up to its balance.
+        old = Transaction.objects.create(account=legacy, amount=Decimal('9000'), balance_after_transaction=Decimal('0'), transaction_type=DEPOSIT)
+        Transaction.objects.filter(pk=old.pk).update(timestamp=opened - timedelta(days=2))
+        ledger.post(legacy, Decimal('100'), DEPOSIT)
+
+        call_command('rebuild_daily_balances', str(legacy.account_no), stdout=StringIO())
+        self.assertEqual(
+            list(legacy.daily_balances.values_list('date', 'opening_balance', 'closing_balance', 'credits')),
+            [(timezone.localdate(), Decimal('700'), Decimal('800'), Decimal('100'))],
+        )
+
+class InterestTests(TestCase):
+    month = date(2025, 4, 1)
+
+    def setUp(self):
+        self.enterContext(override_settings(INTEREST_RATES={'saving': '0.035'}))
+        # Held 1000 from March, 4650 from April 11th: 10 * 1000 + 20 * 4650.
+        self.saver = create_account('interest1', balance=4650)
+        DailyBalanceSnapshot.objects.create(account=self.saver, date=date(2025, 3, 20), closing_balance=Decimal('1000'))
+        DailyBalanceSnapshot.objects.create(
+            account=self.saver, date=date(2025, 4, 11), opening_balance=Decimal('1000'), closing_balance=Decimal('4650'),
+        )
+        # Opened April 21st with 730 and no activity since: 10 * 730.
+        self.late = create_account('interest2', balance=730)
+        self.current = create_account('interest3', balance=5000)
+        UserBankAccount.objects.filter(pk=self.current.pk).update(account_type='current')
+        UserBankAccount.objects.filter(pk__in=[self.saver.pk, self.current.pk]).update(initial_deposite_date=date(2025, 1, 1))
+        UserBankAccount.objects.filter(pk=self.late.pk).update(initial_deposite_date=date(2025, 4, 21))
+
+    def test_numpy_and_python_agree(self):
+        closings = ([0, 0, 1], [2, 5, 0], [500, 200, 900])
+        args = ([100, 0, 300], [0, 3, 28], closings, 30)
+        expected = [100 * 2 + 500 * 3 + 200 * 25, 900 * 27, 300 * 2]
+        self.assertEqual(interest._balance_days_python(*args), expected)
+        if interest.numpy is not None:
+            self.assertEqual(interest.balance_days(*args, use_numpy=True).tolist(), expected)
+        self.assertEqual(interest.interest_cents(730000, 35000), 70)
+        self.assertEqual(interest.interest_cents(10300000, 35000), 988)  # 987.67
+
+    def test_accrue_credits_the_month_once(self):
+        out = StringIO()
+        call_command('accrue_interest', month='2025-04', dry_run=True, stdout=out, stderr=StringIO())
+        self.assertIn('10.58 interest would be credited to 2 accounts', out.getvalue())
+        self.assertFalse(Transaction.objects.filter(transaction_type=INTEREST).exists())
+
+        with mock.patch('transactions.interest.numpy', None):
+            call_command('accrue_interest', month='2025-04', chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        self.saver.refresh_from_db()
+        self.late.refresh_from_db()
+        self.assertEqual((self.saver.balance, self.late.balance), (Decimal('4659.88'), Decimal('730.70')))
+        credit = self.saver.transactions.get(transaction_type=INTEREST)
+        self.assertEqual((credit.amount, credit.balance_after_transaction), (Decimal('9.88'), Decimal('4659.88')))
+        self.assertEqual(credit.interest_accrual.month, self.month)
+        self.assertEqual(self.saver.ledger_entries.get(transaction_type=INTEREST).balance, Decimal('4659.88'))
+        self.assertFalse(self.current.transactions.exists())
+
+        out = StringIO()
+        call_command('accrue_interest', month='2025-04', stdout=out, stderr=StringIO())
+        self.assertIn('0.00 interest credited to 0 accounts', out.getvalue())
+        self.assertEqual(InterestAccrual.objects.count(), 2)
+
+        with self.assertRaisesMessage(CommandError, 'has not ended yet'):
+            call_command('accrue_interest', month=f'{timezone.localdate():%Y-%m}', stdout=StringIO())
+
+
+class BankStatusCacheTests(TestCase):
+    def setUp(self):
+        bank_status.invalidate()
+        self.addCleanup(bank_status.invalidate)
+        self.account = create_account('cached', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def test_flag_is_cached_and_invalidated_on_save(self):
+        self.assertFalse(bank_status.is_bankrupt())
+        with self.assertNumQueries(0):
+            self.assertFalse(bank_status.is_bankrupt())
+
+        BankSettings.objects.create(is_bankrupt=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(bank_status.is_bankrupt())
+
+        for name in ('withdraw', 'loan_request', 'transfer_money'):
+            self.assertRedirects(self.client.get(reverse(name)), reverse('home'), fetch_redirect_response=False)
+
+        BankSettings.objects.all().delete()
+        self.assertFalse(bank_status.is_bankrupt())
+
+
+class TransactionAdminTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+        self.client.force_login(self.admin)
+        self.accounts = [create_account(f'borrower{i}', balance=100) for i in range(3)]
+        self.loans = [loans.request_loan(account, Decimal('1000')).request_transaction for account in self.accounts]
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        with self.assertQueryBudget('admin changelist', budget=8):
+            self.client.get(url)
+
+    def test_bulk_approve_credits_once_and_queues_emails(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        data = {'action': 'approve_loans', '_selected_action': [loan.pk for loan in self.loans]}
+        self.client.post(url, data)
+        self.client.post(url, data)  # already approved, nothing happens
+
+        for account in self.accounts:
+            account.refresh_from_db()
+            self.assertEqual(account.balance, Decimal('1100'))
+        self.assertTrue(all(Transaction.objects.filter(pk__in=[l.pk for l in self.loans]).values_list('loan_approve', flat=True)))
+        self.assertEqual(EmailOutbox.objects.filter(subject='Loan Approval').count(), 3)
+
+    def test_transactions_are_read_only(self):
+        loan = self.loans[0]
+        self.assertEqual(self.client.get(reverse('admin:transactions_transaction_add')).status_code, 403)
+        url = reverse('admin:transactions_transaction_change', args=[loan.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(url, {'amount': '5000'}).status_code, 403)
+
+        loan.refresh_from_db()
+        self.assertEqual(loan.amount, Decimal('1000'))
+
+
+
+class LoanTests(TestCase):
+    def setUp(self):
+        self.account = create_account('borrower', balance=0)
+        self.client.force_login(self.account.user)
+
+    def request_and_approve(self, amount='1000'):
+        self.client.post(reverse('loan_request'), {'amount': amount})
+        loan = Loan.objects.filter(account=self.account).latest('pk')
+        loans.approve_loans([loan.pk])
+        return loan
+
+    def test_loan_lifecycle_keeps_counter_and_postings(self):
+        loan = self.request_and_approve()
+        loan.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual((loan.status, loan.outstanding), (LOAN_ACTIVE, Decimal('1000')))
+        self.assertEqual((self.account.balance, self.account.active_loan_count), (Decimal('1000'), 1))
+        self.assertTrue(loan.request_transaction.loan_approve)
+
+        self.client.get(reverse('pay_loan', args=[loan.pk]))
+        self.client.get(reverse('pay_loan', args=[loan.pk]))  # double click
+        loan.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual((loan.status, loan.outstanding), (LOAN_REPAID, 0))
+        self.assertEqual((self.account.balance, self.account.active_loan_count), (0, 0))
+        # Repayment is a new posting; the original LOAN row is left alone.
+        self.assertEqual(list(self.account.transactions.order_by('pk').values_list('transaction_type', flat=True)), [LOAN, LOAN_PAID])
+
+    def test_failed_repayment_leaves_the_callers_transaction_usable(self):
+        loan = self.request_and_approve()
+        ledger.post(self.account, Decimal('600'), WITHDRAWAL)
+        with transaction.atomic():
+            with self.assertRaises(ledger.InsufficientFunds):
+                loans.repay_loan(loan.pk, self.account.user)
+            loan.refresh_from_db()
+        self.assertEqual(loan.status, LOAN_ACTIVE)
+
+    def test_limit_is_checked_against_the_counter(self):
+        for _ in range(3):
+            self.request_and_approve()
+        self.client.post(reverse('loan_request'), {'amount': '1000'})
+
+        self.assertEqual(Loan.objects.filter(account=self.account).count(), 3)
+        response = self.client.get(reverse('loan_list'))
+        self.assertEqual(len(response.context['loans']), 3)
+        self.assertContains(response, 'Pay', count=3)
+
+@override_settings(ROOT_URLCONF='bank_management.asgi_urls')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.sender = create_account('async_sender', balance=5000)
+        self.receiver = create_account('async_receiver', balance=0)
+
+    async def test_async_views_move_money_and_queue_emails(self):
+        await self.async_client.aforce_login(self.sender.user)
+
+        response = await self.async_client.post(reverse('deposite'), {'amount': '600'})
+        self.assertRedirects(response, reverse('report'), fetch_redirect_response=False)
+        response = await self.async_client.post(reverse('withdraw'), {'amount': '1000'})
+        self.assertRedirects(response, reverse('report'), fetch_redirect_response=False)
+        response = await self.async_client.post(reverse('transfer_money'), {'account_no': self.receiver.account_no, 'amount': '2000'})
+        self.assertRedirects(response, reverse('report'), fetch_redirect_response=False)
+
+        await self.sender.arefresh_from_db()
+        await self.receiver.arefresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('2600'))
+        self.assertEqual(self.receiver.balance, Decimal('2000'))
+        self.assertEqual(await EmailOutbox.objects.acount(), 4)
+
+        response = await self.async_client.get(reverse('report'), {'page_size': 2})
+        self.assertEqual(len(response.context['object_list']), 2)
+        self.assertEqual(response.context['curr_balance'], Decimal('2600'))
+        self.assertContains(response, 'Balance : 2600')
+
+    async def test_async_retries_with_the_same_key_are_replayed(self):
+        await self.async_client.aforce_login(self.sender.user)
+        for _ in range(2):
+            response = await self.async_client.post(reverse('withdraw'), {'amount': '1000'}, headers={'Idempotency-Key': 'retry-1'})
+            self.assertRedirects(response, reverse('report'), fetch_redirect_response=False)
+        await self.sender.arefresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('4000'))
+
+    async def test_async_views_require_login_and_respect_bankruptcy(self):
+        response = await self.async_client.get(reverse('report'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
+
+        await BankSettings.objects.acreate(is_bankrupt=True)
+        await self.async_client.aforce_login(self.sender.user)
+        response = await self.async_client.post(reverse('withdraw'), {'amount': '1000'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        await self.sender.arefresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('5000'))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.sender = create_account('retrier', balance=5000)
+        self.receiver = create_account('payee', balance=0)
+        self.client.force_login(self.sender.user)
+
+    def test_form_embeds_a_key_and_retries_are_replayed(self):
+        response = self.client.get(reverse('deposite'))
+        key = response.context['idempotency_key']
+        self.assertContains(response, f'name="idempotency_key" value="{key}"')
+
+        for _ in range(3):
+            response = self.client.post(reverse('deposite'), {'amount': '600', 'idempotency_key': key}, follow=True)
+            self.assertContains(response, 'BDT 600 has been successfully deposited')
+
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('5600'))
+        self.assertEqual(self.sender.transactions.count(), 1)
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+
+    def test_header_key_replays_transfer_without_posting_again(self):
+        data = {'account_no': self.receiver.account_no, 'amount': '1000'}
+        self.client.post(reverse('transfer_money'), data, headers={'Idempotency-Key': 'abc-123'})
+        # Session, user, then the key lookup; nothing else is touched.
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('transfer_money'), data, headers={'Idempotency-Key': 'abc-123'})
+        self.assertRedirects(response, reverse('report'), fetch_redirect_response=False)
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, Decimal('1000'))
+
+        # Same key, different request.
+        response = self.client.post(reverse('transfer_money'), dict(data, amount='2000'), headers={'Idempotency-Key': 'abc-123'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_lost_race_replays_the_message_once(self):
+        data = {'amount': '600', 'idempotency_key': 'k2'}
+        self.client.post(reverse('deposite'), data, follow=True)
+        stored = IdempotencyKey.objects.get(key='k2')
+
+        # The retry got past the lookup before the first request stored the
+        # key, so saving it fails and the posting is rolled back.
+        with mock.patch.object(idempotency, 'lookup', side_effect=[None, stored]):
+            response = self.client.post(reverse('deposite'), data, follow=True)
+
+        self.assertEqual([str(m) for m in response.context['messages']], ['BDT 600 has been successfully deposited to your account'])
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('5600'))
+
+    def test_expired_keys_can_be_reused_and_are_purged(self):
+        self.client.post(reverse('withdraw'), {'amount': '500'}, headers={'Idempotency-Key': 'k1'})
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.client.post(reverse('withdraw'), {'amount': '500'}, headers={'Idempotency-Key': 'k1'})
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('4000'))
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
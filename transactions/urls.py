@@ -8,6 +8,7 @@ urlpatterns = [
     path('loan_request/', LoanRequestView.as_view(), name='loan_request'),
     path('loan_list/', LoanListView.as_view(), name='loan_list'),
     path('report/', TransactionReportView.as_view(), name='report'),
+    path('report/export/', StatementExportView.as_view(), name='statement_export'),
     path('loan/<int:loan_id>', PayLoanView.as_view(), name='pay_loan'),
     path('transfer_money', TransferMoneyView.as_view(), name='transfer_money'),
 ]
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""
+Velocity scoring of transfers.
+
+Every debit the ledger posts updates a few per-account counters once its
+transaction commits:
+
+- the money out, and the number of accounts paid for the first time, in
+  buckets of a twelfth of each rule's window,
+- a marker per account paid, so a later transfer to it isn't new, kept
+  ``VELOCITY_STATE_TTL`` from the first payment,
+- the count and sum of its transfers out, for its average transfer.
+
+Counters only ever grow by atomic increments, so concurrent debits on one
+account all count, and a debit costs the same however busy the account is.
+A window's total is the sum of its buckets, including the one it starts
+in: it may count up to a twelfth of the window more than happened, never
+less.
+
+``assess()`` reads the counters back in one cache round trip (no database
+query) and runs the ``FRAUD_RULES`` over them. Each rule that fires adds
+its score; ``TransferMoneyForm`` refuses transfers that reach
+``FRAUD_BLOCK_SCORE``. Rules look like::
+
+    {'rule': 'outgoing_total', 'window': '1h', 'limit': 1000000, 'score': 40}
+    {'rule': 'new_receivers', 'window': '1d', 'limit': 5, 'score': 40}
+    {'rule': 'unusual_amount', 'factor': 10, 'min_history': 5, 'score': 30}
+
+``window`` is ``<count><s|m|h|d>``. Limits include the transfer being
+scored.
+
+The counters are kept in a ``core.ratelimit`` backend: ``VELOCITY_BACKEND``
+``cache`` (the default) shares them through Django's cache, ``memory``
+keeps them per process. They are not persisted, so ``manage.py
+rebuild_velocity`` recomputes them from the ledger after a cache restart.
+That only reaches the web processes through a shared cache (``CACHE_URL``).
+"""
+import logging
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+from functools import partial
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Min, Sum
+from core.ratelimit import PERIODS, CacheBackend, MemoryBackend
+from .constants import TRANSFER_OUT
+from .models import LedgerEntry
+from .reconcile import account_ranges
+
+logger = logging.getLogger('transactions.velocity')
+
+# Buckets per window.
+BUCKETS = 12
+
+OUTGOING = 'out'
+NEW_RECEIVERS = 'new'
+
+# `windows` maps (counter, window) to its total over the window; amounts
+# are in cents. `known_receiver` is whether the account paid the receiver
+# before.
+VelocityState = namedtuple('VelocityState', ['windows', 'count', 'total', 'known_receiver'])
+
+Assessment = namedtuple('Assessment', ['score', 'reasons', 'blocked'])
+
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        _backend = MemoryBackend() if settings.VELOCITY_BACKEND == 'memory' else CacheBackend(prefix='velocity')
+    return _backend
+
+
+def parse_window(window):
+    return int(window[:-1]) * PERIODS[window[-1]]
+
+
+def to_cents(amount):
+    return int(amount * 100)
+
+
+class OutgoingTotal:
+    # Money out within the window.
+    counter = OUTGOING
+
+    def __init__(self, window, limit, score):
+        self.window = parse_window(window)
+        self.limit = limit
+        self.score = score
+        self.reason = f'over {limit} out in {window}'
+
+    def fires(self, state, cents):
+        return state.windows[self.counter, self.window] + cents > self.limit * 100
+
+
+class NewReceivers:
+    # Transfers to accounts paid for the first time within the window.
+    counter = NEW_RECEIVERS
+
+    def __init__(self, window, limit, score):
+        self.window = parse_window(window)
+        self.limit = limit
+        self.score = score
+        self.reason = f'over {limit} new receivers in {window}'
+
+    def fires(self, state, cents):
+        return state.windows[self.counter, self.window] + (not state.known_receiver) > self.limit
+
+
+class UnusualAmount:
+    # A transfer far above the account's average transfer.
+    def __init__(self, factor, min_history, score):
+        self.factor = factor
+        self.min_history = min_history
+        self.score = score
+        self.reason = f'over {factor}x the average transfer'
+
+    def fires(self, state, cents):
+        return state.count >= self.min_history and cents * state.count > self.factor * state.total
+
+
+RULES = {
+    'outgoing_total' : OutgoingTotal,
+    'new_receivers' : NewReceivers,
+    'unusual_amount' : UnusualAmount,
+}
+
+
+def build_rules(config):
+    return [RULES[rule['rule']](**{key: value for key, value in rule.items() if key != 'rule'}) for rule in config]
+
+
+_rules = (None, [])
+
+
+def rules():
+    # FRAUD_RULES built once, and again whenever the setting is replaced.
+    global _rules
+    config = settings.FRAUD_RULES
+    if _rules[0] is not config:
+        _rules = (config, build_rules(config))
+    return _rules[1]
+
+
+def windows(rules):
+    # The (counter, window) pairs the rules read.
+    return sorted({(rule.counter, rule.window) for rule in rules if hasattr(rule, 'counter')})
+
+
+def bucket_width(window):
+    return max(1, window // BUCKETS)
+
+
+def bucket_key(counter, window, account_id, at):
+    return f'{counter}:{window}:{account_id}:{int(at // bucket_width(window))}'
+
+
+def window_keys(counter, window, account_id, now):
+    # The buckets from the one `window` ago to the current one.
+    width = bucket_width(window)
+    return [
+        f'{counter}:{window}:{account_id}:{index}'
+        for index in range(int((now - window) // width), int(now // width) + 1)
+    ]
+
+
+def bucket_ttl(window):
+    return window + bucket_width(window)
+
+
+def paid_key(account_id, receiver_id):
+    return f'paid:{account_id}:{receiver_id}'
+
+
+def record(entries):
+    # Add the debits among `entries` (LedgerEntry) to their accounts'
+    # counters, summed per counter first so a batch costs one increment
+    # per counter it touches.
+    tracked = windows(rules())
+    deltas = defaultdict(int)
+    first_paid = {}
+    for entry in entries:
+        if entry.amount >= 0:
+            continue
+        at = entry.created_at.timestamp()
+        cents = to_cents(-entry.amount)
+        for counter, window in tracked:
+            if counter == OUTGOING:
+                deltas[bucket_key(counter, window, entry.account_id, at), bucket_ttl(window)] += cents
+        if entry.transaction_type == TRANSFER_OUT:
+            deltas[f'count:{entry.account_id}', None] += 1
+            deltas[f'total:{entry.account_id}', None] += cents
+        if entry.counterparty_id is not None:
+            first_paid.setdefault((entry.account_id, entry.counterparty_id), at)
+
+    for (account_id, receiver_id), at in first_paid.items():
+        # add() only succeeds for the first payment to the receiver.
+        if backend().add(paid_key(account_id, receiver_id), 1, settings.VELOCITY_STATE_TTL):
+            for counter, window in tracked:
+                if counter == NEW_RECEIVERS:
+                    deltas[bucket_key(counter, window, account_id, at), bucket_ttl(window)] += 1
+    for (key, ttl), delta in deltas.items():
+        backend().incr(key, delta, ttl)
+
+
+def record_after_commit(entries):
+    # A cache outage is logged rather than failing a posting that committed.
+    transaction.on_commit(partial(record, entries), robust=True)
+
+
+def state(account_id, receiver_id, now):
+    # The account's VelocityState at `now`, read in one round trip.
+    keys = {pair: window_keys(*pair, account_id, now) for pair in windows(rules())}
+    count_key, total_key, paid = f'count:{account_id}', f'total:{account_id}', paid_key(account_id, receiver_id)
+    values = backend().get_many([key for pair_keys in keys.values() for key in pair_keys] + [count_key, total_key, paid])
+    return VelocityState(
+        {pair: sum(values.get(key, 0) for key in pair_keys) for pair, pair_keys in keys.items()},
+        values.get(count_key, 0),
+        values.get(total_key, 0),
+        paid in values,
+    )
+
+
+def assess(account_id, amount, receiver_id, now):
+    """
+    Score a transfer of ``amount`` from ``account_id`` to ``receiver_id``
+    at ``now`` (a Unix time) and return an ``Assessment``.
+    """
+    current = state(account_id, receiver_id, now)
+    score, reasons = 0, []
+    for rule in rules():
+        if rule.fires(current, to_cents(amount)):
+            score += rule.score
+            reasons.append(rule.reason)
+    blocked = score >= settings.FRAUD_BLOCK_SCORE
+    if blocked:
+        logger.warning('Blocked transfer of %s from account %s to %s, score %s: %s', amount, account_id, receiver_id, score, '; '.join(reasons))
+    return Assessment(score, reasons, blocked)
+
+
+def account_counters(start, end, now, tracked):
+    """
+    The counters of a range of account ids rebuilt from the ledger, in three
+    queries, as ``({ttl: {key: value}}, accounts)``.
+    """
+    entries = LedgerEntry.objects.filter(account_id__gte=start, account_id__lt=end)
+    transfers = entries.filter(transaction_type=TRANSFER_OUT)
+    counters = defaultdict(dict)
+    accounts = set()
+
+    stats = transfers.values('account_id').annotate(count=Count('id'), total=Sum('amount')).values_list('account_id', 'count', 'total')
+    for account_id, count, total in stats:
+        counters[None][f'count:{account_id}'] = count
+        counters[None][f'total:{account_id}'] = to_cents(-total)
+        accounts.add(account_id)
+
+    # The receivers first paid within VELOCITY_STATE_TTL, and when.
+    paid_since = datetime.fromtimestamp(now - settings.VELOCITY_STATE_TTL, timezone.utc)
+    pairs = (
+        entries.filter(amount__lt=0, counterparty__isnull=False).values('account_id', 'counterparty_id')
+        .annotate(first=Min('created_at')).filter(first__gt=paid_since)
+        .values_list('account_id', 'counterparty_id', 'first')
+    )
+    for account_id, receiver_id, first in pairs:
+        counters[int(first.timestamp() + settings.VELOCITY_STATE_TTL - now)][paid_key(account_id, receiver_id)] = 1
+        for counter, window in tracked:
+            if counter == NEW_RECEIVERS and first.timestamp() > now - bucket_ttl(window):
+                key = bucket_key(counter, window, account_id, first.timestamp())
+                counters[bucket_ttl(window)][key] = counters[bucket_ttl(window)].get(key, 0) + 1
+        accounts.add(account_id)
+
+    keep = max((bucket_ttl(window) for counter, window in tracked if counter == OUTGOING), default=0)
+    debits = (
+        entries.filter(amount__lt=0, created_at__gt=datetime.fromtimestamp(now - keep, timezone.utc))
+        .values_list('account_id', 'created_at', 'amount')
+    )
+    for account_id, created_at, amount in debits:
+        for counter, window in tracked:
+            if counter == OUTGOING and created_at.timestamp() > now - bucket_ttl(window):
+                key = bucket_key(counter, window, account_id, created_at.timestamp())
+                counters[bucket_ttl(window)][key] = counters[bucket_ttl(window)].get(key, 0) + to_cents(-amount)
+        accounts.add(account_id)
+    return counters, accounts
+
+
+def rebuild(chunk_size=10000, now=None):
+    """
+    Recompute every account's counters from the ledger, ``chunk_size``
+    account ids at a time, and return how many accounts have any.
+    """
+    now = now or time.time()
+    tracked = windows(rules())
+    stored = 0
+    for start, end in account_ranges(chunk_size, DEFAULT_DB_ALIAS):
+        counters, accounts = account_counters(start, end, now, tracked)
+        for ttl, values in counters.items():
+            backend().set_many(values, ttl)
+        stored += len(accounts)
+    return stored
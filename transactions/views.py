@@ -1,31 +1,30 @@
+import csv
+import json
+import itertools
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.views.generic import ListView, CreateView
 from django.views import View
-from .models import Transaction, BankSettings
+from django.views.generic.base import ContextMixin
+from .models import Loan, Transaction
 from .forms import *
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.urls import reverse_lazy
-from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, TRANSFER_IN, TRANSFER_OUT
+from django.urls import reverse, reverse_lazy
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, TRANSFER_IN, TRANSFER_OUT, TRANSACTION_TYPE, MAX_ACTIVE_LOANS
 from django.contrib import messages
 from datetime import datetime
-from django.db.models import Sum
-from django.core.mail import EmailMessage, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.db import router, transaction
+from django.conf import settings
+from .emails import send_transaction_email
+from . import archive, idempotency, ledger, loans
+from .mixins import BankNotBankruptMixin, IdempotentPostMixin
+from .pagination import akeyset_paginate, keyset_paginate, stream_values
+from .snapshots import abalance_summary, balance_summary, date_range_filter
+from core.mixins import AsyncLoginRequiredMixin
 
 # Create your views here.
 
-def send_transaction_email(user, amount, subject, template):
-    mail_subject = 'Deposite Confirmation'
-    message = render_to_string(template, { 
-        'user' : user, 
-        'amount' : amount, 
-    })
-    to_email = user.email
-    send_mail = EmailMultiAlternatives(subject, '', to=[to_email])
-    send_mail.attach_alternative(message, 'text/html')
-    send_mail.send()
-
-
 class TransactionCreateView(LoginRequiredMixin, CreateView):
     model = Transaction
     template_name = 'transaction_form.html'
@@ -47,7 +46,7 @@ class TransactionCreateView(LoginRequiredMixin, CreateView):
         })
         return context
     
-class DepositeView(TransactionCreateView):
+class DepositeView(IdempotentPostMixin, TransactionCreateView):
     form_class = DepositeForm
     title = 'Deposite BDT'
 
@@ -59,27 +58,21 @@ class DepositeView(TransactionCreateView):
         return initial
     
     def form_valid(self, form):
-        print(self.request.POST)
         amount = form.cleaned_data.get('amount')
-        account = self.request.user.account
-        account.balance += amount
-        account.save(update_fields = ['balance'])
-        messages.success(self.request, f'BDT {amount} has been successfully deposited to your account')
-        send_transaction_email(self.request.user, amount, 'Deposite Confirmation', 'deposite_email.html')
-        return super().form_valid(form)
-
-class WithdrawMoney(TransactionCreateView):
+        message = f'BDT {amount} has been successfully deposited to your account'
+        with transaction.atomic():
+            self.object = ledger.post(self.request.user.account, amount, DEPOSIT)
+            send_transaction_email(self.request.user, amount, 'Deposite Confirmation', 'deposite_email.html')
+            idempotency.save(self.request, self.get_success_url(), message)
+        # Only once the key is stored: a retry that stored it first rolls
+        # this posting back and replays its own message.
+        messages.success(self.request, message)
+        return redirect(self.get_success_url())
+
+class WithdrawMoney(BankNotBankruptMixin, IdempotentPostMixin, TransactionCreateView):
     form_class = WithdrawForm
     title = 'Withdraw BDT'
-
-    def dispatch(self, request, *args, **kwargs):
-        # Dynamically check if the bank is bankrupt
-        bank_settings = BankSettings.objects.first()
-        if bank_settings and bank_settings.is_bankrupt:
-            messages.error(request, "The bank is currently bankrupt. WithDrawn are not allowed.")
-            return redirect('home')  # Redirect to a safe page
-        return super().dispatch(request, *args, **kwargs)
-    
+    bankrupt_message = "The bank is currently bankrupt. WithDrawn are not allowed."
 
     def get_initial(self):
         initial = super().get_initial()
@@ -90,24 +83,22 @@ class WithdrawMoney(TransactionCreateView):
     
     def form_valid(self, form):
         amount = form.cleaned_data['amount']
-        account = self.request.user.account
-        account.balance -= amount
-        account.save(update_fields = ['balance'])
-        messages.success(self.request, f'BDT {amount} has been successfully withdarw from your account')
-        send_transaction_email(self.request.user, amount, 'Withdrawl Confirmation', 'withdrawal.html')
-        return super().form_valid(form)
+        message = f'BDT {amount} has been successfully withdarw from your account'
+        try:
+            with transaction.atomic():
+                self.object = ledger.post(self.request.user.account, amount, WITHDRAWAL)
+                send_transaction_email(self.request.user, amount, 'Withdrawl Confirmation', 'withdrawal.html')
+                idempotency.save(self.request, self.get_success_url(), message)
+        except ledger.InsufficientFunds:
+            form.add_error('amount', 'Insufficient balance')
+            return self.form_invalid(form)
+        messages.success(self.request, message)
+        return redirect(self.get_success_url())
     
-class LoanRequestView(TransactionCreateView):
+class LoanRequestView(BankNotBankruptMixin, TransactionCreateView):
     form_class = LoanRequestForm
     title = 'Requesting for Loan'
-
-    def dispatch(self, request, *args, **kwargs):
-        # Dynamically check if the bank is bankrupt
-        bank_settings = BankSettings.objects.first()
-        if bank_settings and bank_settings.is_bankrupt:
-            messages.error(request, "The bank is currently bankrupt. Loan Request View not allowed.")
-            return redirect('home')  # Redirect to a safe page
-        return super().dispatch(request, *args, **kwargs)
+    bankrupt_message = "The bank is currently bankrupt. Loan Request View not allowed."
 
     def get_initial(self):
         initial = super().get_initial()
@@ -116,90 +107,186 @@ class LoanRequestView(TransactionCreateView):
         })
         return initial
     
+    @transaction.atomic
     def form_valid(self, form):
         amount = form.cleaned_data['amount']
-        current_loan_count = Transaction.objects.filter(account = self.request.user.account, transaction_type = LOAN, loan_approve = True).count()
-        if current_loan_count >= 3:
-            messages.error(self.request, 'You have already 3 active loans, first return them to get another loan')
+        # Counter kept by transactions.loans, no need to count loans here.
+        if self.request.user.account.active_loan_count >= MAX_ACTIVE_LOANS:
+            messages.error(self.request, f'You have already {MAX_ACTIVE_LOANS} active loans, first return them to get another loan')
             return super().form_invalid(form)
+        self.object = loans.request_loan(self.request.user.account, amount).request_transaction
         messages.success(self.request, f'BDT {amount} of loan Request has been sent to the bank authority')
         send_transaction_email(self.request.user, amount, 'Loan Application Status', 'loan_application.html')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
+
+def get_date_range(request):
+    # Returns the (start_date, end_date) filter from the query string, or None.
+    start_date_str = request.GET.get('start_date')
+    end_date_str = request.GET.get('end_date')
+
+    if start_date_str and end_date_str:
+        return (
+            datetime.strptime(start_date_str, '%Y-%m-%d').date(),
+            datetime.strptime(end_date_str, '%Y-%m-%d').date(),
+        )
+    return None
+
 
 class TransactionReportView(LoginRequiredMixin, ListView):
     model = Transaction
     template_name = 'transaction_report.html'
-    balance = 0
+    date_range = None
 
     def get_queryset(self):
         queryset = super().get_queryset().filter(account = self.request.user.account)
 
-        start_date_str = self.request.GET.get('start_date')
-        end_date_str = self.request.GET.get('end_date')
-
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+        self.date_range = get_date_range(self.request)
 
-            queryset = queryset.filter(timestamp__date__gte = start_date, timestamp__date__lte = end_date)
+        if self.date_range:
+            queryset = queryset.filter(**date_range_filter(*self.date_range))
 
-            self.balance =  self.balance = queryset.aggregate(Sum('amount'))['amount__sum'] or 0
-        else:
-            self.balance = self.request.user.account.balance
+        return queryset
 
-        return queryset.distinct()
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', settings.REPORT_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.REPORT_PAGE_SIZE
+        return max(1, min(page_size, settings.REPORT_MAX_PAGE_SIZE))
+
+    def get_page_kwargs(self):
+        return {
+            'older' : self.request.GET.get('older'),
+            'newer' : self.request.GET.get('newer'),
+            'page_size' : self.get_page_size(),
+        }
+
+    def page_query(self, **cursor):
+        query = self.request.GET.copy()
+        query.pop('older', None)
+        query.pop('newer', None)
+        query.update(cursor)
+        return query.urlencode()
 
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+        summary = balance_summary(self.request.user.account, *self.date_range) if self.date_range else None
+        page = keyset_paginate(self.object_list, **self.get_page_kwargs())
+        return self.get_report_context(page, summary, **kwargs)
+
+    def get_report_context(self, page, summary, **kwargs):
+        if summary:
+            balance = summary['closing_balance'] - summary['opening_balance']
+        else:
+            balance = self.request.user.account.balance
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
         context.update({
             'account' : self.request.user.account,
-            'curr_balance' : self.balance
+            'curr_balance' : balance,
+            'summary' : summary,
+            'export_query' : self.page_query(),
+            'older_page_query' : page.older_cursor and self.page_query(older=page.older_cursor),
+            'newer_page_query' : page.newer_cursor and self.page_query(newer=page.newer_cursor),
         })
         return context
 
 
+class Echo:
+    # File-like object for csv.writer that hands each line straight back.
+    def write(self, value):
+        return value
+
+
+class StatementExportView(LoginRequiredMixin, View):
+    columns = ['id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction']
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return HttpResponseBadRequest('Unsupported format, use csv or ndjson')
+        try:
+            date_range = get_date_range(request)
+        except ValueError:
+            return HttpResponseBadRequest('Dates must be in YYYY-MM-DD format')
+
+        # Bound now: the rows are read while streaming, after the view (and
+        # ReadReplicaMiddleware's replica routing) has returned.
+        queryset = Transaction.objects.using(router.db_for_read(Transaction)).filter(account = request.user.account)
+        bounds = {}
+        if date_range:
+            bounds = date_range_filter(*date_range)
+            queryset = queryset.filter(**bounds)
+        # Rows are streamed as tuples without building model instances, so
+        # memory stays flat. Archived months come first: they are older than
+        # anything still in the table.
+        rows = itertools.chain(
+            archive.archived_rows(request.user.account.pk, self.columns, bounds.get('timestamp__gte'), bounds.get('timestamp__lt')),
+            stream_values(queryset, self.columns, settings.STATEMENT_EXPORT_CHUNK_SIZE),
+        )
+
+        if export_format == 'csv':
+            content = self.csv_lines(rows)
+            content_type = 'text/csv'
+        else:
+            content = self.ndjson_lines(rows)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="statement-{request.user.account.account_no}.{export_format}"'
+        return response
+
+    def csv_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.columns)
+        types = dict(TRANSACTION_TYPE)
+        for pk, timestamp, transaction_type, amount, balance in rows:
+            yield writer.writerow([pk, timestamp.isoformat(), types.get(transaction_type, ''), amount, balance])
+
+    def ndjson_lines(self, rows):
+        types = dict(TRANSACTION_TYPE)
+        for pk, timestamp, transaction_type, amount, balance in rows:
+            yield json.dumps({
+                'id' : pk,
+                'timestamp' : timestamp.isoformat(),
+                'transaction_type' : types.get(transaction_type, ''),
+                'amount' : str(amount),
+                'balance_after_transaction' : str(balance),
+            }) + '\n'
+
+
 class PayLoanView(LoginRequiredMixin, View):
+    @transaction.atomic
     def get(self, request, loan_id):
-        loan = get_object_or_404(Transaction, id=loan_id)
-
-        if loan.loan_approve:
-            user_account = loan.account
-            if loan.amount < user_account.balance:
-                user_account.balance -= loan.amount
-                loan.balance_after_transaction = user_account.balance
-                user_account.save()
-                loan.transaction_type = LOAN_PAID
-                loan.save()
-                messages.success(request, 'Loan has been successfully paid')
-                send_transaction_email(self.request.user, loan.amount, 'Loan Repayment Confirmation', 'loan_confirmation.html')
-                return redirect('report')
-            else:
-                messages.error(request, 'You do not have sufficient balance to pay the loan')
-                return redirect('report')
+        # repay_loan locks the loan so a double click can't repay it twice.
+        try:
+            loan = loans.repay_loan(loan_id, request.user)
+        except loans.LoanNotActive:
+            get_object_or_404(Loan, id=loan_id, account__user=request.user)
+            messages.error(request, 'This loan is not active')
+            return redirect('loan_list')
+        except ledger.InsufficientFunds:
+            messages.error(request, 'You do not have sufficient balance to pay the loan')
+            return redirect('report')
+        messages.success(request, 'Loan has been successfully paid')
+        send_transaction_email(self.request.user, loan.principal, 'Loan Repayment Confirmation', 'loan_confirmation.html')
+        return redirect('report')
 
 
 class LoanListView(LoginRequiredMixin, ListView):
-    model = Transaction
+    model = Loan
     template_name = 'loan_request.html'
     context_object_name = 'loans'
 
     def get_queryset(self):
         user_account = self.request.user.account
-        queryset = super().get_queryset().filter(account = user_account, transaction_type = LOAN)
+        queryset = super().get_queryset().filter(account = user_account)
         return queryset
 
 
-class TransferMoneyView(LoginRequiredMixin, View):
+class TransferMoneyView(BankNotBankruptMixin, LoginRequiredMixin, IdempotentPostMixin, ContextMixin, View):
     template_name = 'transfer_money.html'
     title = "Transfer Money"
-
-    def dispatch(self, request, *args, **kwargs):
-        # Dynamically check if the bank is bankrupt
-        bank_settings = BankSettings.objects.first()
-        if bank_settings and bank_settings.is_bankrupt:
-            messages.error(request, "The bank is currently bankrupt. Transfer Money is not allowed.")
-            return redirect('home')  # Redirect to a safe page
-        return super().dispatch(request, *args, **kwargs)
+    bankrupt_message = "The bank is currently bankrupt. Transfer Money is not allowed."
+    success_message = 'Money has been successfully transferred'
 
     def get_initial(self):
         initial = super().get_initial()
@@ -207,19 +294,123 @@ class TransferMoneyView(LoginRequiredMixin, View):
             'transaction_type' : TRANSFER_OUT
         })
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'title' : self.title
+        })
+        return context
+
     def get(self, request):
         form = TransferMoneyForm(sender_account = request.user.account)
-        return render(request, self.template_name, {'form' : form, 'title' : self.title})
+        return render(request, self.template_name, self.get_context_data(form = form))
     
     def post(self, request):
         form = TransferMoneyForm(request.POST, sender_account = request.user.account)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Money has been successfully transferred')
-            receiver_account = form.receiver_account
-            send_transaction_email(request.user, form.cleaned_data['amount'], "Transfer Confirmation", 'transfer_email.html')
-            send_transaction_email(receiver_account.user, form.cleaned_data['amount'], "Transfer Confirmation", 'transfer_email.html')
-            return redirect('report')
-        return render(request, self.template_name, {'form' : form, 'title' : self.title})
+            try:
+                with transaction.atomic():
+                    form.save()
+                    receiver_account = form.receiver_account
+                    send_transaction_email(request.user, form.cleaned_data['amount'], "Transfer Confirmation", 'transfer_email.html')
+                    send_transaction_email(receiver_account.user, form.cleaned_data['amount'], "Transfer Confirmation", 'transfer_email.html')
+                    idempotency.save(request, reverse('report'), self.success_message)
+            except ledger.InsufficientFunds:
+                form.add_error('amount', 'Insufficient balance')
+            else:
+                messages.success(request, self.success_message)
+                return redirect('report')
+        return render(request, self.template_name, self.get_context_data(form = form))
+
+
+# Async versions of the busiest views, served by bank_management.asgi_urls.
+# The async ORM has no transactions, so each posting still runs as one
+# atomic block in a worker thread; the outbox row for its email is
+# written in the same block and SMTP happens later in send_outbox_emails.
+# So is the idempotency key, as in the sync views.
+
+@sync_to_async
+@transaction.atomic
+def post_and_notify(request, amount, transaction_type, email, location, message):
+    posted = ledger.post(request.user.account, amount, transaction_type)
+    send_transaction_email(request.user, amount, *email)
+    idempotency.save(request, location, message)
+    return posted
+
+
+@sync_to_async
+@transaction.atomic
+def transfer_and_notify(request, form, message):
+    form.save()
+    amount = form.cleaned_data['amount']
+    send_transaction_email(form.sender_account.user, amount, "Transfer Confirmation", 'transfer_email.html')
+    send_transaction_email(form.receiver_account.user, amount, "Transfer Confirmation", 'transfer_email.html')
+    idempotency.save(request, reverse('report'), message)
 
 
+class AsyncTransactionCreateMixin(AsyncLoginRequiredMixin):
+    http_method_names = ['get', 'post', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        self.object = None
+        return self.render_to_response(self.get_context_data())
+
+    async def post(self, request, *args, **kwargs):
+        self.object = None
+        form = self.get_form()
+        if form.is_valid():
+            return await self.aform_valid(form)
+        return self.form_invalid(form)
+
+
+class AsyncDepositeView(AsyncTransactionCreateMixin, DepositeView):
+    async def aform_valid(self, form):
+        amount = form.cleaned_data.get('amount')
+        message = f'BDT {amount} has been successfully deposited to your account'
+        self.object = await post_and_notify(
+            self.request, amount, DEPOSIT, ('Deposite Confirmation', 'deposite_email.html'), str(self.success_url), message,
+        )
+        messages.success(self.request, message)
+        return redirect(self.get_success_url())
+
+
+class AsyncWithdrawMoney(AsyncTransactionCreateMixin, WithdrawMoney):
+    async def aform_valid(self, form):
+        amount = form.cleaned_data['amount']
+        message = f'BDT {amount} has been successfully withdarw from your account'
+        try:
+            self.object = await post_and_notify(
+                self.request, amount, WITHDRAWAL, ('Withdrawl Confirmation', 'withdrawal.html'), str(self.success_url), message,
+            )
+        except ledger.InsufficientFunds:
+            form.add_error('amount', 'Insufficient balance')
+            return self.form_invalid(form)
+        messages.success(self.request, message)
+        return redirect(self.get_success_url())
+
+
+class AsyncTransactionReportView(AsyncLoginRequiredMixin, TransactionReportView):
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        summary = await abalance_summary(request.user.account, *self.date_range) if self.date_range else None
+        page = await akeyset_paginate(self.object_list, **self.get_page_kwargs())
+        return self.render_to_response(self.get_report_context(page, summary))
+
+
+class AsyncTransferMoneyView(AsyncLoginRequiredMixin, TransferMoneyView):
+    async def get(self, request):
+        form = TransferMoneyForm(sender_account = request.user.account)
+        return render(request, self.template_name, self.get_context_data(form = form))
+
+    async def post(self, request):
+        form = TransferMoneyForm(request.POST, sender_account = request.user.account)
+        # Validation looks up the receiving account.
+        if await sync_to_async(form.is_valid)():
+            try:
+                await transfer_and_notify(request, form, self.success_message)
+            except ledger.InsufficientFunds:
+                form.add_error('amount', 'Insufficient balance')
+            else:
+                messages.success(request, self.success_message)
+                return redirect('report')
+        return render(request, self.template_name, self.get_context_data(form = form))